@@ -0,0 +1,371 @@
+#!/usr/bin/python3
+"""Encoder throughput benchmark for the video.py conversion pipeline.
+
+Synthetic GoPro-like clips are generated with ffmpeg's lavfi sources and pushed
+through ``video.convertVideos`` for every requested CPU codec/preset combination.
+Wall time, CPU time, encoding fps, output size and compression ratio are reported
+as a table and optionally written as JSON for regression tracking.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import video
+
+logger = logging.getLogger(__name__)
+
+RESOLUTIONS = {
+    "1080": (1920, 1080),
+    "1520": (2704, 1520),
+    "2160": (3840, 2160),
+}
+PATTERNS = ["testsrc2", "mandelbrot"]
+CPU_CODECS = ["h265", "h264", "av1"]
+DEFAULT_PRESETS = video.ENCODER_PRESETS
+CLIP_FRAMERATE = 60
+CLIP_DURATION = 10.0
+# Sources are written with a near-lossless fast encode so they resemble the high
+# bitrate footage straight off a camera card.
+SOURCE_ENCODER_ARGS = ["-c:v", "libx264", "-preset", "ultrafast", "-qp", "12"]
+ORGANIZER_CHAPTERS = 4  # Chapters per synthetic sequence in the organizer benchmark.
+
+
+def csv_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def arguments(argv=None):
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the GoPro video compressor encoders on synthetic footage",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-w",
+        "--work-dir",
+        type=str,
+        default=None,
+        help="Directory for generated clips and outputs (default: a temporary directory)",
+    )
+    parser.add_argument(
+        "-r",
+        "--resolutions",
+        type=csv_list,
+        default=list(RESOLUTIONS),
+        help="Comma-separated clip heights to benchmark",
+    )
+    parser.add_argument(
+        "--patterns",
+        type=csv_list,
+        default=PATTERNS,
+        help="Comma-separated lavfi sources used to generate clips",
+    )
+    parser.add_argument(
+        "-c",
+        "--codecs",
+        type=csv_list,
+        default=CPU_CODECS,
+        help="Comma-separated CPU codecs to benchmark",
+    )
+    parser.add_argument(
+        "-p",
+        "--presets",
+        type=csv_list,
+        default=DEFAULT_PRESETS,
+        help="Comma-separated encoder presets to benchmark",
+    )
+    parser.add_argument(
+        "-d",
+        "--duration",
+        type=float,
+        default=CLIP_DURATION,
+        help="Length of each synthetic clip in seconds",
+    )
+    parser.add_argument("--json", type=str, default=None, help="Write results as JSON to this file")
+    parser.add_argument(
+        "--organizer-files",
+        type=int,
+        default=None,
+        help="Only benchmark the organizer on this many synthetic chapter files",
+    )
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Keep the generated clips and outputs in the work directory",
+    )
+    args = parser.parse_args(argv)
+    config = vars(args)
+    return config
+
+
+def validate_config(config):
+    unknown = [height for height in config["resolutions"] if height not in RESOLUTIONS]
+    if unknown:
+        raise video.VideoConversionError(f"Unsupported benchmark resolution(s): {unknown}")
+    unknown = [pattern for pattern in config["patterns"] if pattern not in PATTERNS]
+    if unknown:
+        raise video.VideoConversionError(f"Unsupported lavfi pattern(s): {unknown}")
+    unknown = [codec for codec in config["codecs"] if codec not in CPU_CODECS]
+    if unknown:
+        raise video.VideoConversionError(f"Unsupported benchmark codec(s): {unknown}")
+    unknown = [preset for preset in config["presets"] if preset not in video.ENCODER_PRESETS]
+    if unknown:
+        raise video.VideoConversionError(f"Unsupported encoder preset(s): {unknown}")
+    if config["duration"] <= 0:
+        raise video.VideoConversionError("Clip duration must be positive")
+    if config["organizer_files"] is not None and config["organizer_files"] <= 0:
+        raise video.VideoConversionError("Organizer file count must be positive")
+
+
+def clip_command(pattern, width, height, duration, destination):
+    """Return the ffmpeg argv that renders a synthetic clip with video and audio."""
+    return [
+        "ffmpeg",
+        "-y",
+        "-v",
+        "error",
+        "-f",
+        "lavfi",
+        "-i",
+        f"{pattern}=size={width}x{height}:rate={CLIP_FRAMERATE}",
+        "-f",
+        "lavfi",
+        "-i",
+        "sine=frequency=440:sample_rate=48000",
+        "-t",
+        f"{duration:g}",
+        "-map",
+        "0:v",
+        "-map",
+        "1:a",
+        *SOURCE_ENCODER_ARGS,
+        "-pix_fmt",
+        "yuv420p",
+        "-c:a",
+        "aac",
+        "-b:a",
+        "192k",
+        destination,
+    ]
+
+
+def generate_clips(work_dir, resolutions, patterns, duration):
+    """Render one clip per resolution/pattern, each in its own sequence folder."""
+    clips = []
+    number = 1
+    for resolution in resolutions:
+        width, height = RESOLUTIONS[resolution]
+        for pattern in patterns:
+            sequence = f"{number:04d}"
+            sequence_dir = os.path.join(work_dir, sequence)
+            os.makedirs(sequence_dir, exist_ok=True)
+            source = os.path.join(sequence_dir, f"GH01{sequence}.MP4")
+            if not os.path.exists(source):
+                logger.info("Generating %sp %s clip", resolution, pattern)
+                try:
+                    subprocess.run(
+                        clip_command(pattern, width, height, duration, source), check=True
+                    )
+                except (OSError, subprocess.CalledProcessError) as exc:
+                    raise video.VideoConversionError(
+                        f"Failed to generate synthetic clip '{source}': {exc}"
+                    ) from exc
+            clips.append(
+                {
+                    "sequence": sequence,
+                    "resolution": resolution,
+                    "pattern": pattern,
+                    "source": source,
+                    "frames": int(round(duration * CLIP_FRAMERATE)),
+                }
+            )
+            number += 1
+    return clips
+
+
+def children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def benchmark_clip(work_dir, clip, codec, preset):
+    """Convert ``clip`` once with ``codec``/``preset`` through the real pipeline."""
+    output = os.path.join(work_dir, os.path.basename(clip["source"]))
+    options = video.getOptions(codec, "cpu")
+    cpu_before = children_cpu_time()
+    started = time.perf_counter()
+    video.convertVideos(
+        work_dir,
+        options,
+        0.12,
+        25,
+        0.70,
+        True,
+        sequences=[clip["sequence"]],
+        codec=codec,
+        auto_copy=False,
+        preset=preset,
+    )
+    wall_time = time.perf_counter() - started
+    cpu_time = children_cpu_time() - cpu_before
+    source_size = os.path.getsize(clip["source"])
+    output_size = os.path.getsize(output)
+    os.unlink(output)
+    return {
+        "resolution": clip["resolution"],
+        "pattern": clip["pattern"],
+        "codec": codec,
+        "preset": preset,
+        "frames": clip["frames"],
+        "wall_time": round(wall_time, 3),
+        "cpu_time": round(cpu_time, 3),
+        "fps": round(clip["frames"] / wall_time, 2) if wall_time else None,
+        "source_size": source_size,
+        "output_size": output_size,
+        "compression_ratio": round(source_size / output_size, 3) if output_size else None,
+    }
+
+
+def format_table(results):
+    columns = [
+        ("resolution", "res"),
+        ("pattern", "pattern"),
+        ("codec", "codec"),
+        ("preset", "preset"),
+        ("fps", "fps"),
+        ("wall_time", "wall s"),
+        ("cpu_time", "cpu s"),
+        ("output_size", "bytes"),
+        ("compression_ratio", "ratio"),
+    ]
+    rows = [[str(result[key]) for key, _ in columns] for result in results]
+    widths = [
+        max(len(header), *(len(row[index]) for row in rows)) if rows else len(header)
+        for index, (_, header) in enumerate(columns)
+    ]
+    lines = [
+        "  ".join(header.ljust(width) for (_, header), width in zip(columns, widths, strict=True))
+    ]
+    lines.append("  ".join("-" * width for width in widths))
+    for row in rows:
+        lines.append("  ".join(cell.ljust(width) for cell, width in zip(row, widths, strict=True)))
+    return "\n".join(lines)
+
+
+def organizer_filenames(count):
+    """Return ``count`` GoPro chapter names, ORGANIZER_CHAPTERS per sequence."""
+    names = []
+    for number in range(count):
+        sequence, chapter = divmod(number, ORGANIZER_CHAPTERS)
+        prefix = "GX" if sequence % 2 else "GH"
+        names.append(f"{prefix}{chapter + 1:02d}{sequence % 10000:04d}.MP4")
+    return names
+
+
+def benchmark_organizer(work_dir, count):
+    """Time one scan and organize pass over ``count`` empty chapter files."""
+    for name in organizer_filenames(count):
+        with open(os.path.join(work_dir, name), "wb"):
+            pass
+    started = time.perf_counter()
+    contents = video.scan_loose_chapters(work_dir)
+    scanned = time.perf_counter()
+    sequences = video.videostofolders(contents, work_dir)
+    finished = time.perf_counter()
+    return {
+        "files": len(contents),
+        "sequences": len(sequences),
+        "scan_time": round(scanned - started, 3),
+        "organize_time": round(finished - scanned, 3),
+        "files_per_second": round(len(contents) / (finished - started), 1),
+    }
+
+
+def run_organizer_benchmark(config):
+    validate_config(config)
+    work_dir = config["work_dir"] or tempfile.mkdtemp(prefix="video-benchmark-")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        result = benchmark_organizer(work_dir, config["organizer_files"])
+    finally:
+        if not config["keep"]:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {"created": time.time(), "host": platform.node(), "organizer": result}
+
+
+def ffmpeg_version():
+    try:
+        result = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.splitlines()[0] if result.stdout else None
+
+
+def run_benchmark(config):
+    validate_config(config)
+    missing = [tool for tool in ("ffmpeg", "ffprobe", "exiftool") if not shutil.which(tool)]
+    if missing:
+        raise video.VideoConversionError(f"Benchmark requires {', '.join(missing)} on PATH")
+
+    work_dir = config["work_dir"] or tempfile.mkdtemp(prefix="video-benchmark-")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        clips = generate_clips(
+            work_dir, config["resolutions"], config["patterns"], config["duration"]
+        )
+        results = []
+        for clip in clips:
+            for codec in config["codecs"]:
+                for preset in config["presets"]:
+                    logger.info(
+                        "Benchmarking %sp %s with %s/%s",
+                        clip["resolution"],
+                        clip["pattern"],
+                        codec,
+                        preset,
+                    )
+                    results.append(benchmark_clip(work_dir, clip, codec, preset))
+    finally:
+        if not config["keep"]:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "created": time.time(),
+        "host": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg_version(),
+        "clip_duration": config["duration"],
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    try:
+        video.configure_logging()
+        video.reset_signal_state()
+        video.configure_signal_handlers()
+        config = arguments()
+        if config["organizer_files"]:
+            report = run_organizer_benchmark(config)
+            print(json.dumps(report["organizer"], indent=2))
+        else:
+            report = run_benchmark(config)
+            print(format_table(report["results"]))
+        if config["json"]:
+            with open(config["json"], "w") as json_file:
+                json.dump(report, json_file, indent=2)
+    except video.VideoConversionError as exc:
+        logger.error("Benchmark halted: %s", video.sanitize_for_log(exc))
+        sys.exit(1)
+    except OSError as exc:
+        logger.error("Filesystem error during benchmark: %s", video.sanitize_for_log(exc))
+        sys.exit(1)
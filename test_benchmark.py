@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+import benchmark
+import video
+
+
+def test_clip_command_renders_video_and_audio():
+    command = benchmark.clip_command("mandelbrot", 3840, 2160, 5.0, "/tmp/GH010001.MP4")
+
+    assert "mandelbrot=size=3840x2160:rate=60" in command
+    assert command[command.index("-t") + 1] == "5"
+    assert ["-map", "0:v", "-map", "1:a"] == command[command.index("-map") :][:4]
+    assert command[-1] == "/tmp/GH010001.MP4"
+
+
+def test_validate_config_rejects_unknown_preset():
+    config = benchmark.arguments(["--presets", "medium,ludicrous"])
+
+    with pytest.raises(video.VideoConversionError, match="preset"):
+        benchmark.validate_config(config)
+
+
+def test_benchmark_clip_measures_pipeline_output(monkeypatch, tmp_path):
+    source = tmp_path / "0001" / "GH010001.MP4"
+    source.parent.mkdir()
+    source.write_bytes(b"x" * 1000)
+    calls = []
+
+    def fake_convert(path, options, *_args, **kwargs):
+        calls.append((options, kwargs["preset"], kwargs["auto_copy"]))
+        (tmp_path / "GH010001.MP4").write_bytes(b"x" * 250)
+
+    monkeypatch.setattr(video, "convertVideos", fake_convert)
+    clip = {
+        "sequence": "0001",
+        "resolution": "1080",
+        "pattern": "testsrc2",
+        "source": str(source),
+        "frames": 600,
+    }
+
+    result = benchmark.benchmark_clip(str(tmp_path), clip, "h265", "fast")
+
+    assert calls == [(["-c", "copy", "-c:v", "libx265"], "fast", False)]
+    assert result["compression_ratio"] == 4.0
+    assert result["output_size"] == 250
+    assert not (tmp_path / "GH010001.MP4").exists()
+    assert "fast" in benchmark.format_table([result])
+
+
+def test_benchmark_organizer_sorts_ten_thousand_files(tmp_path):
+    result = benchmark.benchmark_organizer(str(tmp_path), 10000)
+
+    assert result["files"] == 10000
+    assert result["sequences"] == 10000 // benchmark.ORGANIZER_CHAPTERS
+    assert sorted(os.listdir(tmp_path / "0000")) == [f"GH0{n}0000.MP4" for n in range(1, 5)]
@@ -1,4 +1,11 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import struct
 import subprocess
+import sys
+import time
 
 import pytest
 
@@ -30,24 +37,52 @@ class DummyProbe:
         self.streams = streams
 
 
-def test_bash_command_handles_missing_shell(monkeypatch):
+class DummyProcess:
+    """Popen stand-in that exits with a fixed return code."""
+
+    def __init__(self, returncode=0):
+        self.returncode = returncode
+        self.pid = 4242
+        self.terminated = False
+
+    def wait(self):
+        return self.returncode
+
+    def terminate(self):
+        self.terminated = True
+
+
+def test_run_command_handles_missing_executable(monkeypatch):
     def raise_missing(*_args, **_kwargs):
         raise FileNotFoundError("missing")
 
-    monkeypatch.setattr(video.subprocess, "run", raise_missing)
+    video.reset_signal_state()
+    monkeypatch.setattr(video.subprocess, "Popen", raise_missing)
+
+    with pytest.raises(video.VideoConversionError, match="'echo' not available"):
+        video.run_command(["echo", "test"], context="test")
+
+
+def test_run_command_handles_command_failure(monkeypatch):
+    video.reset_signal_state()
+    monkeypatch.setattr(video.subprocess, "Popen", lambda *_args, **_kwargs: DummyProcess(1))
 
-    with pytest.raises(video.VideoConversionError, match="Bash not available"):
-        video.bash_command("echo test", context="test")
+    with pytest.raises(video.VideoConversionError, match="Command failed") as excinfo:
+        video.run_command(["echo", "test"], context="test")
 
+    assert isinstance(excinfo.value.__cause__, subprocess.CalledProcessError)
+    assert not video._ACTIVE_PROCESSES
 
-def test_bash_command_handles_command_failure(monkeypatch):
-    def raise_failure(*_args, **_kwargs):
-        raise subprocess.CalledProcessError(1, "echo test")
 
-    monkeypatch.setattr(video.subprocess, "run", raise_failure)
+def test_run_command_refuses_to_start_during_shutdown(monkeypatch):
+    def fail_popen(*_args, **_kwargs):
+        raise AssertionError("no process should be started")
 
-    with pytest.raises(video.VideoConversionError, match="Command failed"):
-        video.bash_command("echo test", context="test")
+    monkeypatch.setattr(video.subprocess, "Popen", fail_popen)
+    monkeypatch.setattr(video, "_SIGNAL_HANDLED", True)
+
+    with pytest.raises(video.VideoConversionError, match="Shutdown in progress"):
+        video.run_command(["echo", "test"], context="test")
 
 
 def test_get_options_rejects_invalid_combo():
@@ -55,21 +90,128 @@ def test_get_options_rejects_invalid_combo():
         video.getOptions("bad", "cpu")
 
 
-def test_probe_video_handles_missing_file(monkeypatch):
-    def raise_missing(_source):
-        raise FileNotFoundError("missing")
+def test_get_options_cpu_profiles():
+    options = video.getOptions("av1", "cpu", profile="efficiency", threads=4)
+
+    assert options[:4] == ["-c", "copy", "-c:v", "libsvtav1"]
+    assert options[4:] == ["-threads", "4", "-svtav1-params", "lookahead=120"]
+    x265 = video.getOptions("h265", "cpu", profile="speed", threads=8)
+    assert x265[-2:] == ["-x265-params", "rc-lookahead=15:bframes=4:pools=8"]
+    encoder_args = video.build_encoder_args(options, 1000, "slower")
+    assert encoder_args[encoder_args.index("-preset") + 1] == "4"
+    with pytest.raises(video.VideoConversionError, match="Unsupported codec/accelerator"):
+        video.getOptions("av1", "qsv")
+    with pytest.raises(video.VideoConversionError, match="only applies to the cpu"):
+        video.getOptions("h265", "qsv", profile="balanced")
+
+
+def test_build_encoder_args_uses_each_encoders_rate_control():
+    av1 = video.getOptions("av1", "cpu", profile="efficiency")
+    assert video.build_encoder_args(av1, 8000000, "slower", "fps=60000/1001") == [
+        "-c",
+        "copy",
+        "-c:v",
+        "libsvtav1",
+        "-svtav1-params",
+        "lookahead=120:rc=1",
+        "-b:v",
+        "8000000",
+        "-fps_mode",
+        "passthrough",
+        "-g",
+        "120",
+        "-preset",
+        "4",
+        "-vf",
+        "fps=60000/1001",
+    ]
+    x265 = video.build_encoder_args(video.getOptions("h265", "cpu"), 1000, "medium")
+    assert x265[4:10] == ["-b:v", "1000", "-maxrate", "1500", "-bufsize", "4000"]
+    assert "-look_ahead" not in x265 and "-bitrate_limit" not in x265
+    qsv = video.build_encoder_args(video.getOptions("h265", "qsv"), 1000, "medium")
+    assert qsv[-2:] == ["-look_ahead", "1"]
+    assert qsv[qsv.index("-bitrate_limit") + 1] == "0"
+
+
+def test_thread_caps_are_left_out_of_the_job_identity():
+    for codec, profile in (("h265", None), ("h265", "speed"), ("av1", "efficiency")):
+        four_jobs = video.getOptions(codec, "cpu", profile=profile, threads=8)
+        eight_jobs = video.getOptions(codec, "cpu", profile=profile, threads=4)
+        single = video.getOptions(codec, "cpu", profile=profile)
+
+        assert video.without_thread_caps(four_jobs) == video.without_thread_caps(eight_jobs)
+        assert video.without_thread_caps(four_jobs) == single
 
-    monkeypatch.setattr(video, "FFProbe", raise_missing)
 
+def test_calculate_bitrate_scales_per_codec():
+    probe = DummyProbe([DummyStream(bit_rate=60 * 1024 * 1024)])
+
+    hevc = video.calculateBitrate("/tmp/source.mp4", 0.12, 25, 0.7, probe=probe, codec="h265")
+    av1 = video.calculateBitrate("/tmp/source.mp4", 0.12, 25, 0.7, probe=probe, codec="av1")
+
+    assert hevc == video.BITRATE_1080P
+    assert av1 == round(video.BITRATE_1080P * 0.7)
+
+
+def test_probe_video_handles_missing_file(tmp_path):
     with pytest.raises(video.VideoConversionError, match="Source file not found"):
-        video.probeVideo("/tmp/missing.mp4")
+        video.probeVideo(str(tmp_path / "missing.mp4"))
+
+
+def test_probe_video_handles_missing_ffprobe(monkeypatch, tmp_path):
+    source = tmp_path / "GH010001.MP4"
+    source.write_text("video")
+
+    def raise_missing(_source):
+        raise FileNotFoundError("ffprobe")
+
+    monkeypatch.setattr(video, "run_ffprobe", raise_missing)
+
+    with pytest.raises(video.VideoConversionError, match="ffprobe not available"):
+        video.probeVideo(str(source))
 
 
-def test_probe_video_handles_empty_streams(monkeypatch):
-    monkeypatch.setattr(video, "FFProbe", lambda _source: DummyProbe([]))
+def test_probe_video_handles_empty_streams(monkeypatch, tmp_path):
+    source = tmp_path / "empty.mp4"
+    source.write_text("video")
+    monkeypatch.setattr(video, "run_ffprobe", lambda _source: {"streams": [], "format": {}})
 
     with pytest.raises(video.VideoConversionError, match="No streams found"):
-        video.probeVideo("/tmp/empty.mp4")
+        video.probeVideo(str(source))
+
+
+def test_probe_video_parses_json_report(monkeypatch, tmp_path):
+    source = tmp_path / "GX010001.MP4"
+    source.write_text("video")
+    report = {
+        "streams": [
+            {
+                "index": 0,
+                "codec_name": "hevc",
+                "codec_type": "video",
+                "coded_width": 3840,
+                "coded_height": 2160,
+                "avg_frame_rate": "60000/1001",
+                "bit_rate": "100000000",
+                "duration": "530.03",
+            },
+            {"index": 1, "codec_name": "aac", "codec_type": "audio"},
+            {"index": 2, "codec_name": "none", "codec_type": "data"},
+            {"index": 3, "codec_name": "bin_data", "codec_type": "data"},
+        ],
+        "format": {"duration": "530.05", "size": "4000000000", "bit_rate": "60366000"},
+    }
+    monkeypatch.setattr(video, "run_ffprobe", lambda _source: report)
+
+    probe = video.probeVideo(str(source))
+
+    assert video.stream_layout(probe) == ("hevc", "aac", "none", "bin_data")
+    assert probe.streams[0].coded_height == 2160
+    assert probe.streams[0].framerate == pytest.approx(59.94, rel=1e-3)
+    assert probe.streams[0].bit_rate == 100000000
+    assert probe.streams[1].bit_rate is None
+    assert probe.duration == pytest.approx(530.05)
+    assert video.calculateBitrate(str(source), 0.12, 25, 0.7, probe=probe) == video.BITRATE_2160P
 
 
 def test_calculate_bitrate_invalid_metadata():
@@ -107,6 +249,50 @@ def test_videos_to_folders_permission_error(monkeypatch, tmp_path):
         video.videostofolders(contents, str(tmp_path))
 
 
+def test_videos_to_folders_orders_chapters_numerically(tmp_path):
+    names = ["GH100001.MP4", "GH020001.MP4", "GX010002.MP4", "GH010001.MP4", "notes.txt"]
+    for name in names:
+        (tmp_path / name).write_bytes(b"")
+
+    contents = video.scan_loose_chapters(str(tmp_path))
+    sequences = video.videostofolders(contents, str(tmp_path))
+
+    assert sequences == ["0001", "0002"]
+    assert video.index_sequences(names)["0001"] == ["GH010001.MP4", "GH020001.MP4", "GH100001.MP4"]
+    _, chapters = video.list_sequence_chapters(str(tmp_path), "0001")
+    assert chapters == ["GH010001.MP4", "GH020001.MP4", "GH100001.MP4"]
+    assert (tmp_path / "notes.txt").exists()
+
+
+def test_videos_to_folders_dry_run_prints_plan(capsys, tmp_path):
+    (tmp_path / "GH010001.MP4").write_bytes(b"")
+
+    assert video.videostofolders(["GH010001.MP4"], str(tmp_path), dry_run=True) == ["0001"]
+
+    out = capsys.readouterr().out.splitlines()
+    assert out[0] == f"# mkdir -p {tmp_path / '0001'}"
+    assert out[1] == f"# mv -n {tmp_path / 'GH010001.MP4'} {tmp_path / '0001' / 'GH010001.MP4'}"
+    assert not (tmp_path / "0001").exists()
+
+
+def test_videos_to_folders_link_falls_back_to_symlink(monkeypatch, tmp_path):
+    (tmp_path / "GH010001.MP4").write_bytes(b"chapter")
+
+    def cross_device(_source, _destination):
+        raise OSError(video.errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(video.os, "link", cross_device)
+    video.videostofolders(["GH010001.MP4"], str(tmp_path), link=True)
+
+    linked = tmp_path / "0001" / "GH010001.MP4"
+    assert linked.is_symlink()
+    assert linked.read_bytes() == b"chapter"
+    assert (tmp_path / "GH010001.MP4").exists()
+    # Later passes recognise the link and leave it alone.
+    video.videostofolders(["GH010001.MP4"], str(tmp_path), link=True)
+    assert video.organize_new_chapters(str(tmp_path), link=True) == []
+
+
 def test_convert_videos_rejects_single_stream(monkeypatch, tmp_path):
     sequence_path = tmp_path / "0001"
     sequence_path.mkdir()
@@ -143,7 +329,7 @@ def test_convert_videos_rejects_three_streams(monkeypatch, tmp_path):
     monkeypatch.setattr(video.os, "listdir", fake_listdir)
     monkeypatch.setattr(video, "probeVideo", lambda _source: DummyProbe([DummyStream()] * 3))
     monkeypatch.setattr(video, "calculateBitrate", lambda *_args, **_kwargs: 1000)
-    monkeypatch.setattr(video, "bash_command", lambda *_args, **_kwargs: None)
+    monkeypatch.setattr(video, "run_command", lambda *_args, **_kwargs: None)
 
     with pytest.raises(video.VideoConversionError, match="Unsupported stream layout"):
         video.convertVideos(str(tmp_path), "-c copy", 0.12, 25, 0.7, True, sequences=["0002"])
@@ -172,7 +358,7 @@ def test_convert_videos_rejects_missing_telemetry(monkeypatch, tmp_path):
         lambda _source: DummyProbe(streams_with_wrong_telemetry_codec),
     )
     monkeypatch.setattr(video, "calculateBitrate", lambda *_args, **_kwargs: 1000)
-    monkeypatch.setattr(video, "bash_command", lambda *_args, **_kwargs: None)
+    monkeypatch.setattr(video, "run_command", lambda *_args, **_kwargs: None)
 
     with pytest.raises(video.VideoConversionError, match="Expected bin_data stream"):
         video.convertVideos(str(tmp_path), "-c copy", 0.12, 25, 0.7, True, sequences=["0003"])
@@ -198,7 +384,7 @@ def test_convert_videos_resume_skips_existing_output(monkeypatch, tmp_path):
 
     monkeypatch.setattr(video.os, "listdir", fake_listdir)
     monkeypatch.setattr(video, "probeVideo", fail_probe)
-    monkeypatch.setattr(video, "bash_command", lambda *_args, **_kwargs: calls.append(True))
+    monkeypatch.setattr(video, "run_command", lambda *_args, **_kwargs: calls.append(True))
 
     video.convertVideos(
         str(tmp_path), "-c copy", 0.12, 25, 0.7, True, resume=True, sequences=["0004"]
@@ -221,7 +407,7 @@ def test_convert_videos_resume_allows_conversion(monkeypatch, tmp_path):
         return []
 
     replace_calls = []
-    bash_calls = []
+    command_calls = []
 
     video.reset_signal_state()
     video._TRACKED_PARTIAL_OUTPUTS.clear()
@@ -231,7 +417,7 @@ def test_convert_videos_resume_allows_conversion(monkeypatch, tmp_path):
         video, "probeVideo", lambda _source: DummyProbe([DummyStream(), DummyStream()])
     )
     monkeypatch.setattr(video, "calculateBitrate", lambda *_args, **_kwargs: 1000)
-    monkeypatch.setattr(video, "bash_command", lambda *_args, **_kwargs: bash_calls.append(True))
+    monkeypatch.setattr(video, "run_command", lambda *_args, **_kwargs: command_calls.append(True))
     monkeypatch.setattr(video.os, "replace", lambda *_args: replace_calls.append(True))
     monkeypatch.setattr(video.shutil, "copystat", lambda *_args, **_kwargs: None)
 
@@ -239,7 +425,7 @@ def test_convert_videos_resume_allows_conversion(monkeypatch, tmp_path):
         str(tmp_path), "-c copy", 0.12, 25, 0.7, True, resume=True, sequences=["0005"]
     )
 
-    assert bash_calls
+    assert command_calls
     assert replace_calls
     assert not video._TRACKED_PARTIAL_OUTPUTS
 
@@ -316,3 +502,1363 @@ def test_configure_signal_handlers_registers(monkeypatch):
     assert (video.signal.SIGINT, video.handle_shutdown_signal) in registered
     assert (video.signal.SIGTERM, video.handle_shutdown_signal) in registered
     assert video.cleanup_temporary_artifacts in atexit_calls
+
+
+def test_handle_shutdown_signal_terminates_active_processes(monkeypatch):
+    process = DummyProcess()
+
+    video.reset_signal_state()
+    video._ACTIVE_PROCESSES.clear()
+    video.register_process(process)
+    monkeypatch.setattr(video, "cleanup_temporary_artifacts", lambda: None)
+
+    with pytest.raises(SystemExit):
+        video.handle_shutdown_signal(video.signal.SIGTERM, None)
+
+    assert process.terminated
+    video.unregister_process(process)
+
+
+def make_sequences(tmp_path, names):
+    for name in names:
+        sequence_path = tmp_path / name
+        sequence_path.mkdir()
+        (sequence_path / f"GH01{name}.MP4").write_text("video")
+
+
+class StagePlan:
+    """Minimal stand-in for a SequencePlan flowing through the pipeline stages."""
+
+    def __init__(self, sequence):
+        self.sequence = sequence
+
+
+def patch_pipeline_stages(monkeypatch, encode=None, finish=None):
+    monkeypatch.setattr(
+        video, "prepare_sequence", lambda _path, sequence, *_args, **_kwargs: StagePlan(sequence)
+    )
+    monkeypatch.setattr(video, "encode_sequence_plan", encode or (lambda *_args: None))
+    monkeypatch.setattr(video, "finish_sequence_plan", finish or (lambda _plan: None))
+
+
+def test_convert_videos_parallel_converts_every_sequence(monkeypatch, tmp_path):
+    names = ["0010", "0011", "0012", "0013"]
+    make_sequences(tmp_path, names)
+    converted = []
+
+    def record_sequence(plan):
+        converted.append(plan.sequence)
+
+    patch_pipeline_stages(monkeypatch, finish=record_sequence)
+
+    video.convertVideos(str(tmp_path), "-c copy", 0.12, 25, 0.7, True, sequences=names, jobs=3)
+
+    assert sorted(converted) == names
+
+
+def test_convert_videos_parallel_reraises_first_failure(monkeypatch, tmp_path):
+    names = ["0020", "0021"]
+    make_sequences(tmp_path, names)
+
+    def fail_sequence(plan, _preset_tuner):
+        if plan.sequence == "0021":
+            raise video.VideoConversionError("boom")
+
+    patch_pipeline_stages(monkeypatch, encode=fail_sequence)
+
+    with pytest.raises(video.VideoConversionError, match="boom"):
+        video.convertVideos(str(tmp_path), "-c copy", 0.12, 25, 0.7, True, sequences=names, jobs=2)
+
+
+def test_sequence_pipeline_plans_next_sequence_during_encode(monkeypatch, tmp_path):
+    names = ["0100", "0101", "0102"]
+    make_sequences(tmp_path, names)
+    events = []
+    second_planned = video.Event()
+
+    def prepare(_path, sequence, *_args, **_kwargs):
+        events.append(("plan", sequence))
+        if sequence == "0101":
+            second_planned.set()
+        return StagePlan(sequence)
+
+    def encode(plan, _preset_tuner):
+        if plan.sequence == "0100":
+            # The planner must get to the next sequence while this encode runs.
+            assert second_planned.wait(5)
+        if plan.sequence == "0101":
+            raise video.VideoConversionError("encoder failed")
+        events.append(("encode", plan.sequence))
+
+    patch_pipeline_stages(
+        monkeypatch, encode=encode, finish=lambda plan: events.append(("finish", plan.sequence))
+    )
+    monkeypatch.setattr(video, "prepare_sequence", prepare)
+
+    with pytest.raises(video.VideoConversionError, match="encoder failed"):
+        video.convertVideos(str(tmp_path), [], 0.12, 25, 0.7, True, sequences=names)
+
+    # The sequence already encoded is finalized; nothing after the failure is encoded.
+    assert ("finish", "0100") in events
+    assert ("encode", "0102") not in events
+
+
+def test_convert_videos_rejects_invalid_job_count(tmp_path):
+    with pytest.raises(video.VideoConversionError, match="at least 1"):
+        video.convertVideos(str(tmp_path), "-c copy", 0.12, 25, 0.7, True, sequences=[], jobs=0)
+
+
+def test_source_cache_hits_until_file_changes(tmp_path):
+    source = tmp_path / "GH010001.MP4"
+    source.write_text("video")
+    cache = video.SourceCache(str(tmp_path / "cache.sqlite3"))
+
+    assert cache.get("probe", str(source)) is None
+    cache.put("probe", str(source), [{"codec_name": "hevc"}])
+    assert cache.get("probe", str(source)) == [{"codec_name": "hevc"}]
+
+    source.write_text("re-imported video")
+    assert cache.get("probe", str(source)) is None
+    assert cache.hits["probe"] == 1
+    assert cache.misses["probe"] == 2
+    cache.close()
+
+
+def test_source_cache_evicts_unused_entries(tmp_path):
+    source = tmp_path / "GH010002.MP4"
+    source.write_text("video")
+    cache = video.SourceCache(str(tmp_path / "cache.sqlite3"))
+    cache.put("probe", str(source), [{"codec_name": "h264"}])
+
+    assert cache.evict_stale(max_age=-1) == 1
+    assert cache.get("probe", str(source)) is None
+    cache.close()
+
+
+def test_probe_video_consults_source_cache(monkeypatch, tmp_path):
+    source = tmp_path / "GH010003.MP4"
+    source.write_text("video")
+    probe_calls = []
+
+    def fake_ffprobe(path):
+        probe_calls.append(path)
+        return {
+            "streams": [
+                {"codec_name": "h264", "coded_height": 1080},
+                {"codec_name": "aac"},
+            ],
+            "format": {},
+        }
+
+    cache = video.SourceCache(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(video, "run_ffprobe", fake_ffprobe)
+    monkeypatch.setattr(video, "_SOURCE_CACHE", cache)
+
+    first = video.probeVideo(str(source))
+    second = video.probeVideo(str(source))
+
+    assert len(probe_calls) == 1
+    assert [stream.codec_name for stream in second.streams] == ["h264", "aac"]
+    assert second.streams[0].coded_height == first.streams[0].coded_height
+    assert cache.hits[video.PROBE_CACHE_KIND] == 1
+    cache.close()
+
+
+SITI_SUMMARY = """[Parsed_siti_2 @ 0x5555] SITI Summary:
+[Parsed_siti_2 @ 0x5555] Total frames: 180
+[Parsed_siti_2 @ 0x5555] Spatial Information:
+[Parsed_siti_2 @ 0x5555] Average: 30.000000
+[Parsed_siti_2 @ 0x5555] Max: 41.250000
+[Parsed_siti_2 @ 0x5555] Temporal Information:
+[Parsed_siti_2 @ 0x5555] Average: 5.000000
+[Parsed_siti_2 @ 0x5555] Max: 12.500000
+"""
+
+
+def test_complexity_analysis_is_cached_and_scales_bitrate(monkeypatch, tmp_path):
+    make_sequences(tmp_path, ["0007"])
+    analysed = []
+
+    def fake_run(command, _context, capture_stderr=False):
+        analysed.append(command.argv())
+        return SITI_SUMMARY
+
+    cache = video.SourceCache(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(video, "run_command", fake_run)
+    monkeypatch.setattr(video, "_SOURCE_CACHE", cache)
+    monkeypatch.setattr(
+        video,
+        "probeVideo",
+        lambda _source: DummyProbe([DummyStream(bit_rate=10**9), DummyStream()]),
+    )
+
+    args = (str(tmp_path), "0007", [], 0.12, 25, 0.7, True)
+    # --plan lists the analysis instead of running it.
+    dry = video.plan_sequence(*args, complexity=True, dry_run=True)
+    assert analysed == []
+    assert video.describe_sequence_plan(dry)[0] == video.complexity_command(dry.source).argv()
+
+    plans = [video.plan_sequence(*args, complexity=True) for _ in range(2)]
+
+    assert len(analysed) == 1
+    assert "scale=-2:240,siti=print_summary=1" in analysed[0][analysed[0].index("-vf") + 1]
+    # SI and TI at half and a quarter of the reference give sqrt(1/8) -> the 0.5 floor.
+    assert plans[1].bitrate == round(video.BITRATE_1080P * video.COMPLEXITY_SCALE_MIN)
+    dry = video.plan_sequence(*args, complexity=True, dry_run=True)
+    assert (dry.complexity_sources, dry.bitrate) == ([], plans[1].bitrate)
+    assert video.complexity_bitrate_scale({"si": 90.0, "ti": 20.0}) == pytest.approx(1.5**0.5)
+    assert video.parse_siti_summary("no summary") is None
+    cache.close()
+
+
+def test_convert_videos_rejects_mismatched_chapter_layouts(monkeypatch, tmp_path):
+    sequence_path = tmp_path / "0006"
+    sequence_path.mkdir()
+    (sequence_path / "GH010006.MP4").write_text("video")
+    (sequence_path / "GH020006.MP4").write_text("video")
+
+    def fake_probe(source):
+        if source.endswith("GH020006.MP4"):
+            return DummyProbe([DummyStream(), DummyStream(codec_name="pcm_s16le")])
+        return DummyProbe([DummyStream(), DummyStream(codec_name="aac")])
+
+    monkeypatch.setattr(video, "probeVideo", fake_probe)
+    monkeypatch.setattr(video, "run_command", lambda *_args, **_kwargs: None)
+
+    with pytest.raises(video.VideoConversionError, match="does not match first chapter"):
+        video.convertVideos(str(tmp_path), "-c copy", 0.12, 25, 0.7, True, sequences=["0006"])
+
+
+def run_single_sequence(monkeypatch, tmp_path, name, streams, **kwargs):
+    sequence_path = tmp_path / name
+    sequence_path.mkdir()
+    (sequence_path / f"GH01{name}.MP4").write_text("video")
+    commands = []
+
+    video.reset_signal_state()
+    monkeypatch.setattr(video, "probeVideo", lambda _source: DummyProbe(streams))
+    monkeypatch.setattr(
+        video,
+        "run_command",
+        lambda cmd, *_args, **_kwargs: commands.append(" ".join(video.command_argv(cmd))),
+    )
+    monkeypatch.setattr(video.os, "replace", lambda *_args: None)
+    monkeypatch.setattr(video.shutil, "copystat", lambda *_args, **_kwargs: None)
+
+    video.convertVideos(
+        str(tmp_path), "-c copy -c:v libx265", 0.12, 25, 0.7, True, sequences=[name], **kwargs
+    )
+    return commands
+
+
+def test_convert_videos_stream_copies_sources_below_target(monkeypatch, tmp_path):
+    streams = [DummyStream(codec_name="hevc", bit_rate=8000000), DummyStream(codec_name="aac")]
+
+    commands = run_single_sequence(monkeypatch, tmp_path, "0030", streams, codec="h265")
+
+    assert "-c copy -map 0:0 -map 0:1" in commands[0]
+    assert "-b:v" not in commands[0]
+
+
+def test_convert_videos_reencodes_when_codec_differs(monkeypatch, tmp_path):
+    streams = [DummyStream(codec_name="h264", bit_rate=8000000), DummyStream(codec_name="aac")]
+
+    commands = run_single_sequence(monkeypatch, tmp_path, "0031", streams, codec="h265")
+
+    assert "-b:v" in commands[0]
+
+
+def test_convert_videos_force_encode_disables_stream_copy(monkeypatch, tmp_path):
+    streams = [DummyStream(codec_name="hevc", bit_rate=8000000), DummyStream(codec_name="aac")]
+
+    commands = run_single_sequence(
+        monkeypatch, tmp_path, "0032", streams, codec="h265", auto_copy=False
+    )
+
+    assert "-b:v" in commands[0]
+
+
+def test_plan_chunk_boundaries_respects_minimum_duration():
+    assert video.plan_chunk_boundaries(None, 4) == []
+    assert video.plan_chunk_boundaries(7200.0, 1) == []
+    assert video.plan_chunk_boundaries(90.0, 4) == []
+    assert video.plan_chunk_boundaries(7200.0, 4) == [1800.0, 3600.0, 5400.0]
+    assert video.plan_chunk_boundaries(150.0, 8) == [75.0]
+
+
+def test_encode_sequence_chunked_stitches_with_original_audio_and_telemetry(monkeypatch, tmp_path):
+    plan = video.SequencePlan(
+        "0040",
+        [str(tmp_path / "0040" / "GH010040.MP4")],
+        str(tmp_path / "GH010040.MP4"),
+        [DummyProbe([DummyStream()])],
+        ["-c:v", "libx265"],
+        bitrate=1000,
+        has_telemetry=True,
+        chunk_boundaries=[1800.0, 3600.0],
+    )
+    work_dir = f"{plan.partial_destination}.chunks"
+    commands = []
+
+    def fake_run(cmd, _context, **_kwargs):
+        argv = video.command_argv(cmd)
+        commands.append(" ".join(argv))
+        if "segment" in argv:
+            for index in range(3):
+                with open(f"{work_dir}/source_{index:04d}.mp4", "w") as segment:
+                    segment.write("segment")
+
+    video.reset_signal_state()
+    monkeypatch.setattr(video, "run_command", fake_run)
+
+    video.encode_sequence_chunked(plan, "/tmp/concat.txt")
+
+    assert "-segment_times 1800.000,3600.000" in commands[0]
+    encode_commands = [cmd for cmd in commands if "-c:v libx265" in cmd]
+    assert len(encode_commands) == 3
+    assert all("-an -map 0:0" in cmd for cmd in encode_commands)
+    assert "-map 0:0 -map 1:1 -map 1:3 -c copy" in commands[-1]
+    assert commands[-1].endswith(plan.partial_destination)
+    assert not os.path.exists(work_dir)
+    assert work_dir not in video._TRACKED_TEMP_DIRS
+
+
+def test_cleanup_temporary_artifacts_removes_directories(tmp_path):
+    work_dir = tmp_path / "output.mp4.partial.chunks"
+    work_dir.mkdir()
+    (work_dir / "source_0000.mp4").write_text("segment")
+
+    video.reset_signal_state()
+    video._TRACKED_TEMP_DIRS.clear()
+    video.register_temp_dir(str(work_dir))
+
+    video.cleanup_temporary_artifacts()
+
+    assert not work_dir.exists()
+    assert not video._TRACKED_TEMP_DIRS
+
+
+def test_progress_monitor_computes_eta_and_writes_status(tmp_path):
+    status_path = tmp_path / "status.json"
+    board = video.ProgressBoard(str(status_path))
+    monitor = video.ProgressMonitor("0050", duration=100.0, board=board)
+
+    for line in [
+        "frame=1500",
+        "fps=50.0",
+        "out_time=00:00:25.000000",
+        "speed=0.5x",
+        "progress=continue",
+    ]:
+        monitor.feed_line(line)
+
+    assert monitor.state["frames"] == 1500
+    assert monitor.state["percent"] == 25.0
+    assert monitor.state["eta_seconds"] == 150.0
+
+    monitor.finish(0)
+
+    document = video.json.loads(status_path.read_text())
+    assert document["sequences"]["0050"]["status"] == "done"
+    assert document["sequences"]["0050"]["frames"] == 1500
+
+
+def test_run_command_streams_progress_to_monitor():
+    video.reset_signal_state()
+    monitor = video.ProgressMonitor("0051", duration=10.0, board=video.ProgressBoard())
+    progress_lines = "frame=300 fps=60.0 out_time=00:00:05.000000 speed=2.0x progress=end"
+
+    video.run_command(
+        [sys.executable, "-c", f"print('\\n'.join({progress_lines!r}.split()))"],
+        "test",
+        progress=monitor,
+    )
+
+    assert monitor.state["frames"] == 300
+    assert monitor.state["percent"] == 50.0
+    assert monitor.state["status"] == "done"
+
+
+def test_parse_quality_metrics_reads_ssim_and_psnr():
+    output = (
+        "[Parsed_ssim_4 @ 0x55d] SSIM Y:0.991 U:0.995 V:0.994 All:0.992345 (21.15)\n"
+        "[Parsed_psnr_5 @ 0x55e] PSNR y:44.1 u:47.0 v:46.8 average:44.870000 min:40.1 max:50.2\n"
+    )
+
+    assert video.parse_quality_metrics(output) == {"ssim": 0.992345, "psnr": 44.87}
+    assert video.parse_quality_metrics("") == {}
+
+
+def test_plan_sample_offsets_spreads_windows():
+    assert video.plan_sample_offsets(None, 3, 4.0) == [0.0]
+    assert video.plan_sample_offsets(100.0, 3, 4.0) == [23.0, 48.0, 73.0]
+
+
+def test_preset_tuner_picks_fastest_preset_meeting_floor_and_caches(monkeypatch):
+    scores = {"veryfast": 0.95, "faster": 0.97, "fast": 0.985, "medium": 0.99}
+    measured = []
+
+    def fake_measure(
+        _self, _concat, offset, _options, _bitrate, preset, _work_dir, _context, _filter
+    ):
+        measured.append((preset, offset))
+        return scores[preset]
+
+    monkeypatch.setattr(video.PresetTuner, "_measure_sample", fake_measure)
+    tuner = video.PresetTuner(floor=0.98, candidates=list(scores), samples=2)
+    probe = DummyProbe([DummyStream(coded_height=2160, coded_width=3840, framerate=59.94)])
+
+    first = tuner.choose("/tmp/concat.txt", probe, 600.0, "-c:v libx265", 1000, "test")
+    second = tuner.choose("/tmp/concat.txt", probe, 900.0, "-c:v libx265", 1000, "test")
+
+    assert first == second == "fast"
+    assert [preset for preset, _ in measured] == ["veryfast"] * 2 + ["faster"] * 2 + ["fast"] * 2
+
+
+def test_ffmpeg_command_renders_grouped_argv():
+    command = (
+        video.FFmpegCommand("-nostats")
+        .add_concat_input("/tmp/list.txt", "-ss", 5)
+        .add_input("/tmp/b.mp4")
+        .add_output("/tmp/out file.mp4", "-c", "copy", "-f", "mp4")
+    )
+
+    assert command.argv() == [
+        "ffmpeg",
+        "-y",
+        "-nostats",
+        "-ss",
+        "5",
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-i",
+        "/tmp/list.txt",
+        "-i",
+        "/tmp/b.mp4",
+        "-c",
+        "copy",
+        "-f",
+        "mp4",
+        "/tmp/out file.mp4",
+    ]
+    assert str(command).endswith("'/tmp/out file.mp4'")
+
+
+def test_convert_videos_dry_run_prints_plan_without_running(monkeypatch, tmp_path, capsys):
+    (tmp_path / "GH010060.MP4").write_text("video")
+    (tmp_path / "GH020060.MP4").write_text("video")
+    streams = [DummyStream(bit_rate=60000000), DummyStream(codec_name="aac")]
+
+    def fail_run(*_args, **_kwargs):
+        raise AssertionError("no command should run in plan mode")
+
+    monkeypatch.setattr(video, "probeVideo", lambda _source: DummyProbe(streams))
+    monkeypatch.setattr(video, "run_command", fail_run)
+
+    video.convertVideos(
+        str(tmp_path),
+        video.getOptions("h265", "cpu"),
+        0.12,
+        25,
+        0.7,
+        True,
+        sequences=["0060"],
+        jobs=4,
+        dry_run=True,
+    )
+
+    output = capsys.readouterr().out
+    assert "# Sequence 0060: convert 2 chapter(s)" in output
+    assert "GH020060.MP4" in output
+    assert "-c:v libx265 -b:v 14680064" in output
+    assert "exiftool -TagsFromFile" in output
+    assert not (tmp_path / "0060").exists()
+    assert not video._TRACKED_PARTIAL_OUTPUTS
+
+
+FAKE_EXIFTOOL = """
+import sys, time
+args = []
+for line in sys.stdin:
+    line = line.rstrip("\\n")
+    if line.startswith("-execute"):
+        if "hang" in args:
+            time.sleep(30)
+        if "missing" in args:
+            sys.stderr.write("Error: File not found - missing\\n")
+        else:
+            sys.stdout.write(" ".join(args[: args.index("-echo4")]) + "\\n")
+        sys.stderr.write(args[args.index("-echo4") + 1] + "\\n")
+        sys.stdout.write("{ready" + line[len("-execute"):] + "}\\n")
+        sys.stdout.flush()
+        sys.stderr.flush()
+        args = []
+    elif args[-1:] == ["-stay_open"] and line == "False":
+        break
+    else:
+        args.append(line)
+"""
+
+
+def make_fake_exiftool(tmp_path):
+    script = tmp_path / "fake-exiftool"
+    script.write_text(f"#!{sys.executable}\n{FAKE_EXIFTOOL}")
+    script.chmod(0o755)
+    return str(script)
+
+
+def test_exiftool_session_frames_requests_and_reports_errors(tmp_path):
+    video.reset_signal_state()
+    session = video.ExifToolSession(make_fake_exiftool(tmp_path), timeout=10)
+    video.configure_exiftool_session(session)
+    job = video.ArtifactTracker()
+    try:
+        # The daemon outlives the job that happens to start it.
+        with video.use_tracker(job):
+            assert session.execute(["-TagsFromFile", "a.mp4", "b.mp4"]) == (
+                "-TagsFromFile a.mp4 b.mp4\n",
+                "",
+            )
+        assert video._ACTIVE_PROCESSES == {session._process}
+        job.cancel()
+        assert session.execute(["second"])[0] == "second\n"
+        with pytest.raises(video.VideoConversionError, match="File not found"):
+            video.run_exiftool(["missing"], "test")
+        assert not session.dead
+    finally:
+        video.configure_exiftool_session(None)
+        session.close()
+    assert session._process.returncode == 0
+    assert not video._ACTIVE_PROCESSES
+
+
+def test_run_exiftool_falls_back_when_session_times_out(monkeypatch, tmp_path):
+    video.reset_signal_state()
+    session = video.ExifToolSession(make_fake_exiftool(tmp_path), timeout=0.5)
+    calls = []
+    monkeypatch.setattr(video, "run_command", lambda argv, context: calls.append(argv))
+    video.configure_exiftool_session(session)
+    try:
+        video.run_exiftool(["hang", "out.mp4"], "test")
+        video.run_exiftool(["next.mp4"], "test")
+    finally:
+        video.configure_exiftool_session(None)
+        session.close()
+
+    assert session.dead
+    assert calls == [["exiftool", "hang", "out.mp4"], ["exiftool", "next.mp4"]]
+    assert not video._ACTIVE_PROCESSES
+
+
+def mp4_box(kind, payload=b""):
+    return struct.pack(">I4s", len(payload) + 8, kind) + payload
+
+
+def mp4_times_box(kind, creation, modification):
+    return mp4_box(kind, struct.pack(">BxxxII", 0, creation, modification) + bytes(16))
+
+
+def mp4_trak(handler, creation, modification):
+    mdia = mp4_box(
+        b"mdia",
+        mp4_times_box(b"mdhd", creation, modification)
+        + mp4_box(b"hdlr", bytes(8) + handler + bytes(13)),
+    )
+    return mp4_box(b"trak", mp4_times_box(b"tkhd", creation, modification) + mdia)
+
+
+def make_mp4(udta, creation, modification, handlers, mdat_first=True, tail=b""):
+    moov = mp4_box(
+        b"moov",
+        mp4_times_box(b"mvhd", creation, modification)
+        + b"".join(mp4_trak(handler, creation + index, modification) for index, handler in handlers)
+        + udta,
+    )
+    mdat = mp4_box(b"mdat", b"\xab" * 64)
+    body = mdat + moov if mdat_first else moov + tail + mdat
+    return mp4_box(b"ftyp", b"isom") + body
+
+
+def read_patched_metadata(path):
+    data = path.read_bytes()
+    return data, video.read_mp4_metadata(data)
+
+
+def test_patch_mp4_metadata_rewrites_trailing_moov(tmp_path):
+    gopro_udta = mp4_box(b"udta", mp4_box(b"GPMF", b"telemetry-settings" * 4))
+    source = tmp_path / "GH010001.MP4"
+    source.write_bytes(
+        make_mp4(gopro_udta, 3700000000, 3700000100, [(0, b"vide"), (1, b"tmcd"), (2, b"meta")])
+    )
+    output = tmp_path / "out.partial"
+    output.write_bytes(
+        make_mp4(
+            mp4_box(b"udta", mp4_box(b"\xa9too", b"ffmpeg")), 0, 0, [(0, b"vide"), (0, b"meta")]
+        )
+    )
+
+    assert video.patch_mp4_metadata(str(source), str(output)) == "rewritten"
+
+    data, metadata = read_patched_metadata(output)
+    assert metadata["udta"] == gopro_udta
+    assert metadata["movie"] == (3700000000, 3700000100)
+    # The telemetry track takes its times from the source meta track, not from tmcd.
+    assert metadata["tracks"][b"meta"] == ((3700000002, 3700000100), (3700000002, 3700000100))
+    assert metadata["tracks"][b"vide"][0] == (3700000000, 3700000100)
+    assert data[12:84] == mp4_box(b"mdat", b"\xab" * 64)
+
+
+def test_patch_mp4_metadata_uses_padding_or_relocates_leading_moov(tmp_path):
+    gopro_udta = mp4_box(b"udta", mp4_box(b"GPMF", b"x" * 40))
+    source = tmp_path / "source.mp4"
+    source.write_bytes(make_mp4(gopro_udta, 3700000000, 3700000100, [(0, b"vide")]))
+    padded = tmp_path / "padded.partial"
+    padded.write_bytes(
+        make_mp4(b"", 0, 0, [(0, b"vide")], mdat_first=False, tail=mp4_box(b"free", bytes(100)))
+    )
+    relocated = tmp_path / "relocated.partial"
+    relocated.write_bytes(make_mp4(b"", 0, 0, [(0, b"vide")], mdat_first=False))
+    original_size = relocated.stat().st_size
+
+    assert video.patch_mp4_metadata(str(source), str(padded)) == "padded"
+    assert video.patch_mp4_metadata(str(source), str(relocated)) == "relocated"
+
+    for path in (padded, relocated):
+        data, metadata = read_patched_metadata(path)
+        assert metadata["udta"] == gopro_udta
+        assert metadata["movie"] == (3700000000, 3700000100)
+        # mdat must stay where the moov chunk offsets expect it.
+        mdat = video.find_mp4_box(data, b"mdat")
+        assert data[mdat.payload_offset : mdat.end] == b"\xab" * 64
+    assert relocated.stat().st_size > original_size
+    assert [box.kind for box in video.iter_mp4_boxes(relocated.read_bytes())] == [
+        b"ftyp",
+        b"free",
+        b"mdat",
+        b"moov",
+    ]
+
+
+def test_copy_output_metadata_falls_back_to_external_tools(monkeypatch, tmp_path):
+    source = tmp_path / "GH010001.MP4"
+    source.write_bytes(b"not an mp4 file")
+    output = tmp_path / "out.MP4.partial"
+    output.write_bytes(b"also not an mp4 file")
+    plan = video.SequencePlan(
+        "0001",
+        [str(source)],
+        str(tmp_path / "out.MP4"),
+        [DummyProbe([DummyStream()])],
+        [],
+        has_telemetry=True,
+    )
+    calls = []
+    monkeypatch.setattr(video, "run_command", lambda argv, context: calls.append(argv[0]))
+
+    video.copy_output_metadata(plan)
+
+    assert calls == ["udtacopy", "exiftool"]
+    assert output.read_bytes() == b"also not an mp4 file"
+
+
+def test_sequence_tracker_waits_for_quiet_period():
+    tracker = video.SequenceTracker(quiet_period=10)
+    first = (("GH010070.MP4", 100, 1),)
+    grown = (("GH010070.MP4", 200, 2),)
+
+    assert not tracker.observe("0070", first, 0)
+    assert not tracker.observe("0070", grown, 5)
+    assert not tracker.observe("0070", grown, 14)
+    assert tracker.observe("0070", grown, 15)
+    assert not tracker.observe("0070", grown, 100)
+    # A new chapter after conversion queues the sequence again once it settles.
+    more = (*grown, ("GH020070.MP4", 50, 3))
+    assert not tracker.observe("0070", more, 101)
+    assert tracker.observe("0070", more, 111)
+
+
+class ScriptedWatcher:
+    """Watcher that drops files into the folder on each wake-up, then stops the loop."""
+
+    def __init__(self, steps, stop):
+        self.steps = list(steps)
+        self.stop = stop
+        self.closed = False
+
+    def wait(self, _timeout):
+        if self.steps:
+            self.steps.pop(0)()
+        else:
+            self.stop.set()
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+def test_watch_videos_converts_sequences_once_chapters_settle(monkeypatch, tmp_path):
+    (tmp_path / "GH010071.MP4").write_text("chapter")
+    converted = []
+
+    def fake_convert_sequence(path, sequence, *_args, **kwargs):
+        converted.append((sequence, sorted(os.listdir(os.path.join(path, sequence)))))
+        # The output lands next to the folders and must not be sorted again.
+        (tmp_path / f"GH01{sequence}.MP4").write_text("output")
+
+    monkeypatch.setattr(video, "convert_sequence", fake_convert_sequence)
+    ledger = video.JobLedger(str(tmp_path.parent / f"{tmp_path.name}-ledger.sqlite3"))
+    ledger.start("0070", [], "settings")  # Left running by a crashed daemon.
+    monkeypatch.setattr(video, "_JOB_LEDGER", ledger)
+    stop = video.Event()
+    watcher = ScriptedWatcher(
+        [
+            lambda: (tmp_path / "GH020071.MP4").write_text("chapter"),
+            lambda: None,
+            lambda: (tmp_path / "GX010072.MP4").write_text("chapter"),
+            lambda: None,
+            lambda: None,
+        ],
+        stop,
+    )
+
+    video.watch_videos(
+        str(tmp_path), [], 0.12, 25, 0.7, True, quiet_period=0, stop=stop, watcher=watcher
+    )
+
+    assert converted == [
+        ("0071", ["GH010071.MP4", "GH020071.MP4"]),
+        ("0072", ["GX010072.MP4"]),
+    ]
+    assert (tmp_path / "GH010071.MP4").read_text() == "output"
+    assert watcher.closed
+    totals, problems = ledger.summary()
+    assert totals["pending"][0] == 2
+    assert problems == [("0070", "failed", 1, "interrupted")]
+    ledger.close()
+
+
+def test_inotify_watcher_wakes_on_new_file(tmp_path):
+    watcher = video.open_directory_watcher(str(tmp_path))
+    if isinstance(watcher, video.PollingWatcher):
+        pytest.skip("inotify is not available")
+    try:
+        assert not watcher.wait(0)
+        (tmp_path / "GH010073.MP4").write_text("chapter")
+        assert watcher.wait(5)
+        assert not watcher.wait(0)
+    finally:
+        watcher.close()
+
+
+def test_job_ledger_resumes_only_matching_runs(monkeypatch, tmp_path):
+    sequence_path = tmp_path / "0080"
+    sequence_path.mkdir()
+    (sequence_path / "GH010080.MP4").write_text("video")
+    (tmp_path / "GH010080.MP4").write_text("output of an unknown older run")
+    commands = []
+
+    def fake_run_command(cmd, *_args, **_kwargs):
+        argv = video.command_argv(cmd)
+        commands.append(argv[0])
+        if argv[0] == "fail":
+            raise video.VideoConversionError("encoder crashed")
+        with open(argv[-1], "w") as output:
+            output.write("encoded")
+
+    video.reset_signal_state()
+    monkeypatch.setattr(
+        video, "probeVideo", lambda _source: DummyProbe([DummyStream(), DummyStream()])
+    )
+    monkeypatch.setattr(video, "run_command", fake_run_command)
+    ledger = video.JobLedger(str(tmp_path / video.JOB_LEDGER_FILENAME))
+    video.configure_job_ledger(ledger)
+
+    def convert(mbits_max=25):
+        commands.clear()
+        video.convertVideos(
+            str(tmp_path), ["ffmpeg"], 0.12, mbits_max, 0.7, True, resume=True, sequences=["0080"]
+        )
+        return list(commands)
+
+    try:
+        # Without a ledger record, an existing output is trusted as before.
+        assert convert() == []
+        ledger.start("0080", [], "old-settings")
+        ledger.finish("0080", 1)
+        assert convert()[0] == "ffmpeg"
+        assert convert() == []
+        assert convert(mbits_max=15)[0] == "ffmpeg"
+        (sequence_path / "GH010080.MP4").write_text("re-imported chapter")
+        monkeypatch.setattr(video, "encode_command", lambda *_args: ["fail"])
+        with pytest.raises(video.VideoConversionError, match="encoder crashed"):
+            convert(mbits_max=15)
+    finally:
+        video.configure_job_ledger(None)
+
+    status = video.format_ledger_status(ledger)
+    assert "failed        1" in status
+    assert "0080 failed after 4 attempt(s): encoder crashed" in status
+
+
+def test_job_ledger_recovers_interrupted_runs(tmp_path):
+    ledger = video.JobLedger(str(tmp_path / video.JOB_LEDGER_FILENAME))
+    ledger.enqueue(["0081", "0082"])
+    ledger.start("0081", [["GH010081.MP4", 5, 1]], "settings")
+
+    ledger.recover()
+    ledger.enqueue(["0081", "0082"])
+
+    totals, problems = ledger.summary()
+    assert totals["pending"][0] == 1
+    assert problems == [("0081", "failed", 1, "interrupted")]
+
+
+def test_pipeline_records_planning_failures_in_the_ledger(monkeypatch, tmp_path):
+    ledger = video.JobLedger(str(tmp_path / video.JOB_LEDGER_FILENAME))
+    monkeypatch.setattr(video, "_JOB_LEDGER", ledger)
+
+    def broken_probe(_source):
+        raise video.VideoConversionError("unreadable chapter")
+
+    monkeypatch.setattr(video, "probeVideo", broken_probe)
+    make_sequences(tmp_path, ["0083"])
+
+    with pytest.raises(video.VideoConversionError, match="unreadable chapter"):
+        video.convertVideos(str(tmp_path), [], 0.12, 25, 0.7, True, sequences=["0083"])
+
+    totals, problems = ledger.summary()
+    assert "pending" not in totals
+    assert problems == [("0083", "failed", 0, "unreadable chapter")]
+    ledger.close()
+
+
+def test_plan_segments_covers_duration_with_open_last_segment():
+    assert video.plan_segments(700.0, 300.0) == [(0.0, 300.0), (300.0, 300.0), (600.0, None)]
+    assert video.plan_segments(300.0, 300.0) == []
+    assert video.plan_segments(None, 300.0) == []
+
+
+def test_encode_sequence_segmented_resumes_after_interruption(monkeypatch, tmp_path):
+    chapter = tmp_path / "0090" / "GH010090.MP4"
+    chapter.parent.mkdir()
+    chapter.write_text("video")
+    plan = video.SequencePlan(
+        "0090",
+        [str(chapter)],
+        str(tmp_path / "GH010090.MP4"),
+        [DummyProbe([DummyStream()])],
+        ["-c:v", "libx265"],
+        bitrate=1000,
+        segments=video.plan_segments(700.0, 300.0),
+    )
+    commands = []
+    interrupt_at = ["segment_0001.mp4.partial"]
+
+    def fake_run(cmd, _context, **_kwargs):
+        argv = video.command_argv(cmd)
+        commands.append(" ".join(argv))
+        if interrupt_at and argv[-1].endswith(interrupt_at[0]):
+            with open(argv[-1], "w") as output:
+                output.write("half a segment")
+            raise video.VideoConversionError("Command failed during encoding: terminated")
+        with open(argv[-1], "w") as output:
+            output.write("encoded")
+
+    video.reset_signal_state()
+    monkeypatch.setattr(video, "run_command", fake_run)
+
+    with pytest.raises(video.VideoConversionError, match="terminated"):
+        video.encode_sequence_segmented(plan, "/tmp/concat.txt")
+    video.cleanup_temporary_artifacts()
+
+    assert sorted(os.listdir(plan.segment_dir)) == ["manifest.json", "segment_0000.mp4"]
+    assert "-ss 0.000 -t 300.000 -f concat" in commands[0]
+
+    commands.clear()
+    interrupt_at.clear()
+    video.reset_signal_state()
+    video.encode_sequence_segmented(plan, "/tmp/concat.txt")
+
+    assert len(commands) == 3
+    assert "-ss 300.000 -t 300.000" in commands[0]
+    assert "-ss 600.000 -f concat" in commands[1]
+    assert commands[2].endswith(plan.partial_destination)
+    with open(os.path.join(plan.segment_dir, "encoded.txt")) as encoded_list:
+        assert encoded_list.read().count("segment_000") == 3
+    assert not video._TRACKED_PARTIAL_OUTPUTS
+
+    # Different encoder settings invalidate the finished segments.
+    commands.clear()
+    plan.bitrate = 2000
+    video.encode_sequence_segmented(plan, "/tmp/concat.txt")
+    assert len(commands) == 4
+
+
+def test_chapter_read_ahead_follows_encoder_position(monkeypatch, tmp_path):
+    chapters = []
+    for index in range(3):
+        chapter = tmp_path / f"GH0{index + 1}0110.MP4"
+        chapter.write_bytes(b"x" * 1024)
+        chapters.append(str(chapter))
+    advice = []
+    monkeypatch.setattr(video, "advise_file", lambda path, hint: advice.append((hint, path)))
+    read_ahead = video.ChapterReadAhead(chapters, [10.0, 10.0, 10.0])
+    willneed, dontneed = "POSIX_FADV_WILLNEED", "POSIX_FADV_DONTNEED"
+
+    read_ahead.start()
+    assert advice == [(willneed, chapters[0]), (willneed, chapters[1])]
+    advice.clear()
+    read_ahead.advance(9.5)
+    assert advice == []
+    read_ahead.advance(12.0)
+    assert advice == [(dontneed, chapters[0]), (willneed, chapters[2])]
+    advice.clear()
+    read_ahead.advance(None)
+    read_ahead.close()
+    assert advice == [(dontneed, chapter) for chapter in chapters]
+
+
+def test_chapter_read_ahead_without_fadvise_hints(monkeypatch, tmp_path):
+    chapter = tmp_path / "GH010112.MP4"
+    chapter.write_bytes(b"x" * 1024)
+    for name in ("POSIX_FADV_WILLNEED", "POSIX_FADV_DONTNEED"):
+        monkeypatch.delattr(video.os, name, raising=False)
+
+    read_ahead = video.ChapterReadAhead([str(chapter)], [10.0])
+    read_ahead.start()
+    read_ahead.advance(5.0)
+    read_ahead.close()
+
+
+def test_device_reader_limit_serializes_sequences_on_one_device(tmp_path):
+    chapter = tmp_path / "GH010111.MP4"
+    chapter.write_bytes(b"x")
+    video.configure_device_readers(1)
+    first = video.ChapterReadAhead([str(chapter)], [None])
+    second = video.ChapterReadAhead([str(chapter)], [None])
+    started = video.Event()
+
+    def start_second():
+        second.start()
+        started.set()
+
+    try:
+        first.start()
+        waiter = video.Thread(target=start_second, daemon=True)
+        waiter.start()
+        assert not started.wait(0.2)
+        first.close()
+        assert started.wait(5)
+        second.close()
+    finally:
+        video.configure_device_readers(None)
+
+
+def test_move_output_copies_across_filesystems_and_verifies(monkeypatch, tmp_path):
+    scratch = tmp_path / "scratch"
+    archive = tmp_path / "archive"
+    scratch.mkdir()
+    archive.mkdir()
+    partial = scratch / "GH010120.MP4.partial"
+    partial.write_bytes(os.urandom(300_000))
+    payload = partial.read_bytes()
+    destination = archive / "GH010120.MP4"
+    real_replace = os.replace
+    staged_during_copy = []
+
+    def cross_device_replace(source, target):
+        if str(source).startswith(str(scratch)):
+            raise OSError(video.errno.EXDEV, "Invalid cross-device link")
+        staged_during_copy.append(set(video._TRACKED_PARTIAL_OUTPUTS))
+        real_replace(source, target)
+
+    def no_copy_file_range(*_args):
+        raise OSError(video.errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(video.os, "replace", cross_device_replace)
+    monkeypatch.setattr(video.os, "copy_file_range", no_copy_file_range, raising=False)
+    monkeypatch.setattr(video, "COPY_CHUNK_SIZE", 65536)
+    video.register_partial_output(str(partial))
+
+    video.move_output(str(partial), str(destination))
+
+    assert destination.read_bytes() == payload
+    assert not partial.exists()
+    assert not (archive / "GH010120.MP4.partial").exists()
+    # Both the scratch file and the staged copy were tracked while the copy ran.
+    assert staged_during_copy == [{str(partial), f"{destination}.partial"}]
+    assert not video._TRACKED_PARTIAL_OUTPUTS
+
+
+def test_plan_sequence_places_outputs_and_work_files(monkeypatch, tmp_path):
+    make_sequences(tmp_path, ["0121"])
+    monkeypatch.setattr(
+        video, "probeVideo", lambda _source: DummyProbe([DummyStream(), DummyStream()])
+    )
+
+    plan = video.plan_sequence(
+        str(tmp_path),
+        "0121",
+        [],
+        0.12,
+        25,
+        0.7,
+        True,
+        output_dir="/archive",
+        scratch_dir="/scratch",
+    )
+
+    assert plan.destination == "/archive/GH010121.MP4"
+    assert plan.partial_destination == "/scratch/GH010121.MP4.partial"
+    assert plan.segment_dir == "/scratch/GH010121.MP4.segments"
+
+
+def test_plan_sequence_downscales_and_decimates(monkeypatch, tmp_path):
+    make_sequences(tmp_path, ["0122"])
+    uhd = DummyStream(
+        coded_height=2160,
+        coded_width=3840,
+        framerate=120000 / 1001,
+        bit_rate=100_000_000,
+        codec_name="hevc",
+    )
+    monkeypatch.setattr(video, "probeVideo", lambda _source: DummyProbe([uhd, DummyStream()]))
+
+    plan = video.plan_sequence(
+        str(tmp_path), "0122", [], 0.12, 25, 0.7, True, codec="h265", max_height=1080, max_fps=60
+    )
+
+    assert plan.convert
+    assert plan.bitrate == video.BITRATE_1080P
+    # Every other frame is kept, so NTSC footage stays NTSC and motion stays even.
+    assert plan.video_filter == "fps=60000/1001,scale=-2:1080:flags=lanczos"
+    assert plan.encoder_args()[-2:] == ["-vf", plan.video_filter]
+    assert video.output_geometry(3840, 2160, 120000 / 1001, 1080, 60)[:3] == (
+        1920,
+        1080,
+        60000 / 1001,
+    )
+    assert video.output_geometry(1920, 1080, 240.0, None, 60)[2:] == (60.0, "fps=60")
+    assert video.output_geometry(1920, 1080, 120000 / 1001, None, 59.94)[3] == "fps=60000/1001"
+    assert video.output_geometry(1920, 1080, 30.0, 1080, 60) == (1920, 1080, 30.0, None)
+
+
+def test_sequence_lease_blocks_live_holders_and_reclaims_expired(tmp_path):
+    holder = video.SequenceLease(str(tmp_path), "0200", ttl=60)
+    assert holder.acquire()
+    assert not video.SequenceLease(str(tmp_path), "0200", ttl=60).acquire()
+    assert holder.renew()
+
+    lease_path = tmp_path / ".0200.lease"
+    record = json.loads(lease_path.read_text())
+    lease_path.write_text(json.dumps({**record, "heartbeat": time.time() - 120}))
+    successor = video.SequenceLease(str(tmp_path), "0200", ttl=60)
+
+    assert successor.acquire()
+    assert json.loads(lease_path.read_text())["token"] == successor.token
+    assert not holder.renew()
+    holder.release()
+    assert lease_path.exists()
+    successor.release()
+    assert os.listdir(tmp_path) == []
+
+
+def run_lease_worker(path, log_path):
+    def fake_convert(folder, sequence, *_args, **_kwargs):
+        with open(log_path, "a") as log:
+            log.write(f"{sequence} {os.getpid()}\n")
+        time.sleep(0.02)
+        _, files = video.list_sequence_chapters(folder, sequence)
+        with open(os.path.join(folder, files[0]), "w") as output:
+            output.write("output")
+
+    video.convert_sequence = fake_convert
+    video.work_shared_folder(path, [], 0.12, 25, 0.7, True, jobs=2, poll_interval=0.01)
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(), reason="needs fork start method"
+)
+def test_lease_workers_in_several_processes_convert_each_sequence_once(tmp_path):
+    sequences = [f"{number:04d}" for number in range(300, 340)]
+    for sequence in sequences:
+        (tmp_path / f"GH01{sequence}.MP4").write_text("video")
+    log_path = tmp_path.parent / f"{tmp_path.name}-claims.log"
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=run_lease_worker, args=(str(tmp_path), str(log_path)))
+        for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+
+    assert [worker.exitcode for worker in workers] == [0] * 4
+    claims = [line.split()[0] for line in log_path.read_text().splitlines()]
+    assert sorted(claims) == sequences
+    assert all((tmp_path / f"GH01{sequence}.MP4").exists() for sequence in sequences)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".lease")]
+
+
+def test_archive_index_skips_and_links_reimported_sequences(monkeypatch, tmp_path):
+    monkeypatch.setattr(video, "FINGERPRINT_BLOCK_SIZE", 4)
+    monkeypatch.setattr(video, "probeVideo", lambda _source: DummyProbe([DummyStream()] * 2))
+    archive = video.ArchiveIndex(str(tmp_path / "index" / "archive.sqlite3"))
+    monkeypatch.setattr(video, "_ARCHIVE_INDEX", archive)
+    footage = bytes(range(64))
+    folders = {name: tmp_path / name for name in ("first", "card", "copy")}
+    for name in ("first", "copy"):
+        (folders[name] / "0400").mkdir(parents=True)
+        (folders[name] / "0400" / "GH010400.MP4").write_bytes(footage)
+    folders["card"].mkdir()
+    (folders["card"] / "GH010400.MP4").write_bytes(footage)
+
+    plan = video.plan_sequence(
+        str(folders["first"]), "0400", [], 0.12, 25, 0.7, True, options_hash="a"
+    )
+    (folders["first"] / "GH010400.MP4").write_bytes(b"encoded")
+    video.record_sequence_result(plan)
+
+    # A re-imported card is left in place, an organized copy is linked to the output.
+    card = str(folders["card"])
+    assert video.videostofolders(["GH010400.MP4"], card, options_hash="a") == []
+    assert (folders["card"] / "GH010400.MP4").exists()
+    # Other settings still need the footage organized and converted.
+    assert video.videostofolders(["GH010400.MP4"], card, dry_run=True, options_hash="b") == ["0400"]
+    args = (str(folders["copy"]), "0400", [], 0.12, 25, 0.7, True)
+    assert video.plan_sequence(*args, options_hash="a") is None
+    assert os.path.samefile(folders["copy"] / "GH010400.MP4", folders["first"] / "GH010400.MP4")
+    assert video.plan_sequence(*args, options_hash="other-settings") is not None
+
+    # Only the head, middle and tail blocks are hashed.
+    same = bytearray(footage)
+    same[10] ^= 0xFF
+    (tmp_path / "same.MP4").write_bytes(same)
+    (tmp_path / "other.MP4").write_bytes(footage[:-1] + b"x")
+    fingerprint = video.chapter_fingerprint(str(folders["card"] / "GH010400.MP4"))
+    assert video.chapter_fingerprint(str(tmp_path / "same.MP4")) == fingerprint
+    assert video.chapter_fingerprint(str(tmp_path / "other.MP4")) != fingerprint
+    archive.close()
+
+
+def test_proxy_and_thumbnails_share_the_archive_decode(monkeypatch, tmp_path):
+    make_sequences(tmp_path, ["0500"])
+    monkeypatch.setattr(video, "probeVideo", lambda _source: DummyProbe([DummyStream()] * 2))
+    plan = video.plan_sequence(
+        str(tmp_path),
+        "0500",
+        ["-c:v", "libx265"],
+        0.12,
+        25,
+        0.7,
+        True,
+        proxy=True,
+        thumbnail_interval=5,
+        max_height=720,
+    )
+    thumbnails = tmp_path / "thumbnails" / "GH010500"
+    thumbnails.mkdir(parents=True)
+    (thumbnails / "00001.jpg").write_bytes(b"old")
+
+    def fake_run(command, _context, **_kwargs):
+        argv = command.argv()
+        graph = argv[argv.index("-filter_complex") + 1]
+        assert argv.count("-i") == 1
+        assert graph.startswith(
+            "[0:v:0]split=3[v0][v1][v2];[v0]scale=-2:720:flags=lanczos[archive]"
+        )
+        assert "[v2]fps=1/5,scale=-2:360[thumbs]" in graph
+        assert argv[argv.index("-map") + 1] == "[archive]"
+        for output in (plan.partial_destination, plan.proxy_partial):
+            with open(output, "w") as output_file:
+                output_file.write("encoded")
+        with open(os.path.join(plan.thumbnail_partial_dir, "00001.jpg"), "w") as thumb:
+            thumb.write("new")
+
+    monkeypatch.setattr(video, "run_command", fake_run)
+    monkeypatch.setattr(video, "copy_output_metadata", lambda _plan: None)
+    video.encode_sequence_plan(plan)
+    video.finish_sequence_plan(plan)
+
+    assert (tmp_path / "GH010500.MP4").read_text() == "encoded"
+    assert (tmp_path / "proxies" / "GH010500.MP4").read_text() == "encoded"
+    assert (thumbnails / "00001.jpg").read_text() == "new"
+    assert not os.path.exists(plan.thumbnail_partial_dir)
+    assert video.list_sequence_folders(str(tmp_path)) == ["0500"]
+
+
+def test_plan_lists_the_derived_outputs_pass_of_split_encodes(monkeypatch, tmp_path):
+    make_sequences(tmp_path, ["0501"])
+    monkeypatch.setattr(video, "probeVideo", lambda _source: DummyProbe([DummyStream()] * 2))
+    args = (str(tmp_path), "0501", ["-c:v", "libx265"], 0.12, 25, 0.7, True)
+    plan = video.plan_sequence(*args, proxy=True)
+    plan.chunk_boundaries = [10.0]
+
+    commands = video.describe_sequence_plan(plan)
+    derived = video.command_argv(video.derived_outputs_command(plan, video.CONCAT_LIST_PLACEHOLDER))
+
+    assert commands[-1 - len(video.metadata_commands(plan))] == derived
+    plan.chunk_boundaries = []
+    assert derived not in video.describe_sequence_plan(plan)
+
+
+def test_run_command_async_feeds_progress():
+    script = "print('out_time_us=1000000'); print('progress=end')"
+    lines = []
+
+    class Recorder:
+        def feed_line(self, line):
+            lines.append(line.strip())
+
+        def finish(self, returncode):
+            lines.append(returncode)
+
+    tracker = video.ArtifactTracker()
+    with video.use_tracker(tracker):
+        asyncio.run(video.run_command_async([sys.executable, "-c", script], "test", Recorder()))
+
+    assert lines == ["out_time_us=1000000", "progress=end", 0]
+    assert not tracker.processes
+
+
+def test_run_command_async_refuses_cancelled_tracker():
+    tracker = video.ArtifactTracker()
+    tracker.cancel()
+    with video.use_tracker(tracker), pytest.raises(video.VideoConversionError, match="Shutdown"):
+        asyncio.run(video.run_command_async([sys.executable, "-c", "pass"], "test"))
+
+
+def test_use_tracker_keeps_artifacts_out_of_the_default_tracker(tmp_path):
+    video._TRACKED_TEMP_FILES.clear()
+    leftover = tmp_path / "concat.txt"
+    leftover.write_text("file 'a'\n")
+    tracker = video.ArtifactTracker()
+
+    with video.use_tracker(tracker):
+        video.register_temp_file(str(leftover))
+
+    assert tracker.temp_files == {str(leftover)}
+    assert not video._TRACKED_TEMP_FILES
+    tracker.cleanup()
+    assert not leftover.exists()
+    assert not tracker.temp_files
+
+
+def test_encode_sequence_plan_async_shares_the_staging(monkeypatch, tmp_path):
+    make_sequences(tmp_path, ["0008"])
+    monkeypatch.setattr(video, "probeVideo", lambda _source: DummyProbe([DummyStream()] * 2))
+    plan = video.plan_sequence(str(tmp_path), "0008", [], 0.12, 25, 0.7, True)
+    concat_paths = []
+
+    def fake_encode_command(plan, concat_path):
+        concat_paths.append(concat_path)
+        write = f"open({plan.partial_destination!r}, 'w').write('x')"
+        return [sys.executable, "-c", f"{write}; raise SystemExit({len(concat_paths) - 1})"]
+
+    monkeypatch.setattr(video, "encode_command", fake_encode_command)
+    tracker = video.ArtifactTracker()
+    with video.use_tracker(tracker):
+        asyncio.run(video.encode_sequence_plan_async(plan))
+        assert os.path.exists(plan.partial_destination)
+        with pytest.raises(video.VideoConversionError, match="Command failed"):
+            asyncio.run(video.encode_sequence_plan_async(plan))
+
+    assert not os.path.exists(plan.partial_destination)
+    assert not any(os.path.exists(path) for path in concat_paths)
+    assert not tracker.temp_files and not tracker.partial_outputs
+
+
+def test_converter_cancellation_stops_ffmpeg_and_removes_partial(tmp_path, monkeypatch):
+    video.reset_signal_state()
+    video._TRACKED_PARTIAL_OUTPUTS.clear()
+    partial = tmp_path / "GH010001.MP4.partial"
+    started = []
+
+    async def fake_encode(plan, _preset_tuner=None):
+        video.register_partial_output(plan.partial_destination)
+        partial.write_bytes(b"partial")
+        started.append(video.current_tracker())
+        await video.run_command_async([sys.executable, "-c", "import time; time.sleep(30)"])
+
+    monkeypatch.setattr(video, "encode_sequence_plan_async", fake_encode)
+    converter = video.Converter(str(tmp_path), ["-c:v", "libx265"])
+    plan = type("Plan", (), {"sequence": "0001", "partial_destination": str(partial)})()
+
+    async def cancel_running_execute():
+        task = asyncio.create_task(converter.execute(plan))
+        while not (started and started[0].processes):
+            await asyncio.sleep(0.01)
+        process = next(iter(started[0].processes))
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return process
+
+    process = asyncio.run(cancel_running_execute())
+
+    assert process.returncode is not None
+    assert not partial.exists()
+    assert not started[0].partial_outputs
+    assert not video._TRACKED_PARTIAL_OUTPUTS
+
+
+def test_converter_convert_limits_concurrency_and_reports_failures(tmp_path, monkeypatch):
+    running = []
+    peak = []
+
+    async def fake_plan(self, sequence):
+        return sequence
+
+    async def fake_execute(self, plan):
+        running.append(plan)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(plan)
+        if plan == "0002":
+            raise video.VideoConversionError("encode failed")
+
+    monkeypatch.setattr(video.Converter, "plan", fake_plan)
+    monkeypatch.setattr(video.Converter, "_execute", fake_execute)
+    converter = video.Converter(str(tmp_path), [], max_concurrency=2)
+
+    failures = asyncio.run(converter.convert(["0001", "0002", "0003", "0004"]))
+
+    assert list(failures) == ["0002"]
+    assert max(peak) == 2
+
+
+def test_main_reports_missing_videos_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(video, "configure_logging", lambda: None)
+    monkeypatch.setattr(video, "configure_signal_handlers", lambda: None)
+
+    assert video.main(["-v", str(tmp_path / "missing")]) == 1
+
+
+def test_open_source_cache_continues_without_an_unusable_cache(tmp_path):
+    blocker = tmp_path / "not-a-directory"
+    blocker.write_text("")
+
+    assert video.open_source_cache(str(blocker / "source-cache.sqlite3")) is None
+
+
+def test_sqlite_stores_log_failed_statements_instead_of_raising(tmp_path):
+    ledger = video.JobLedger(str(tmp_path / "ledger.sqlite3"))
+    archive = video.ArchiveIndex(str(tmp_path / "index" / "archive.sqlite3"))
+    ledger.close()
+    archive.close()
+
+    assert ledger.check("0001", [], "hash", str(tmp_path / "out.MP4")) is None
+    assert archive.lookup("key") is None
+    with pytest.raises(video.VideoConversionError, match="Failed to open archive index"):
+        video.ArchiveIndex(str(tmp_path / "ledger.sqlite3" / "archive.sqlite3"))
+
+
+def test_list_sequence_folders_skips_work_directories(tmp_path):
+    make_sequences(tmp_path, ["0001", "0002"])
+    (tmp_path / "GH010001.MP4.partial.chunks").mkdir()
+    (tmp_path / "GH010002.MP4.segments").mkdir()
+
+    assert video.list_sequence_folders(str(tmp_path)) == ["0001", "0002"]
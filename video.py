@@ -1,29 +1,100 @@
 #!/usr/bin/python3
 
 import argparse
+import asyncio
 import atexit
+import contextlib
+import contextvars
+import ctypes
+import errno
+import hashlib
+import json
 import logging
+import math
+import mmap
 import os
+import re
+import select
 import shlex
 import shutil
 import signal
+import sqlite3
+import struct
 import subprocess
 import sys
 import tempfile
-from threading import RLock
-
-from ffprobe import FFProbe
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from queue import Empty, Queue
+from threading import BoundedSemaphore, Event, RLock, Thread
 
 logger = logging.getLogger(__name__)
 
 _TRACKED_TEMP_FILES = set()
 _TRACKED_PARTIAL_OUTPUTS = set()
+_TRACKED_TEMP_DIRS = set()
+_ACTIVE_PROCESSES = set()
 _SIGNAL_HANDLED = False
 _CLEANUP_DONE = False
 _TEMP_LOCK = RLock()
+_SOURCE_CACHE = None
+_PROGRESS_BOARD = None
+_EXIFTOOL_SESSION = None
+_JOB_LEDGER = None
+_ARCHIVE_INDEX = None
+_DEVICE_READER_LIMIT = None
+_DEVICE_READERS = {}
 EXIT_CODE_SIGINT = 130  # Standard Unix exit code for SIGINT (128 + 2).
 EXIT_CODE_SIGTERM = 143  # Standard Unix exit code for SIGTERM (128 + 15).
 PARTIAL_OUTPUT_SUFFIX = ".partial"
+CONCAT_LIST_PLACEHOLDER = "<concat-list>"  # Stands in for the temporary list in --plan output.
+SOURCE_CACHE_FILENAME = "source-cache.sqlite3"
+ARCHIVE_INDEX_FILENAME = "archive-index.sqlite3"
+FINGERPRINT_BLOCK_SIZE = 4 * 1024 * 1024  # Bytes hashed at the head, middle and tail.
+FINGERPRINT_CACHE_KIND = "fingerprint-blake2b-3x4MiB"
+SOURCE_CACHE_MAX_AGE_SECONDS = 90 * 24 * 60 * 60  # Drop entries unused for 90 days.
+PROBE_CACHE_KIND = "ffprobe-json"
+COMPLEXITY_PROXY_HEIGHT = 240  # Complexity is measured on a downscaled proxy...
+COMPLEXITY_FRAME_STEP = 10  # ...of every Nth frame.
+# The proxy settings are part of the kind, so changing them never reuses old results.
+COMPLEXITY_CACHE_KIND = f"siti-{COMPLEXITY_PROXY_HEIGHT}p-step{COMPLEXITY_FRAME_STEP}"
+# Mean SI/TI of handheld action footage on that proxy; such footage keeps the base bitrate.
+COMPLEXITY_REFERENCE_SI = 60.0
+COMPLEXITY_REFERENCE_TI = 20.0
+COMPLEXITY_SCALE_MIN = 0.5
+COMPLEXITY_SCALE_MAX = 1.25
+JOB_LEDGER_FILENAME = ".video-conversion.sqlite3"  # Kept in the videos folder.
+JOB_STATUSES = ("pending", "running", "done", "failed")
+FFMPEG_PROGRESS_ARGS = ("-progress", "pipe:1", "-nostats")
+PROGRESS_LOG_INTERVAL = 30.0  # Seconds between progress log lines per sequence.
+STATUS_WRITE_INTERVAL = 1.0  # Minimum seconds between status file rewrites.
+PROBE_MAX_WORKERS = 8  # ffprobe is I/O bound; cap concurrent probes per sequence.
+READ_AHEAD_BYTES = 256 * 1024 * 1024  # Prefetched from the start of the next chapter.
+READ_AHEAD_BLOCK_SIZE = 8 * 1024 * 1024
+COPY_CHUNK_SIZE = 64 * 1024 * 1024  # Bytes per copy_file_range/sendfile call.
+PROXY_DIRNAME = "proxies"  # Editing proxies and thumbnails live next to the outputs.
+THUMBNAIL_DIRNAME = "thumbnails"
+PROXY_HEIGHT = 540
+PROXY_ENCODER_ARGS = [
+    *("-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-g", "30"),
+    *("-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart"),
+]
+THUMBNAIL_HEIGHT = 360
+THUMBNAIL_INTERVAL = 10.0  # Seconds between thumbnails when --thumbnails has no value.
+LEASE_SUFFIX = ".lease"
+LEASE_TTL = 300.0  # Seconds without a heartbeat before another node may take a lease over.
+WORKER_POLL_INTERVAL = 30.0  # Seconds between rescans while other nodes hold the leases.
+# exiftool rewrites the whole output file, so multi-gigabyte sequences need a generous limit.
+EXIFTOOL_TIMEOUT = 600.0
+EXIFTOOL_CLOSE_TIMEOUT = 10.0
+MP4_FREE_BOXES = (b"free", b"skip")
+MP4_MAX_BOX32 = 0xFFFFFFFF
+WATCH_QUIET_PERIOD = 60.0  # Seconds a sequence must stay unchanged before it is converted.
+WATCH_POLL_INTERVAL = 5.0  # Seconds between rescans, even when inotify reports nothing.
+# inotify(7) masks: a chapter appearing or finishing its copy into the watched folder.
+INOTIFY_EVENTS = 0x00000008 | 0x00000080 | 0x00000100  # IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
 
 
 def configure_logging():
@@ -41,28 +112,158 @@ def sanitize_for_log(value):
     return str(value).replace("\n", "\\n").replace("\r", "\\r")
 
 
+class ArtifactTracker:
+    """Temporary files, partial outputs, temporary directories and child processes of a job.
+
+    The CLI records everything in the module-wide default tracker, which the signal
+    handlers clean up; each Converter brings its own so cancelling one library job never
+    touches another job's files. The register_* helpers use current_tracker().
+    """
+
+    def __init__(
+        self, temp_files=None, partial_outputs=None, temp_dirs=None, processes=None, lock=None
+    ):
+        self.temp_files = set() if temp_files is None else temp_files
+        self.partial_outputs = set() if partial_outputs is None else partial_outputs
+        self.temp_dirs = set() if temp_dirs is None else temp_dirs
+        self.processes = set() if processes is None else processes
+        self.lock = RLock() if lock is None else lock
+        self.cancelled = False
+
+    def _discard(self, collection, item):
+        with self.lock:
+            collection.discard(item)
+
+    def terminate_processes(self):
+        """Ask every running child process to stop so in-flight workers can unwind."""
+        with self.lock:
+            processes = list(self.processes)
+
+        for process in processes:
+            try:
+                process.terminate()
+            except ProcessLookupError:
+                # The process already exited; its worker will unregister it.
+                pass
+            except OSError as exc:
+                logger.warning(
+                    "Failed to terminate child process %s: %s",
+                    getattr(process, "pid", "?"),
+                    sanitize_for_log(exc),
+                )
+
+    def cancel(self):
+        """Refuse to start further commands and stop the running ones."""
+        with self.lock:
+            self.cancelled = True
+        self.terminate_processes()
+
+    def cleanup(self):
+        """Remove every tracked temporary file, partial output and temporary directory."""
+        with self.lock:
+            temp_files = list(self.temp_files)
+            partial_outputs = list(self.partial_outputs)
+            temp_dirs = list(self.temp_dirs)
+
+        for path in temp_files:
+            cleanup_tracked_path(
+                path, "temporary file", lambda item: self._discard(self.temp_files, item)
+            )
+
+        for path in partial_outputs:
+            cleanup_tracked_path(
+                path, "partial output", lambda item: self._discard(self.partial_outputs, item)
+            )
+
+        for path in temp_dirs:
+            cleanup_tracked_dir(
+                path, "temporary directory", lambda item: self._discard(self.temp_dirs, item)
+            )
+
+
+# The CLI's tracker keeps the historical module-level sets and lock.
+_DEFAULT_TRACKER = ArtifactTracker(
+    _TRACKED_TEMP_FILES,
+    _TRACKED_PARTIAL_OUTPUTS,
+    _TRACKED_TEMP_DIRS,
+    _ACTIVE_PROCESSES,
+    _TEMP_LOCK,
+)
+_CURRENT_TRACKER = contextvars.ContextVar("artifact_tracker", default=_DEFAULT_TRACKER)
+
+
+def current_tracker():
+    """Return the ArtifactTracker of the running task or thread (the CLI's by default)."""
+    return _CURRENT_TRACKER.get()
+
+
+@contextlib.contextmanager
+def use_tracker(tracker):
+    """Record artifacts in ``tracker`` for the duration of the block."""
+    token = _CURRENT_TRACKER.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _CURRENT_TRACKER.reset(token)
+
+
 def register_temp_file(path):
     if path:
-        with _TEMP_LOCK:
-            _TRACKED_TEMP_FILES.add(path)
+        tracker = current_tracker()
+        with tracker.lock:
+            tracker.temp_files.add(path)
 
 
 def unregister_temp_file(path):
     if path:
-        with _TEMP_LOCK:
-            _TRACKED_TEMP_FILES.discard(path)
+        tracker = current_tracker()
+        with tracker.lock:
+            tracker.temp_files.discard(path)
 
 
 def register_partial_output(path):
     if path:
-        with _TEMP_LOCK:
-            _TRACKED_PARTIAL_OUTPUTS.add(path)
+        tracker = current_tracker()
+        with tracker.lock:
+            tracker.partial_outputs.add(path)
 
 
 def unregister_partial_output(path):
     if path:
-        with _TEMP_LOCK:
-            _TRACKED_PARTIAL_OUTPUTS.discard(path)
+        tracker = current_tracker()
+        with tracker.lock:
+            tracker.partial_outputs.discard(path)
+
+
+def register_temp_dir(path):
+    if path:
+        tracker = current_tracker()
+        with tracker.lock:
+            tracker.temp_dirs.add(path)
+
+
+def unregister_temp_dir(path):
+    if path:
+        tracker = current_tracker()
+        with tracker.lock:
+            tracker.temp_dirs.discard(path)
+
+
+def register_process(process, tracker=None):
+    tracker = tracker or current_tracker()
+    with tracker.lock:
+        tracker.processes.add(process)
+
+
+def unregister_process(process, tracker=None):
+    tracker = tracker or current_tracker()
+    with tracker.lock:
+        tracker.processes.discard(process)
+
+
+def terminate_active_processes():
+    """Ask every child process started by the CLI to stop so in-flight workers can unwind."""
+    _DEFAULT_TRACKER.terminate_processes()
 
 
 def cleanup_temporary_artifacts():
@@ -71,14 +272,7 @@ def cleanup_temporary_artifacts():
         if _CLEANUP_DONE:
             return
         _CLEANUP_DONE = True
-        temp_files = list(_TRACKED_TEMP_FILES)
-        partial_outputs = list(_TRACKED_PARTIAL_OUTPUTS)
-
-    for path in temp_files:
-        cleanup_tracked_path(path, "temporary file", unregister_temp_file)
-
-    for path in partial_outputs:
-        cleanup_tracked_path(path, "partial output", unregister_partial_output)
+    _DEFAULT_TRACKER.cleanup()
 
 
 def cleanup_tracked_path(path, label, unregister_callback=None, *, raise_on_error=False):
@@ -103,6 +297,26 @@ def cleanup_tracked_path(path, label, unregister_callback=None, *, raise_on_erro
             unregister_callback(path)
 
 
+def cleanup_tracked_dir(path, label, unregister_callback=None):
+    if not path:
+        return
+    try:
+        shutil.rmtree(path)
+    except FileNotFoundError:
+        # The directory is already gone; nothing left to clean up.
+        pass
+    except OSError as exc:
+        logger.warning(
+            "Failed to clean up %s %s: %s",
+            label,
+            sanitize_for_log(path),
+            sanitize_for_log(exc),
+        )
+    finally:
+        if unregister_callback:
+            unregister_callback(path)
+
+
 def handle_shutdown_signal(signum, _frame):
     global _SIGNAL_HANDLED
     with _TEMP_LOCK:
@@ -110,6 +324,7 @@ def handle_shutdown_signal(signum, _frame):
             return
         _SIGNAL_HANDLED = True
     logger.info("Received signal %s. Cleaning up temporary files.", signum)
+    terminate_active_processes()
     cleanup_temporary_artifacts()
     if signum == signal.SIGINT:
         raise SystemExit(EXIT_CODE_SIGINT)
@@ -143,13 +358,665 @@ def escape_concat_path(path):
     )
 
 
+def default_cache_path():
+    """Return the source cache location inside the XDG cache directory."""
+    cache_home = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "video-conversion", SOURCE_CACHE_FILENAME)
+
+
+def default_archive_index_path():
+    """Return the archive index location inside the XDG data directory."""
+    data_home = os.getenv("XDG_DATA_HOME") or os.path.join(
+        os.path.expanduser("~"), ".local", "share"
+    )
+    return os.path.join(data_home, "video-conversion", ARCHIVE_INDEX_FILENAME)
+
+
+class SQLiteStore:
+    """A SQLite database whose one connection is shared by worker threads.
+
+    Subclasses set ``label`` and list their ``SCHEMA`` statements; every access goes
+    through ``_lock``. Statements run with ``_execute`` log failures and return no rows,
+    so bookkeeping never stops a conversion.
+    """
+
+    label = "database"
+    SCHEMA = ()
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = RLock()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._connection = sqlite3.connect(db_path, check_same_thread=False)
+            with self._connection:
+                for statement in self.SCHEMA:
+                    self._connection.execute(statement)
+        except (OSError, sqlite3.Error) as exc:
+            raise VideoConversionError(f"Failed to open {self.label} '{db_path}': {exc}") from exc
+
+    def _execute(self, action, statement, parameters=()):
+        try:
+            with self._lock, self._connection:
+                return self._connection.execute(statement, parameters).fetchall()
+        except sqlite3.Error as exc:
+            logger.warning("Failed to %s in the %s: %s", action, self.label, sanitize_for_log(exc))
+            return []
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class SourceCache(SQLiteStore):
+    """SQLite-backed cache of per-source results keyed by absolute path, size and mtime.
+
+    Entries are stored per ``kind`` (for example ``"probe"``) so different analysis
+    results for the same file can share one database. An entry only counts as a hit
+    while the file still has the size and mtime it had when the entry was written.
+    """
+
+    label = "source cache"
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS entries ("
+        " kind TEXT NOT NULL,"
+        " path TEXT NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " mtime_ns INTEGER NOT NULL,"
+        " data TEXT NOT NULL,"
+        " last_used REAL NOT NULL,"
+        " PRIMARY KEY (kind, path))",
+    )
+
+    def __init__(self, db_path, max_age=SOURCE_CACHE_MAX_AGE_SECONDS):
+        super().__init__(db_path)
+        self.hits = Counter()
+        self.misses = Counter()
+        self.evict_stale(max_age)
+
+    def get(self, kind, path):
+        """Return the cached data for ``path`` or None when missing or stale."""
+        abs_path = os.path.abspath(path)
+        try:
+            stat_result = os.stat(abs_path)
+        except OSError:
+            self.misses[kind] += 1
+            return None
+
+        try:
+            with self._lock, self._connection:
+                row = self._connection.execute(
+                    "SELECT size, mtime_ns, data FROM entries WHERE kind = ? AND path = ?",
+                    (kind, abs_path),
+                ).fetchone()
+                if row is None:
+                    self.misses[kind] += 1
+                    return None
+                size, mtime_ns, data = row
+                if size != stat_result.st_size or mtime_ns != stat_result.st_mtime_ns:
+                    # The file changed since it was cached; the entry can never hit again.
+                    self._connection.execute(
+                        "DELETE FROM entries WHERE kind = ? AND path = ?", (kind, abs_path)
+                    )
+                    self.misses[kind] += 1
+                    return None
+                self._connection.execute(
+                    "UPDATE entries SET last_used = ? WHERE kind = ? AND path = ?",
+                    (time.time(), kind, abs_path),
+                )
+                self.hits[kind] += 1
+            return json.loads(data)
+        except (sqlite3.Error, ValueError) as exc:
+            logger.warning(
+                "Ignoring unreadable %s cache entry for '%s': %s",
+                kind,
+                sanitize_for_log(abs_path),
+                sanitize_for_log(exc),
+            )
+            self.misses[kind] += 1
+            return None
+
+    def put(self, kind, path, data):
+        """Store JSON-serializable ``data`` for the current size and mtime of ``path``."""
+        abs_path = os.path.abspath(path)
+        try:
+            stat_result = os.stat(abs_path)
+            payload = json.dumps(data)
+            with self._lock, self._connection:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO entries"
+                    " (kind, path, size, mtime_ns, data, last_used)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        kind,
+                        abs_path,
+                        stat_result.st_size,
+                        stat_result.st_mtime_ns,
+                        payload,
+                        time.time(),
+                    ),
+                )
+        except (OSError, sqlite3.Error, TypeError, ValueError) as exc:
+            logger.warning(
+                "Failed to cache %s result for '%s': %s",
+                kind,
+                sanitize_for_log(abs_path),
+                sanitize_for_log(exc),
+            )
+
+    def evict_stale(self, max_age=SOURCE_CACHE_MAX_AGE_SECONDS):
+        """Remove entries that have not been used within ``max_age`` seconds."""
+        cutoff = time.time() - max_age
+        try:
+            with self._lock, self._connection:
+                cursor = self._connection.execute(
+                    "DELETE FROM entries WHERE last_used < ?", (cutoff,)
+                )
+            return cursor.rowcount
+        except sqlite3.Error as exc:
+            logger.warning("Failed to evict stale cache entries: %s", sanitize_for_log(exc))
+            return 0
+
+
+def open_source_cache(db_path):
+    """Return a SourceCache for ``db_path``, or None when it cannot be opened.
+
+    The cache only saves work, so a read-only cache directory must not stop a run.
+    """
+    try:
+        return SourceCache(db_path)
+    except VideoConversionError as exc:
+        logger.warning("Continuing without the source cache: %s", sanitize_for_log(exc))
+        return None
+
+
+def configure_source_cache(cache):
+    """Install ``cache`` (or None to disable caching) for probeVideo and friends."""
+    global _SOURCE_CACHE
+    with _TEMP_LOCK:
+        _SOURCE_CACHE = cache
+
+
+def report_source_cache():
+    cache = _SOURCE_CACHE
+    if cache is None:
+        return
+    for kind in sorted(set(cache.hits) | set(cache.misses)):
+        logger.info(
+            "%s cache: %d hit(s), %d miss(es)",
+            kind.capitalize(),
+            cache.hits[kind],
+            cache.misses[kind],
+        )
+
+
+class JobLedger(SQLiteStore):
+    """SQLite record of every sequence's inputs, settings and outcome in a videos folder.
+
+    A sequence counts as converted only while its chapters (name, size, mtime), the
+    hash of the settings used and the output size all match the recorded run.
+    """
+
+    label = "job ledger"
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        " sequence TEXT PRIMARY KEY,"
+        " inputs TEXT NOT NULL,"
+        " options_hash TEXT NOT NULL,"
+        " status TEXT NOT NULL,"
+        " attempts INTEGER NOT NULL DEFAULT 0,"
+        " started REAL,"
+        " finished REAL,"
+        " duration REAL,"
+        " output_size INTEGER,"
+        " error TEXT,"
+        " updated REAL NOT NULL)",
+    )
+
+    def recover(self):
+        """Mark runs left 'running' by a crashed or killed process as failed."""
+        self._execute(
+            "recover interrupted jobs",
+            "UPDATE jobs SET status = 'failed', error = 'interrupted', updated = ?"
+            " WHERE status = 'running'",
+            (time.time(),),
+        )
+
+    def enqueue(self, sequences):
+        """Add a pending row for every sequence the ledger has not seen yet."""
+        now = time.time()
+        for sequence in sequences:
+            self._execute(
+                "record a pending job",
+                "INSERT OR IGNORE INTO jobs (sequence, inputs, options_hash, status, updated)"
+                " VALUES (?, '[]', '', 'pending', ?)",
+                (sequence, now),
+            )
+
+    def check(self, sequence, inputs, options_hash, destination):
+        """Return 'current', 'stale', or None when the ledger has no finished run to compare."""
+        rows = self._execute(
+            "look up a job",
+            "SELECT inputs, options_hash, status, attempts, output_size FROM jobs"
+            " WHERE sequence = ?",
+            (sequence,),
+        )
+        if not rows or rows[0][3] == 0:
+            return None
+        recorded_inputs, recorded_hash, status, _, output_size = rows[0]
+        try:
+            current_size = os.path.getsize(destination)
+        except OSError:
+            current_size = None
+        if (
+            status == "done"
+            and recorded_hash == options_hash
+            and recorded_inputs == json.dumps(inputs)
+            and output_size == current_size
+        ):
+            return "current"
+        return "stale"
+
+    def start(self, sequence, inputs, options_hash):
+        now = time.time()
+        self._execute(
+            "record a started job",
+            "INSERT INTO jobs (sequence, inputs, options_hash, status, attempts, started, updated)"
+            " VALUES (?, ?, ?, 'running', 1, ?, ?)"
+            " ON CONFLICT(sequence) DO UPDATE SET inputs = excluded.inputs,"
+            " options_hash = excluded.options_hash, status = 'running',"
+            " attempts = attempts + 1, started = excluded.started, finished = NULL,"
+            " duration = NULL, output_size = NULL, error = NULL, updated = excluded.updated",
+            (sequence, json.dumps(inputs), options_hash, now, now),
+        )
+
+    def finish(self, sequence, output_size):
+        now = time.time()
+        self._execute(
+            "record a finished job",
+            "UPDATE jobs SET status = 'done', finished = ?, duration = ? - started,"
+            " output_size = ?, updated = ? WHERE sequence = ?",
+            (now, now, output_size, now, sequence),
+        )
+
+    def fail(self, sequence, error):
+        now = time.time()
+        self._execute(
+            "record a failed job",
+            "UPDATE jobs SET status = 'failed', finished = ?, duration = ? - started,"
+            " error = ?, updated = ? WHERE sequence = ?",
+            (now, now, str(error), now, sequence),
+        )
+
+    def summary(self):
+        """Return per-status totals and the unfinished runs, for --status."""
+        totals = {
+            status: (count, output_size, duration)
+            for status, count, output_size, duration in self._execute(
+                "summarize jobs",
+                "SELECT status, COUNT(*), SUM(output_size), SUM(duration) FROM jobs"
+                " GROUP BY status",
+            )
+        }
+        problems = self._execute(
+            "list failed jobs",
+            "SELECT sequence, status, attempts, error FROM jobs"
+            " WHERE status IN ('running', 'failed') ORDER BY sequence",
+        )
+        return totals, problems
+
+
+def configure_job_ledger(ledger):
+    """Install ``ledger`` (or None to only check for existing outputs) for convertVideos."""
+    global _JOB_LEDGER
+    with _TEMP_LOCK:
+        _JOB_LEDGER = ledger
+
+
+def sequence_inputs(chapter_paths):
+    """Return the (name, size, mtime) of each chapter, as recorded in the job ledger."""
+    inputs = []
+    for chapter_path in chapter_paths:
+        stat_result = os.stat(chapter_path)
+        inputs.append(
+            [os.path.basename(chapter_path), stat_result.st_size, stat_result.st_mtime_ns]
+        )
+    return inputs
+
+
+def job_options_hash(*settings):
+    """Return a short stable digest of the settings that determine a sequence's output."""
+    payload = json.dumps(settings, default=str, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def format_ledger_status(ledger):
+    totals, problems = ledger.summary()
+    lines = [f"Job ledger: {ledger.db_path}"]
+    for status in JOB_STATUSES:
+        count, output_size, duration = totals.get(status, (0, None, None))
+        line = f"{status:<8} {count:>6}"
+        if status == "done" and count:
+            line += (
+                f"  {(output_size or 0) / 1024**3:.1f} GiB written in {format_duration(duration)}"
+            )
+        lines.append(line)
+    for sequence, status, attempts, error in problems:
+        detail = f": {error}" if error else ""
+        lines.append(f"  {sequence} {status} after {attempts} attempt(s){detail}")
+    return "\n".join(lines)
+
+
+def chapter_fingerprint(path):
+    """Return ``size:blake2b`` of a chapter's head, middle and tail blocks.
+
+    Three large reads identify a chapter across cards and folders without hashing
+    gigabytes. Fingerprints are kept in the source cache.
+    """
+    cache = _SOURCE_CACHE
+    if cache is not None:
+        cached = cache.get(FINGERPRINT_CACHE_KIND, path)
+        if cached:
+            return cached["fingerprint"]
+
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, "rb", buffering=0) as chapter:
+            size = os.fstat(chapter.fileno()).st_size
+            if size <= 3 * FINGERPRINT_BLOCK_SIZE:
+                windows = [(0, size)]
+            else:
+                middle = (size - FINGERPRINT_BLOCK_SIZE) // 2
+                windows = [(offset, FINGERPRINT_BLOCK_SIZE) for offset in (0, middle)]
+                windows.append((size - FINGERPRINT_BLOCK_SIZE, FINGERPRINT_BLOCK_SIZE))
+            for offset, length in windows:
+                digest.update(os.pread(chapter.fileno(), length, offset))
+    except OSError as exc:
+        raise VideoConversionError(f"Failed to fingerprint '{path}': {exc}") from exc
+    fingerprint = f"{size}:{digest.hexdigest()}"
+    if cache is not None:
+        cache.put(FINGERPRINT_CACHE_KIND, path, {"fingerprint": fingerprint})
+    return fingerprint
+
+
+def archive_key(fingerprints, options_hash):
+    """Identify a sequence's output by its chapters' content and the conversion settings."""
+    return job_options_hash(fingerprints, options_hash)
+
+
+class ArchiveIndex(SQLiteStore):
+    """SQLite index of converted outputs by content, shared by every videos folder.
+
+    Sequences are looked up by their chapter fingerprints plus the settings hash, so a
+    re-imported card maps onto the output that was already written. Chapters are
+    indexed on their own too (with the settings hash), so the organizer can leave
+    footage alone that was archived with the current settings.
+    """
+
+    label = "archive index"
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS sequences ("
+        " key TEXT PRIMARY KEY,"
+        " output TEXT NOT NULL,"
+        " output_size INTEGER NOT NULL,"
+        " created REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS chapter_outputs ("
+        " fingerprint TEXT NOT NULL,"
+        " options_hash TEXT NOT NULL,"
+        " output TEXT NOT NULL,"
+        " PRIMARY KEY (fingerprint, options_hash))",
+    )
+
+    def lookup(self, key):
+        """Return the recorded output for ``key`` while it still exists with its size."""
+        rows = self._execute(
+            "look up an output", "SELECT output, output_size FROM sequences WHERE key = ?", (key,)
+        )
+        if not rows:
+            return None
+        output, output_size = rows[0]
+        try:
+            if os.path.getsize(output) == output_size:
+                return output
+        except OSError:
+            pass
+        self._execute("drop a missing output", "DELETE FROM sequences WHERE key = ?", (key,))
+        return None
+
+    def archived_outputs(self, fingerprints, options_hash):
+        """Return the existing outputs holding every one of ``fingerprints``, else None.
+
+        Only outputs converted with the ``options_hash`` settings count.
+        """
+        outputs = set()
+        for fingerprint in fingerprints:
+            rows = self._execute(
+                "look up a chapter",
+                "SELECT output FROM chapter_outputs WHERE fingerprint = ? AND options_hash = ?",
+                (fingerprint, options_hash),
+            )
+            if not rows or not os.path.exists(rows[0][0]):
+                return None
+            outputs.add(rows[0][0])
+        return sorted(outputs) or None
+
+    def record(self, key, fingerprints, options_hash, output):
+        try:
+            output_size = os.path.getsize(output)
+        except OSError:
+            return
+        output = os.path.abspath(output)
+        self._execute(
+            "record an output",
+            "INSERT OR REPLACE INTO sequences (key, output, output_size, created)"
+            " VALUES (?, ?, ?, ?)",
+            (key, output, output_size, time.time()),
+        )
+        for fingerprint in fingerprints:
+            self._execute(
+                "record a chapter",
+                "INSERT OR REPLACE INTO chapter_outputs (fingerprint, options_hash, output)"
+                " VALUES (?, ?, ?)",
+                (fingerprint, options_hash, output),
+            )
+
+
+def configure_archive_index(index):
+    """Install ``index`` (or None to disable deduplication) for the organizer and planner."""
+    global _ARCHIVE_INDEX
+    with _TEMP_LOCK:
+        _ARCHIVE_INDEX = index
+
+
+def parse_frame_rate(value):
+    """Convert an ffprobe rational such as ``30000/1001`` into frames per second."""
+    if value in (None, "", "0/0"):
+        return None
+    try:
+        numerator, _, denominator = str(value).partition("/")
+        if denominator:
+            return float(numerator) / float(denominator)
+        return float(numerator)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ProbeStream:
+    """Typed view of one stream from ffprobe's JSON output."""
+
+    __slots__ = (
+        "index",
+        "codec_name",
+        "codec_type",
+        "codec_tag_string",
+        "coded_width",
+        "coded_height",
+        "framerate",
+        "bit_rate",
+        "duration",
+    )
+
+    def __init__(
+        self,
+        index=None,
+        codec_name=None,
+        codec_type=None,
+        codec_tag_string=None,
+        coded_width=None,
+        coded_height=None,
+        framerate=None,
+        bit_rate=None,
+        duration=None,
+    ):
+        self.index = index
+        self.codec_name = codec_name
+        self.codec_type = codec_type
+        self.codec_tag_string = codec_tag_string
+        self.coded_width = coded_width
+        self.coded_height = coded_height
+        self.framerate = framerate
+        self.bit_rate = bit_rate
+        self.duration = duration
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            index=parse_int(data.get("index")),
+            codec_name=data.get("codec_name"),
+            codec_type=data.get("codec_type"),
+            codec_tag_string=data.get("codec_tag_string"),
+            coded_width=parse_int(data.get("coded_width")),
+            coded_height=parse_int(data.get("coded_height")),
+            framerate=parse_frame_rate(data.get("avg_frame_rate")),
+            bit_rate=parse_int(data.get("bit_rate")),
+            duration=parse_float(data.get("duration")),
+        )
+
+    def __repr__(self):
+        return f"<ProbeStream #{self.index} {self.codec_type}/{self.codec_name}>"
+
+
+class ProbeResult:
+    """Typed view of ``ffprobe -show_streams -show_format`` for one file."""
+
+    __slots__ = ("path", "streams", "duration", "size", "bit_rate")
+
+    def __init__(self, path, streams, duration=None, size=None, bit_rate=None):
+        self.path = path
+        self.streams = streams
+        self.duration = duration
+        self.size = size
+        self.bit_rate = bit_rate
+
+    @classmethod
+    def from_json(cls, path, data):
+        format_data = data.get("format") or {}
+        return cls(
+            path,
+            [ProbeStream.from_json(stream) for stream in data.get("streams") or []],
+            duration=parse_float(format_data.get("duration")),
+            size=parse_int(format_data.get("size")),
+            bit_rate=parse_int(format_data.get("bit_rate")),
+        )
+
+    def __repr__(self):
+        return f"<ProbeResult {self.path!r}: {len(self.streams)} stream(s)>"
+
+
+def stream_layout(probe):
+    """Return the codec names of every stream, used to compare chapters of a sequence."""
+    return tuple(getattr(stream, "codec_name", None) for stream in probe.streams)
+
+
 BITRATE_1080P = 14680064  # Optimized bitrate for 1080p video
 BITRATE_1520P = 18874368  # Optimized bitrate for 1520p video
 BITRATE_2160P = 23068672  # Optimized bitrate for 2160p (4K) video
 HEIGHT_1080P = 1080
 HEIGHT_1520P = 1520
 HEIGHT_2160P = 2160
+CODEC_STREAM_NAMES = {"h265": "hevc", "h264": "h264", "av1": "av1"}  # --codec -> ffprobe name
+# AV1 reaches HEVC quality at roughly 70% of the bits, so its targets are scaled down.
+CODEC_BITRATE_SCALE = {"h265": 1.0, "h264": 1.0, "av1": 0.7}
+CPU_ENCODERS = {"h265": "libx265", "h264": "libx264", "av1": "libsvtav1"}
+# --profile -> default preset and encoder tuning (lookahead depth, reference frames).
+CPU_ENCODER_PROFILES = {
+    "speed": {
+        "preset": "faster",
+        "libx265": ["-x265-params", "rc-lookahead=15:bframes=4"],
+        "libx264": ["-rc-lookahead", "20"],
+        "libsvtav1": ["-svtav1-params", "lookahead=16"],
+    },
+    "balanced": {
+        "preset": "medium",
+        "libx265": ["-x265-params", "rc-lookahead=30"],
+        "libx264": ["-rc-lookahead", "40"],
+        "libsvtav1": ["-svtav1-params", "lookahead=48"],
+    },
+    "efficiency": {
+        "preset": "slower",
+        "libx265": ["-x265-params", "rc-lookahead=60:bframes=8:ref=5"],
+        "libx264": ["-rc-lookahead", "60", "-refs", "5"],
+        "libsvtav1": ["-svtav1-params", "lookahead=120"],
+    },
+}
+# libsvtav1 takes numeric presets (0 slowest to 13 fastest); the named presets map onto them.
+SVT_AV1_PRESETS = {
+    "ultrafast": 12,
+    "superfast": 11,
+    "veryfast": 10,
+    "faster": 9,
+    "fast": 8,
+    "medium": 6,
+    "slow": 5,
+    "slower": 4,
+    "veryslow": 2,
+}
+DEFAULT_PRESET = "slower"
+ENCODER_PRESETS = [
+    "ultrafast",
+    "superfast",
+    "veryfast",
+    "faster",
+    "fast",
+    "medium",
+    "slow",
+    "slower",
+    "veryslow",
+]
+# Candidates for --auto-preset, fastest first; all are accepted by the x264/x265 and QSV encoders.
+AUTO_PRESET_CANDIDATES = ["veryfast", "faster", "fast", "medium", "slow", "slower"]
+DEFAULT_QUALITY_FLOORS = {"ssim": 0.98, "psnr": 40.0}
+AUTO_PRESET_SAMPLES = 3
+AUTO_PRESET_SAMPLE_DURATION = 4.0  # Seconds per sample encode.
+SSIM_PATTERN = re.compile(r"SSIM .*All:([0-9.]+)")
+PSNR_PATTERN = re.compile(r"PSNR .*average:([0-9.]+|inf)")
+SITI_PATTERN = re.compile(r"(Spatial|Temporal) Information:.*?Average: ([0-9.]+)", re.DOTALL)
+SEGMENT_DURATION = 300.0  # Seconds of encode at stake when a --resumable run is interrupted.
+SEGMENT_MANIFEST_FILENAME = "manifest.json"
+SEGMENT_DIR_SUFFIX = ".segments"
+CHUNK_DIR_SUFFIX = ".chunks"
+# Work directories may sit in the videos folder; they are never sequence folders.
+WORK_DIR_SUFFIXES = (SEGMENT_DIR_SUFFIX, CHUNK_DIR_SUFFIX)
+# Unexpected errors of a sequence step that are reported as a VideoConversionError.
+SEQUENCE_STEP_ERRORS = (OSError, IndexError, AttributeError, subprocess.SubprocessError)
+PIPELINE_PLAN_AHEAD = 1  # Planned sequences waiting per encoder.
+CHUNK_MIN_DURATION = 60.0  # Seconds; shorter chunks spend too much time on encoder warm-up.
 MAXRATE_MULTIPLIER = 1.5
+FRAME_RATE_TOLERANCE = 0.001  # Relative amount a decimated rate may exceed --max-fps by.
 BUFSIZE_MULTIPLIER = 4
 GOPRO_PREFIX_LENGTH = 4
 MP4_EXTENSION_LENGTH = 4
@@ -167,7 +1034,7 @@ class VideoConversionError(Exception):
     """Raised when video processing operations fail (probe, organize, convert), chaining errors."""
 
 
-def arguments():
+def arguments(argv=None):
 
     parser = argparse.ArgumentParser(
         description="GoPro video compressor",
@@ -179,8 +1046,8 @@ def arguments():
         "--codec",
         type=str,
         default="h265",
-        choices=["h265", "h264"],
-        help="Choose codec (default: h265)",
+        choices=["h265", "h264", "av1"],
+        help="Choose codec (default: h265; av1 needs -a cpu)",
     )
     parser.add_argument(
         "-a",
@@ -212,173 +1079,2997 @@ def arguments():
         default=0.12,
         help="Bitrate modifier for conversion (default: 0.12)",
     )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="Directory for finished outputs (default: the videos folder)",
+    )
+    parser.add_argument(
+        "-s",
+        "--scratch",
+        type=str,
+        default=None,
+        help="Directory for partial outputs and work files, e.g. on fast local storage",
+    )
+    parser.add_argument(
+        "--link",
+        action="store_true",
+        help="Hardlink chapters into their sequence folders instead of moving them "
+        "(symlink across mounts); requires --output",
+    )
     parser.add_argument(
         "-R",
         "--resume",
         action="store_true",
         help="Skip sequences that already have output files",
     )
-    args = parser.parse_args()
-    config = vars(args)
-    return config
-
-
-def bash_command(cmd, context="command execution"):
-
-    try:
-        subprocess.run(["/bin/bash", "-c", cmd], check=True)
-    except FileNotFoundError as exc:
-        raise VideoConversionError(f"Bash not available during {context}: {exc}") from exc
-    except subprocess.CalledProcessError as exc:
-        raise VideoConversionError(f"Command failed during {context}: {exc}") from exc
-
-
-def probeVideo(source):
-
-    try:
-        file = FFProbe(source)
-    except FileNotFoundError as exc:
-        raise VideoConversionError(
-            f"Source file not found while probing '{source}': {exc}"
-        ) from exc
-    except (OSError, subprocess.SubprocessError) as exc:
-        raise VideoConversionError(f"Failed to probe source file '{source}': {exc}") from exc
-
-    if not file.streams:
-        raise VideoConversionError(f"No streams found in source file '{source}'")
-
-    return file
-
-
-def calculateBitrate(source, bitratemodifier, mbits_max, ratio_max, probe=None):
-
-    try:
-        file = probe or probeVideo(source)
-        if not file.streams:
-            raise VideoConversionError(f"No streams found in probe for '{source}'")
-        stream = file.streams[0]
-
-        required_fields = {
-            "coded_height": stream.coded_height,
-            "coded_width": stream.coded_width,
-            "framerate": stream.framerate,
-            "bit_rate": stream.bit_rate,
-        }
-        missing_fields = [name for name, value in required_fields.items() if value is None]
-        if missing_fields:
-            raise VideoConversionError(
-                f"Missing stream metadata in '{source}': {', '.join(missing_fields)}"
-            )
-
-        try:
-            coded_height = int(stream.coded_height)
-        except (TypeError, ValueError) as exc:
-            raise VideoConversionError(
-                f"Invalid coded_height in '{source}': {stream.coded_height}"
-            ) from exc
-
-        try:
-            coded_width = int(stream.coded_width)
-        except (TypeError, ValueError) as exc:
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of sequences to convert in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--device-readers",
+        type=int,
+        default=0,
+        help="Maximum sequences read from one source device at a time (0: no limit)",
+    )
+    parser.add_argument(
+        "--probe-cache",
+        type=str,
+        default=default_cache_path(),
+        help="Path to the on-disk probe cache database",
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="Skip chapters and link sequences already converted with the same settings, "
+        "recognized by content",
+    )
+    parser.add_argument(
+        "--archive-index",
+        type=str,
+        default=default_archive_index_path(),
+        help="Path to the --dedupe index of converted outputs",
+    )
+    parser.add_argument(
+        "--no-probe-cache",
+        action="store_true",
+        help="Always run ffprobe instead of consulting the probe cache",
+    )
+    parser.add_argument(
+        "-F",
+        "--force-encode",
+        action="store_true",
+        help="Re-encode even when the source already matches the codec and target bitrate",
+    )
+    parser.add_argument(
+        "-k",
+        "--chunks",
+        type=int,
+        default=1,
+        help="Split each long sequence at keyframes and encode up to N chunks in parallel",
+    )
+    parser.add_argument(
+        "--resumable",
+        action="store_true",
+        help="Encode in segments kept across runs so an interrupted sequence continues",
+    )
+    parser.add_argument(
+        "--segment-duration",
+        type=float,
+        default=SEGMENT_DURATION,
+        help="Length in seconds of each --resumable segment",
+    )
+    parser.add_argument(
+        "-p",
+        "--preset",
+        type=str,
+        default=None,
+        choices=ENCODER_PRESETS,
+        help="Encoder speed/efficiency preset (default: slower, or the --profile preset)",
+    )
+    parser.add_argument(
+        "--max-height",
+        type=int,
+        default=None,
+        help="Downscale taller sources to this height (e.g. 1080); the bitrate follows the output",
+    )
+    parser.add_argument(
+        "--max-fps",
+        type=float,
+        default=None,
+        help="Drop frames from sources above this frame rate (e.g. 60)",
+    )
+    parser.add_argument(
+        "--complexity",
+        action="store_true",
+        help="Scale each sequence's bitrate by its spatial/temporal complexity, measured on "
+        "a small proxy",
+    )
+    parser.add_argument(
+        "--proxy",
+        action="store_true",
+        help=f"Also write a {PROXY_HEIGHT}p H.264 editing proxy per output from the same decode",
+    )
+    parser.add_argument(
+        "--thumbnails",
+        type=float,
+        nargs="?",
+        const=THUMBNAIL_INTERVAL,
+        default=None,
+        metavar="SECONDS",
+        help="Also write a JPEG thumbnail every SECONDS (default when given: 10) from the same "
+        "decode",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        choices=list(CPU_ENCODER_PROFILES),
+        help="CPU encoder tuning profile; sets the default preset, lookahead and references",
+    )
+    parser.add_argument(
+        "-A",
+        "--auto-preset",
+        action="store_true",
+        help="Pick the fastest preset that meets --quality-floor from sample encodes",
+    )
+    parser.add_argument(
+        "--quality-metric",
+        type=str,
+        default="ssim",
+        choices=sorted(DEFAULT_QUALITY_FLOORS),
+        help="Metric used by --auto-preset to compare samples with the source",
+    )
+    parser.add_argument(
+        "--quality-floor",
+        type=float,
+        default=None,
+        help="Minimum sample score for --auto-preset (default: 0.98 SSIM or 40 dB PSNR)",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Print every command for the batch without moving files or running them",
+    )
+    parser.add_argument(
+        "--status",
+        action="store_true",
+        help="Summarize the job ledger of the videos folder and exit",
+    )
+    parser.add_argument(
+        "-W",
+        "--watch",
+        action="store_true",
+        help="Keep running and convert each sequence once its chapters stop changing",
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="Share the videos folder with other nodes: lease each sequence before converting it",
+    )
+    parser.add_argument(
+        "--lease-ttl",
+        type=float,
+        default=LEASE_TTL,
+        help="Seconds without a heartbeat before a --worker lease is reclaimed",
+    )
+    parser.add_argument(
+        "--quiet-period",
+        type=float,
+        default=WATCH_QUIET_PERIOD,
+        help="Seconds a sequence must stay unchanged before --watch converts it",
+    )
+    parser.add_argument(
+        "--status-file",
+        type=str,
+        default=None,
+        help="Write live per-sequence ffmpeg progress as JSON to this file",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=PROGRESS_LOG_INTERVAL,
+        help="Seconds between progress log lines for each running encode",
+    )
+    parser.add_argument(
+        "--no-exiftool-daemon",
+        action="store_true",
+        help="Start a new exiftool process per sequence instead of sharing one -stay_open session",
+    )
+    args = parser.parse_args(argv)
+    config = vars(args)
+    return config
+
+
+class ProgressBoard:
+    """Collects progress snapshots of every running encode and mirrors them to a JSON file."""
+
+    def __init__(self, status_path=None, log_interval=PROGRESS_LOG_INTERVAL):
+        self.status_path = status_path
+        self.log_interval = log_interval
+        self._entries = {}
+        self._last_write = 0.0
+        self._lock = RLock()
+
+    def update(self, name, snapshot, force_write=False):
+        with self._lock:
+            self._entries[name] = snapshot
+            now = time.monotonic()
+            if force_write or now - self._last_write >= STATUS_WRITE_INTERVAL:
+                self._last_write = now
+                self.write_status()
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._entries.items()}
+
+    def write_status(self):
+        """Atomically replace the status file so scrapers never read a partial document."""
+        if not self.status_path:
+            return
+        document = {"updated": time.time(), "sequences": self.snapshot()}
+        temp_path = f"{self.status_path}.tmp"
+        try:
+            with open(temp_path, "w") as status_file:
+                json.dump(document, status_file, indent=2, sort_keys=True)
+            os.replace(temp_path, self.status_path)
+        except OSError as exc:
+            logger.warning(
+                "Failed to write status file '%s': %s",
+                sanitize_for_log(self.status_path),
+                sanitize_for_log(exc),
+            )
+
+
+def configure_progress_board(board):
+    """Install ``board`` (or None) to receive progress from every ffmpeg encode."""
+    global _PROGRESS_BOARD
+    with _TEMP_LOCK:
+        _PROGRESS_BOARD = board
+
+
+def parse_out_time(value):
+    """Convert ffmpeg's ``HH:MM:SS.micro`` out_time into seconds."""
+    try:
+        hours, minutes, seconds = value.split(":")
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except (AttributeError, ValueError):
+        return None
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "?"
+    seconds = max(0, int(round(seconds)))
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class ProgressMonitor:
+    """Parses ffmpeg ``-progress`` key=value blocks for one encode.
+
+    Each completed block (terminated by a ``progress=`` line) is turned into a snapshot
+    with frames, fps, speed, encoded media time and an ETA derived from the probed
+    ``duration``. Snapshots are logged every ``log_interval`` seconds and published to
+    the progress board, if one is configured. A ``listener`` is called with the
+    encoded media time of every snapshot.
+    """
+
+    def __init__(self, name, duration=None, board=None, listener=None):
+        self.name = name
+        self.duration = duration
+        self.listener = listener
+        self.board = board if board is not None else _PROGRESS_BOARD
+        self.log_interval = self.board.log_interval if self.board else PROGRESS_LOG_INTERVAL
+        self.started = time.monotonic()
+        self.state = {}
+        self._pending = {}
+        self._last_log = self.started
+
+    def feed_line(self, line):
+        key, separator, value = line.strip().partition("=")
+        if not separator:
+            return
+        self._pending[key.strip()] = value.strip()
+        if key.strip() == "progress":
+            self._publish(finished=value.strip() == "end")
+
+    def finish(self, returncode):
+        self.state["status"] = "done" if returncode == 0 else "failed"
+        self.state["elapsed"] = round(time.monotonic() - self.started, 1)
+        if returncode == 0:
+            self.state["eta_seconds"] = 0.0
+        if self.board:
+            self.board.update(self.name, self.state, force_write=True)
+
+    def _publish(self, finished=False):
+        block, self._pending = self._pending, {}
+        out_time = parse_out_time(block.get("out_time"))
+        speed = parse_float(block.get("speed", "").rstrip("x"))
+        eta = None
+        percent = None
+        if self.duration and out_time is not None:
+            percent = round(min(100.0, out_time / self.duration * 100), 1)
+            if speed:
+                eta = round(max(0.0, self.duration - out_time) / speed, 1)
+        self.state = {
+            "status": "running",
+            "frames": parse_int(block.get("frame")),
+            "fps": parse_float(block.get("fps")),
+            "speed": speed,
+            "out_time": out_time,
+            "duration": self.duration,
+            "percent": percent,
+            "eta_seconds": eta,
+            "elapsed": round(time.monotonic() - self.started, 1),
+        }
+        if self.board:
+            self.board.update(self.name, self.state, force_write=finished)
+        if self.listener:
+            self.listener(out_time)
+
+        now = time.monotonic()
+        if finished or now - self._last_log >= self.log_interval:
+            self._last_log = now
+            percent_text = f"{percent:.1f}%" if percent is not None else "?%"
+            logger.info(
+                "Progress %s: %s frame=%s fps=%s speed=%sx eta=%s",
+                sanitize_for_log(self.name),
+                percent_text,
+                self.state["frames"],
+                self.state["fps"],
+                speed if speed is not None else "?",
+                format_duration(eta),
+            )
+
+
+def read_progress(stream, monitor):
+    """Feed every line of an ffmpeg progress pipe to ``monitor`` until EOF."""
+    for line in stream:
+        monitor.feed_line(line)
+
+
+def configure_device_readers(limit):
+    """Allow at most ``limit`` sequences to read from one device at a time (None: no limit)."""
+    global _DEVICE_READER_LIMIT
+    with _TEMP_LOCK:
+        _DEVICE_READER_LIMIT = limit
+        _DEVICE_READERS.clear()
+
+
+def device_reader_slot(path):
+    """Return the semaphore guarding reads from the device holding ``path``, or None."""
+    with _TEMP_LOCK:
+        if not _DEVICE_READER_LIMIT:
+            return None
+        try:
+            device = os.stat(path).st_dev
+        except OSError:
+            return None
+        if device not in _DEVICE_READERS:
+            _DEVICE_READERS[device] = BoundedSemaphore(_DEVICE_READER_LIMIT)
+        return _DEVICE_READERS[device]
+
+
+def advise_file(path, advice):
+    """Pass the ``advice`` hint (e.g. "POSIX_FADV_WILLNEED") for all of ``path`` to the kernel.
+
+    Does nothing where posix_fadvise or the hint is not available, e.g. on macOS.
+    """
+    advice = getattr(os, advice, None)
+    if advice is None or not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, advice)
+        finally:
+            os.close(fd)
+    except OSError as exc:
+        logger.debug("posix_fadvise failed for %s: %s", sanitize_for_log(path), exc)
+
+
+class ChapterReadAhead:
+    """Prefetches the upcoming chapters of a sequence and drops consumed ones from the cache.
+
+    ``advance`` is fed the encoder's position in seconds of the concatenated input.
+    When it enters a new chapter, the next chapter gets ``POSIX_FADV_WILLNEED`` and
+    a background read of its first READ_AHEAD_BYTES, and earlier chapters get
+    ``POSIX_FADV_DONTNEED`` so multi-gigabyte reads do not evict everything else.
+    With a per-device reader limit, ``start`` waits for a free slot on the device.
+    """
+
+    def __init__(self, chapter_paths, durations):
+        self.chapter_paths = chapter_paths
+        self.chapter_ends = None
+        if durations and all(duration is not None for duration in durations):
+            total = 0.0
+            self.chapter_ends = []
+            for duration in durations:
+                total += duration
+                self.chapter_ends.append(total)
+        self.current = None
+        self._slot = None
+        self._prefetcher = None
+        self._stop = Event()
+
+    def start(self):
+        self._slot = device_reader_slot(self.chapter_paths[0])
+        if self._slot is not None:
+            self._slot.acquire()
+        self._enter(0)
+
+    def advance(self, position):
+        if self.chapter_ends is None or position is None:
+            return
+        index = next(
+            (index for index, end in enumerate(self.chapter_ends) if position < end),
+            len(self.chapter_ends) - 1,
+        )
+        if index != self.current:
+            self._enter(index)
+
+    def _enter(self, index):
+        for consumed in range(self.current or 0, index):
+            advise_file(self.chapter_paths[consumed], "POSIX_FADV_DONTNEED")
+        if self.current is None:
+            advise_file(self.chapter_paths[index], "POSIX_FADV_WILLNEED")
+        self.current = index
+        upcoming = index + 1
+        if upcoming < len(self.chapter_paths):
+            advise_file(self.chapter_paths[upcoming], "POSIX_FADV_WILLNEED")
+            if self._prefetcher is None or not self._prefetcher.is_alive():
+                self._prefetcher = Thread(
+                    target=self._read_head,
+                    args=(self.chapter_paths[upcoming],),
+                    name="read-ahead",
+                    daemon=True,
+                )
+                self._prefetcher.start()
+
+    def _read_head(self, path):
+        # WILLNEED is only a hint (and ignored by some network filesystems), so
+        # reading the head of the file makes sure it is cached before ffmpeg needs it.
+        block = bytearray(READ_AHEAD_BLOCK_SIZE)
+        remaining = READ_AHEAD_BYTES
+        try:
+            with open(path, "rb", buffering=0) as chapter:
+                while remaining > 0 and not self._stop.is_set():
+                    count = chapter.readinto(block)
+                    if not count:
+                        break
+                    remaining -= count
+        except OSError as exc:
+            logger.debug("Read-ahead of %s failed: %s", sanitize_for_log(path), exc)
+
+    def close(self):
+        """Stop prefetching, drop every chapter from the page cache and free the device slot."""
+        self._stop.set()
+        if self._prefetcher is not None:
+            self._prefetcher.join()
+        for chapter_path in self.chapter_paths:
+            advise_file(chapter_path, "POSIX_FADV_DONTNEED")
+        if self._slot is not None:
+            self._slot.release()
+            self._slot = None
+
+
+class FFmpegCommand:
+    """An ffmpeg invocation built from structured parts and rendered as an argv list.
+
+    Options are kept in the groups ffmpeg parses them in: global options, then each
+    input with the options that apply to it, then each output with its options. Callers
+    can inspect or extend a command before it runs, and ``str()`` gives a shell-quoted
+    rendering for logs and ``--plan`` output.
+    """
+
+    def __init__(self, *global_args, binary="ffmpeg"):
+        self.binary = binary
+        self.global_args = ["-y", *map(str, global_args)]
+        self.inputs = []
+        self.outputs = []
+
+    def add_global(self, *args):
+        self.global_args.extend(map(str, args))
+        return self
+
+    def add_input(self, path, *options):
+        self.inputs.append(([*map(str, options)], str(path)))
+        return self
+
+    def add_concat_input(self, list_path, *options):
+        """Add an ffmpeg concat demuxer list (absolute paths allowed) as an input."""
+        return self.add_input(list_path, *options, "-f", "concat", "-safe", "0")
+
+    def add_output(self, path, *options):
+        self.outputs.append(([*map(str, options)], str(path)))
+        return self
+
+    def argv(self):
+        argv = [self.binary, *self.global_args]
+        for options, path in self.inputs:
+            argv.extend(options)
+            argv.extend(["-i", path])
+        for options, path in self.outputs:
+            argv.extend(options)
+            argv.append(path)
+        return argv
+
+    def __str__(self):
+        return shlex.join(self.argv())
+
+    def __repr__(self):
+        return f"<FFmpegCommand {self}>"
+
+
+def command_argv(command):
+    """Return the argv list for an FFmpegCommand or any sequence of arguments."""
+    if isinstance(command, FFmpegCommand):
+        return command.argv()
+    return [str(arg) for arg in command]
+
+
+def check_not_cancelled(context):
+    """Raise VideoConversionError once shutdown began or the current job was cancelled."""
+    tracker = current_tracker()
+    with tracker.lock:
+        cancelled = tracker.cancelled
+    with _TEMP_LOCK:
+        if _SIGNAL_HANDLED or cancelled:
+            raise VideoConversionError(f"Shutdown in progress, not starting {context}")
+
+
+def run_command(command, context="command execution", progress=None, capture_stderr=False):
+    """Run ``command`` directly (no shell) and raise VideoConversionError on failure.
+
+    With ``progress``, stdout is parsed as ffmpeg ``-progress`` output in a reader
+    thread; with ``capture_stderr``, the child's stderr is returned as text.
+    """
+
+    argv = command_argv(command)
+    check_not_cancelled(context)
+
+    try:
+        if capture_stderr:
+            process = subprocess.Popen(argv, stderr=subprocess.PIPE, text=True, errors="replace")
+        elif progress is None:
+            process = subprocess.Popen(argv)
+        else:
+            # The command writes ffmpeg -progress output to stdout.
+            process = subprocess.Popen(argv, stdout=subprocess.PIPE, text=True, errors="replace")
+    except FileNotFoundError as exc:
+        raise VideoConversionError(
+            f"Executable '{argv[0]}' not available during {context}: {exc}"
+        ) from exc
+
+    # Track the child so a shutdown signal can stop it from any worker thread.
+    register_process(process)
+    reader = None
+    stderr = None
+    try:
+        if capture_stderr:
+            _, stderr = process.communicate()
+            returncode = process.returncode
+        else:
+            if progress is not None:
+                reader = Thread(
+                    target=read_progress,
+                    args=(process.stdout, progress),
+                    name="progress",
+                    daemon=True,
+                )
+                reader.start()
+            returncode = process.wait()
+    finally:
+        unregister_process(process)
+        if reader is not None:
+            reader.join()
+            process.stdout.close()
+
+    if progress is not None:
+        progress.finish(returncode)
+
+    if returncode != 0:
+        exc = subprocess.CalledProcessError(returncode, argv)
+        raise VideoConversionError(f"Command failed during {context}: {exc}") from exc
+
+    return stderr
+
+
+class ExifToolSessionError(Exception):
+    """Raised when the shared exiftool process can no longer serve requests."""
+
+
+class ExifToolSession:
+    """Client for one long-lived ``exiftool -stay_open True -@ -`` process.
+
+    Arguments are written one per line to the daemon's stdin and each request is
+    terminated with ``-execute<N>``; exiftool answers with ``{ready<N>}`` on stdout
+    and ``-echo4`` frames stderr the same way. Requests are serialized with a lock
+    so every worker thread can share the session. The process starts lazily on the
+    first request and is never restarted once it fails.
+    """
+
+    def __init__(self, executable="exiftool", timeout=EXIFTOOL_TIMEOUT):
+        self.executable = executable
+        self.timeout = timeout
+        self.dead = False
+        self._process = None
+        self._stdout = Queue()
+        self._stderr = Queue()
+        self._counter = 0
+        self._lock = RLock()
+
+    def _start(self):
+        argv = [*command_argv([self.executable]), "-stay_open", "True", "-@", "-"]
+        try:
+            # surrogateescape round-trips non-UTF-8 filenames exactly as argv would.
+            process = subprocess.Popen(
+                argv,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                errors="surrogateescape",
+            )
+        except OSError as exc:
+            self.dead = True
+            raise ExifToolSessionError(f"unable to start {argv[0]}: {exc}") from exc
+        # Every job shares the daemon, so it belongs to the process-wide tracker rather
+        # than to the tracker of whichever Converter execution started it.
+        register_process(process, _DEFAULT_TRACKER)
+        for stream, lines, name in (
+            (process.stdout, self._stdout, "exiftool-stdout"),
+            (process.stderr, self._stderr, "exiftool-stderr"),
+        ):
+            Thread(target=self._pump, args=(stream, lines), name=name, daemon=True).start()
+        self._process = process
+
+    @staticmethod
+    def _pump(stream, lines):
+        for line in stream:
+            lines.put(line)
+        lines.put(None)
+
+    def _read_response(self, lines, marker, deadline):
+        collected = []
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                line = lines.get(timeout=max(remaining, 0))
+            except Empty:
+                self._abort()
+                raise ExifToolSessionError(f"no response within {self.timeout:g} seconds") from None
+            if line is None:
+                self._abort()
+                raise ExifToolSessionError("exiftool exited unexpectedly")
+            if line.rstrip("\r\n") == marker:
+                return "".join(collected)
+            collected.append(line)
+
+    def _abort(self):
+        self.dead = True
+        process = self._process
+        if process is None:
+            return
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        unregister_process(process, _DEFAULT_TRACKER)
+
+    def execute(self, args):
+        """Run one exiftool command in the session and return its (stdout, stderr)."""
+        args = command_argv(args)
+        if any("\n" in arg or "\r" in arg for arg in args):
+            raise ExifToolSessionError("arguments containing newlines cannot be sent")
+        with self._lock:
+            if self.dead:
+                raise ExifToolSessionError("session is no longer running")
+            if self._process is None:
+                self._start()
+            self._counter += 1
+            marker = f"{{ready{self._counter}}}"
+            request = [*args, "-echo4", marker, f"-execute{self._counter}"]
+            try:
+                self._process.stdin.write("\n".join(request) + "\n")
+                self._process.stdin.flush()
+            except (OSError, ValueError) as exc:
+                self._abort()
+                raise ExifToolSessionError(f"unable to send request: {exc}") from exc
+            deadline = time.monotonic() + self.timeout
+            stdout = self._read_response(self._stdout, marker, deadline)
+            stderr = self._read_response(self._stderr, marker, deadline)
+        return stdout, stderr
+
+    def close(self):
+        """Ask the daemon to exit, killing it if it does not stop promptly."""
+        with self._lock:
+            process = self._process
+            if process is None or self.dead:
+                return
+            self.dead = True
+            try:
+                process.stdin.write("-stay_open\nFalse\n")
+                process.stdin.close()
+                process.wait(timeout=EXIFTOOL_CLOSE_TIMEOUT)
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                process.kill()
+                process.wait()
+            unregister_process(process, _DEFAULT_TRACKER)
+
+
+def configure_exiftool_session(session):
+    """Install ``session`` (or None for one exiftool process per call) for metadata copies."""
+    global _EXIFTOOL_SESSION
+    with _TEMP_LOCK:
+        _EXIFTOOL_SESSION = session
+
+
+def run_exiftool(args, context):
+    """Run exiftool with ``args`` through the shared session, or as a one-off process."""
+    session = _EXIFTOOL_SESSION
+    if session is not None and not session.dead:
+        with _TEMP_LOCK:
+            if _SIGNAL_HANDLED:
+                raise VideoConversionError(f"Shutdown in progress, not starting {context}")
+        try:
+            _, stderr = session.execute(args)
+        except ExifToolSessionError as exc:
+            logger.warning(
+                "exiftool session unavailable during %s (%s); running exiftool directly",
+                context,
+                sanitize_for_log(exc),
+            )
+        else:
+            errors = []
+            for line in stderr.splitlines():
+                if line.startswith("Error"):
+                    errors.append(line)
+                elif line.strip():
+                    logger.warning("exiftool: %s", sanitize_for_log(line))
+            if errors:
+                raise VideoConversionError(f"Command failed during {context}: {'; '.join(errors)}")
+            return
+    run_command(["exiftool", *command_argv(args)], context)
+
+
+def run_ffprobe(source):
+    """Run ffprobe once on ``source`` and return its parsed JSON report."""
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-print_format",
+            "json",
+            "-show_streams",
+            "-show_format",
+            source,
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    return json.loads(result.stdout)
+
+
+def probeVideo(source):
+
+    cache = _SOURCE_CACHE
+    if cache is not None:
+        cached = cache.get(PROBE_CACHE_KIND, source)
+        if cached and cached.get("streams"):
+            return ProbeResult.from_json(source, cached)
+
+    if not os.path.isfile(source):
+        raise VideoConversionError(f"Source file not found while probing '{source}'")
+
+    try:
+        data = run_ffprobe(source)
+    except FileNotFoundError as exc:
+        raise VideoConversionError(
+            f"ffprobe not available while probing '{source}': {exc}"
+        ) from exc
+    except subprocess.CalledProcessError as exc:
+        details = sanitize_for_log((exc.stderr or "").strip())
+        raise VideoConversionError(
+            f"Failed to probe source file '{source}': {exc}: {details}"
+        ) from exc
+    except (OSError, subprocess.SubprocessError, ValueError) as exc:
+        raise VideoConversionError(f"Failed to probe source file '{source}': {exc}") from exc
+
+    file = ProbeResult.from_json(source, data)
+    if not file.streams:
+        raise VideoConversionError(f"No streams found in source file '{source}'")
+
+    if cache is not None:
+        cache.put(PROBE_CACHE_KIND, source, data)
+
+    return file
+
+
+def probeSequence(sources, max_workers=PROBE_MAX_WORKERS):
+    """Probe every chapter of a sequence concurrently, returning results in input order."""
+    if len(sources) <= 1 or max_workers <= 1:
+        return [probeVideo(source) for source in sources]
+
+    workers = min(len(sources), max_workers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="probe") as executor:
+        return list(executor.map(probeVideo, sources))
+
+
+def complexity_command(source):
+    """Return the ffmpeg command that prints SI/TI statistics of a proxy of ``source``."""
+    proxy = (
+        f"select=not(mod(n\\,{COMPLEXITY_FRAME_STEP})),"
+        f"scale=-2:{COMPLEXITY_PROXY_HEIGHT},siti=print_summary=1"
+    )
+    return (
+        FFmpegCommand("-nostats")
+        .add_input(source)
+        .add_output("-", "-map", "0:v:0", "-vf", proxy, "-f", "null")
+    )
+
+
+def parse_siti_summary(output):
+    """Extract the average spatial and temporal information from the siti summary."""
+    averages = {kind: float(value) for kind, value in SITI_PATTERN.findall(output or "")}
+    if set(averages) != {"Spatial", "Temporal"}:
+        return None
+    return {"si": averages["Spatial"], "ti": averages["Temporal"]}
+
+
+def cached_complexity(source):
+    """Return the SI/TI of ``source`` measured by an earlier run, or None."""
+    cache = _SOURCE_CACHE
+    if cache is None:
+        return None
+    return cache.get(COMPLEXITY_CACHE_KIND, source) or None
+
+
+def analyse_complexity(source):
+    """Return ``{"si", "ti"}`` for ``source``, from the source cache when possible."""
+    cached = cached_complexity(source)
+    if cached:
+        return cached
+    cache = _SOURCE_CACHE
+
+    output = run_command(
+        complexity_command(source),
+        f"analysing complexity of '{sanitize_for_log(source)}'",
+        capture_stderr=True,
+    )
+    stats = parse_siti_summary(output)
+    if stats is None:
+        raise VideoConversionError(f"Could not read SI/TI statistics for '{source}'")
+    if cache is not None:
+        cache.put(COMPLEXITY_CACHE_KIND, source, stats)
+    return stats
+
+
+def sequence_complexity(chapter_paths, probes):
+    """Return the duration-weighted mean SI/TI of a sequence's chapters."""
+    slot = device_reader_slot(chapter_paths[0])
+    if slot is not None:
+        slot.acquire()
+    try:
+        stats = [analyse_complexity(chapter_path) for chapter_path in chapter_paths]
+    finally:
+        if slot is not None:
+            slot.release()
+    weights = [getattr(probe, "duration", None) or 1.0 for probe in probes]
+    total = sum(weights)
+    return {
+        key: sum(item[key] * weight for item, weight in zip(stats, weights, strict=True)) / total
+        for key in ("si", "ti")
+    }
+
+
+def complexity_bitrate_scale(stats):
+    """Map SI/TI statistics to a bitrate multiplier around the reference footage."""
+    relative = (stats["si"] / COMPLEXITY_REFERENCE_SI) * (stats["ti"] / COMPLEXITY_REFERENCE_TI)
+    return min(COMPLEXITY_SCALE_MAX, max(COMPLEXITY_SCALE_MIN, relative**0.5))
+
+
+def output_geometry(width, height, framerate, max_height=None, max_fps=None):
+    """Apply the --max-height/--max-fps caps; returns (width, height, framerate, filter).
+
+    ``filter`` is the ffmpeg video filter that produces that geometry, or None when the
+    source already fits. Frames are dropped before scaling so fewer frames are scaled,
+    and only every Nth frame is kept so motion stays even: 119.88 fps becomes 59.94.
+    """
+    filters = []
+    if max_fps and framerate > max_fps:
+        # ffprobe rates are rationals such as 120000/1001; the tolerance lets 59.94 match.
+        source_rate = Fraction(framerate).limit_denominator(1001)
+        divisor = max(1, math.ceil(framerate / max_fps - FRAME_RATE_TOLERANCE))
+        output_rate = source_rate / divisor
+        framerate = float(output_rate)
+        filters.append(f"fps={output_rate}")
+    if max_height and height > max_height:
+        # Keep the aspect ratio with an even width, as scale=-2 does.
+        width = int(round(width * max_height / height / 2)) * 2
+        height = max_height
+        filters.append(f"scale=-2:{max_height}:flags=lanczos")
+    return width, height, framerate, ",".join(filters) or None
+
+
+def calculateBitrate(
+    source,
+    bitratemodifier,
+    mbits_max,
+    ratio_max,
+    probe=None,
+    apply_ratio_limit=True,
+    codec=None,
+    max_height=None,
+    max_fps=None,
+    complexity_scale=None,
+):
+
+    try:
+        file = probe or probeVideo(source)
+        if not file.streams:
+            raise VideoConversionError(f"No streams found in probe for '{source}'")
+        stream = file.streams[0]
+
+        required_fields = {
+            "coded_height": stream.coded_height,
+            "coded_width": stream.coded_width,
+            "framerate": stream.framerate,
+            "bit_rate": stream.bit_rate,
+        }
+        missing_fields = [name for name, value in required_fields.items() if value is None]
+        if missing_fields:
+            raise VideoConversionError(
+                f"Missing stream metadata in '{source}': {', '.join(missing_fields)}"
+            )
+
+        try:
+            coded_height = int(stream.coded_height)
+        except (TypeError, ValueError) as exc:
+            raise VideoConversionError(
+                f"Invalid coded_height in '{source}': {stream.coded_height}"
+            ) from exc
+
+        try:
+            coded_width = int(stream.coded_width)
+        except (TypeError, ValueError) as exc:
             raise VideoConversionError(
                 f"Invalid coded_width in '{source}': {stream.coded_width}"
             ) from exc
 
         try:
-            framerate = float(stream.framerate)
-        except (TypeError, ValueError) as exc:
+            framerate = float(stream.framerate)
+        except (TypeError, ValueError) as exc:
+            raise VideoConversionError(
+                f"Invalid framerate in '{source}': {stream.framerate}"
+            ) from exc
+
+        try:
+            bit_rate = int(stream.bit_rate)
+        except (TypeError, ValueError) as exc:
+            raise VideoConversionError(
+                f"Invalid bit_rate in '{source}': {stream.bit_rate}"
+            ) from exc
+
+        coded_width, coded_height, framerate, _ = output_geometry(
+            coded_width, coded_height, framerate, max_height, max_fps
+        )
+        if coded_height == HEIGHT_1080P:
+            bitrate = BITRATE_1080P
+        elif coded_height == HEIGHT_1520P:
+            bitrate = BITRATE_1520P
+        elif coded_height == HEIGHT_2160P:
+            bitrate = BITRATE_2160P
+        else:
+            bitrate = int(round(coded_height * coded_width * framerate * bitratemodifier))
+        bitrate = int(
+            round(bitrate * CODEC_BITRATE_SCALE.get(codec, 1.0) * (complexity_scale or 1.0))
+        )
+
+        bitrate_limit = int(round(bit_rate * ratio_max))
+
+        if apply_ratio_limit and bitrate > bitrate_limit:
+            bitrate = bitrate_limit
+
+        if bitrate > mbits_max * 1024 * 1024:
+            bitrate = mbits_max * 1024 * 1024
+
+        result = bitrate
+        return result
+    except VideoConversionError:
+        raise
+    except (
+        OSError,
+        ValueError,
+        TypeError,
+        IndexError,
+        AttributeError,
+        subprocess.SubprocessError,
+    ) as exc:
+        raise VideoConversionError(f"Failed to calculate bitrate for '{source}': {exc}") from exc
+
+
+def should_stream_copy(chapter_probes, codec, target_bitrate):
+    """Return True when every chapter already uses ``codec`` at or below ``target_bitrate``.
+
+    Re-encoding such a sequence cannot make it meaningfully smaller, so the caller can
+    concatenate it with ``-c copy`` instead.
+    """
+    expected_codec = CODEC_STREAM_NAMES.get(codec)
+    if expected_codec is None:
+        return False
+    for probe in chapter_probes:
+        stream = probe.streams[0]
+        if stream.codec_name != expected_codec:
+            return False
+        bit_rate = parse_int(stream.bit_rate)
+        if bit_rate is None or bit_rate > target_bitrate:
+            return False
+    return True
+
+
+def sum_durations(probes):
+    """Return the total duration of ``probes`` in seconds, or None if any is unknown."""
+    total = 0.0
+    for probe in probes:
+        duration = getattr(probe, "duration", None)
+        if duration is None:
+            return None
+        total += duration
+    return total
+
+
+def plan_chunk_boundaries(duration, chunks, min_duration=CHUNK_MIN_DURATION):
+    """Return the timestamps at which to split ``duration`` seconds into up to ``chunks`` parts.
+
+    No boundaries are returned when chunking is disabled, the duration is unknown or
+    every part would be shorter than ``min_duration``.
+    """
+    if not duration or chunks <= 1:
+        return []
+    count = min(chunks, int(duration // min_duration))
+    if count <= 1:
+        return []
+    step = duration / count
+    return [round(step * index, 3) for index in range(1, count)]
+
+
+def chunk_split_command(concat_path, boundaries, work_dir):
+    """Split the video stream at keyframes near ``boundaries`` without re-encoding."""
+    segment_times = ",".join(f"{boundary:.3f}" for boundary in boundaries)
+    return (
+        FFmpegCommand()
+        .add_concat_input(concat_path)
+        .add_output(
+            os.path.join(work_dir, "source_%04d.mp4"),
+            "-map",
+            "0:0",
+            "-c",
+            "copy",
+            "-f",
+            "segment",
+            "-segment_times",
+            segment_times,
+            "-reset_timestamps",
+            "1",
+        )
+    )
+
+
+def chunk_encode_command(chunk_source, encoder_args, chunk_output):
+    return (
+        FFmpegCommand(*FFMPEG_PROGRESS_ARGS)
+        .add_input(chunk_source)
+        .add_output(chunk_output, *encoder_args, "-an", "-map", "0:0")
+    )
+
+
+def chunk_stitch_command(encoded_list, concat_path, has_telemetry, output_path):
+    """Join encoded chunks and stream-copy audio/telemetry from the original chapters."""
+    stream_maps = ["-map", "0:0", "-map", "1:1"]
+    if has_telemetry:
+        stream_maps += ["-map", "1:3"]
+    return (
+        FFmpegCommand()
+        .add_concat_input(encoded_list)
+        .add_concat_input(concat_path)
+        .add_output(output_path, *stream_maps, "-c", "copy", "-f", "mp4")
+    )
+
+
+def plan_segments(duration, segment_duration):
+    """Return (start, length) windows covering ``duration``; the last one runs to the end."""
+    if not duration or duration <= segment_duration:
+        return []
+    starts = []
+    start = 0.0
+    while start < duration:
+        starts.append(start)
+        start += segment_duration
+    return [(start, segment_duration) for start in starts[:-1]] + [(starts[-1], None)]
+
+
+def segment_encode_command(concat_path, start, length, encoder_args, output_path):
+    """Encode the video stream of one segment window, seeking accurately in the input."""
+    window = ["-ss", f"{start:.3f}"]
+    if length is not None:
+        window += ["-t", f"{length:.3f}"]
+    return (
+        FFmpegCommand(*FFMPEG_PROGRESS_ARGS)
+        .add_concat_input(concat_path, *window)
+        .add_output(output_path, *encoder_args, "-an", "-map", "0:0", "-f", "mp4")
+    )
+
+
+def load_segment_manifest(manifest_path, identity):
+    """Return the finished segment indexes recorded for ``identity``, or None."""
+    try:
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get("identity") != identity:
+        return None
+    return set(manifest.get("completed", []))
+
+
+def write_segment_manifest(manifest_path, identity, completed):
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, "w") as manifest_file:
+        json.dump({"identity": identity, "completed": sorted(completed)}, manifest_file)
+    os.replace(temp_path, manifest_path)
+
+
+def encode_sequence_segmented(plan, concat_path, read_ahead=None):
+    """Encode a sequence as fixed-duration segments that survive an interrupted run.
+
+    Finished segments and a manifest live in ``<output>.segments``, which is not a
+    temporary directory: only the segment being encoded is tracked as a partial
+    output. A later run with the same chapters and encoder arguments skips every
+    recorded segment, then the segments are joined with stream copy together with
+    the original audio and telemetry.
+    """
+    context = plan.context
+    work_dir = plan.segment_dir
+    manifest_path = os.path.join(work_dir, SEGMENT_MANIFEST_FILENAME)
+    encoder_args = plan.encoder_args()
+    identity = {
+        "inputs": sequence_inputs(plan.chapter_paths),
+        # Thread caps follow --jobs, so a resumed run may use other ones.
+        "encoder_args": without_thread_caps(encoder_args),
+        "segments": [list(segment) for segment in plan.segments],
+    }
+    completed = load_segment_manifest(manifest_path, identity)
+    if completed is None:
+        completed = set()
+        cleanup_tracked_dir(work_dir, "outdated segment directory")
+    try:
+        os.makedirs(work_dir, exist_ok=True)
+    except OSError as exc:
+        raise VideoConversionError(
+            f"Failed to create segment directory '{work_dir}' for {context}: {exc}"
+        ) from exc
+
+    segment_paths = [plan.segment_path(index) for index in range(len(plan.segments))]
+    completed = {
+        index
+        for index in completed
+        if index < len(segment_paths) and os.path.exists(segment_paths[index])
+    }
+    if completed:
+        logger.info(
+            "Resuming %s with %d of %d segments already encoded.",
+            context,
+            len(completed),
+            len(segment_paths),
+        )
+
+    for index, (start, length) in enumerate(plan.segments):
+        if index in completed:
+            continue
+        label = f"segment {index + 1}/{len(segment_paths)}"
+        partial_path = f"{segment_paths[index]}{PARTIAL_OUTPUT_SUFFIX}"
+        register_partial_output(partial_path)
+        try:
+            listener = None
+            if read_ahead is not None:
+
+                def listener(position, start=start):
+                    read_ahead.advance(None if position is None else start + position)
+
+            run_command(
+                segment_encode_command(concat_path, start, length, encoder_args, partial_path),
+                f"encoding {label} for {context}",
+                progress=ProgressMonitor(f"{plan.sequence} {label}", length, listener=listener),
+            )
+            os.replace(partial_path, segment_paths[index])
+        finally:
+            cleanup_tracked_path(partial_path, "partial segment", unregister_partial_output)
+        completed.add(index)
+        write_segment_manifest(manifest_path, identity, completed)
+
+    encoded_list = os.path.join(work_dir, "encoded.txt")
+    with open(encoded_list, "w") as encoded_file:
+        for segment_path in segment_paths:
+            escaped_path = escape_concat_path(os.path.abspath(segment_path))
+            encoded_file.write(f"file '{escaped_path}'\n")
+    run_command(
+        chunk_stitch_command(
+            encoded_list, concat_path, plan.has_telemetry, plan.partial_destination
+        ),
+        f"joining segments for {context}",
+    )
+
+
+def encode_sequence_chunked(plan, concat_path):
+    """Encode a concatenated sequence as keyframe-aligned chunks in parallel and stitch them.
+
+    The video stream is split with stream copy (which can only cut on keyframes), every
+    chunk is encoded concurrently with the plan's encoder arguments and the encoded
+    chunks are joined with the concat demuxer. Audio and telemetry are stream-copied
+    from the original chapters so the output has the same stream mapping as a
+    single-pass encode.
+    """
+    context = plan.context
+    output_path = plan.partial_destination
+    work_dir = f"{output_path}{CHUNK_DIR_SUFFIX}"
+    cleanup_tracked_dir(work_dir, "stale chunk directory")
+    try:
+        os.makedirs(work_dir)
+    except OSError as exc:
+        raise VideoConversionError(
+            f"Failed to create chunk directory '{work_dir}' for {context}: {exc}"
+        ) from exc
+    register_temp_dir(work_dir)
+
+    try:
+        run_command(
+            chunk_split_command(concat_path, plan.chunk_boundaries, work_dir),
+            f"splitting chunks for {context}",
+        )
+
+        chunk_sources = sorted(
+            os.path.join(work_dir, name)
+            for name in os.listdir(work_dir)
+            if name.startswith("source_")
+        )
+        if not chunk_sources:
+            raise VideoConversionError(f"Splitting produced no chunks for {context}")
+        chunk_outputs = [
+            os.path.join(work_dir, f"encoded_{index:04d}.mp4")
+            for index in range(len(chunk_sources))
+        ]
+        logger.info("Encoding %d chunks in parallel for %s.", len(chunk_sources), context)
+
+        # Keyframe alignment moves the real cut points slightly, so these are estimates.
+        chunk_edges = [0.0, *plan.chunk_boundaries, plan.duration]
+        encoder_args = plan.encoder_args()
+
+        tracker = current_tracker()
+
+        def encode_chunk(index):
+            chunk_label = f"chunk {index + 1}/{len(chunk_sources)}"
+            chunk_duration = None
+            if plan.duration and index + 1 < len(chunk_edges):
+                chunk_duration = chunk_edges[index + 1] - chunk_edges[index]
+            monitor = ProgressMonitor(f"{plan.sequence} {chunk_label}", chunk_duration)
+            # Pool threads do not inherit the caller's tracker; the encodes belong to it.
+            with use_tracker(tracker):
+                run_command(
+                    chunk_encode_command(chunk_sources[index], encoder_args, chunk_outputs[index]),
+                    f"encoding {chunk_label} for {context}",
+                    progress=monitor,
+                )
+
+        with ThreadPoolExecutor(
+            max_workers=len(chunk_sources), thread_name_prefix="chunk"
+        ) as executor:
+            list(executor.map(encode_chunk, range(len(chunk_sources))))
+
+        encoded_list = os.path.join(work_dir, "encoded.txt")
+        with open(encoded_list, "w") as encoded_file:
+            for chunk_output in chunk_outputs:
+                escaped_path = escape_concat_path(os.path.abspath(chunk_output))
+                encoded_file.write(f"file '{escaped_path}'\n")
+
+        run_command(
+            chunk_stitch_command(encoded_list, concat_path, plan.has_telemetry, output_path),
+            f"stitching chunks for {context}",
+        )
+    finally:
+        cleanup_tracked_dir(work_dir, "chunk directory", unregister_temp_dir)
+
+
+def with_encoder_params(options, flag, params):
+    """Append ``params`` to the ``flag`` (e.g. -svtav1-params) list in ``options``, or add it."""
+    options = list(options)
+    if flag in options:
+        index = options.index(flag) + 1
+        options[index] = f"{options[index]}:{params}"
+        return options
+    return [*options, flag, params]
+
+
+def build_encoder_args(options, bitrate, preset, video_filter=None):
+    """Return the encoder arguments for a re-encode at ``bitrate`` with ``preset``.
+
+    Rate control follows the encoder: QSV gets its VBR cap and lookahead options,
+    x264/x265 the same VBV cap, and SVT-AV1 plain VBR because it only accepts a
+    maximum bit rate in CRF mode.
+    """
+    options = normalize_options(options)
+    encoder = options[options.index("-c:v") + 1] if "-c:v" in options else None
+    maxrate = int(bitrate * MAXRATE_MULTIPLIER)
+    bufsize = int(bitrate * BUFSIZE_MULTIPLIER)
+    lookahead = []
+    if encoder == CPU_ENCODERS["av1"]:
+        preset = str(SVT_AV1_PRESETS[preset])
+        options = with_encoder_params(options, "-svtav1-params", "rc=1")
+        rate_control = ["-b:v", str(bitrate)]
+    elif encoder in CPU_ENCODERS.values():
+        rate_control = ["-b:v", str(bitrate), "-maxrate", str(maxrate), "-bufsize", str(bufsize)]
+    else:
+        rate_control = [
+            "-b:v",
+            str(bitrate),
+            "-maxrate",
+            str(maxrate),
+            "-bitrate_limit",
+            "0",
+            "-bufsize",
+            str(bufsize),
+        ]
+        lookahead = ["-look_ahead", "1"]
+    return [
+        *options,
+        *rate_control,
+        "-fps_mode",
+        "passthrough",
+        "-g",
+        "120",
+        "-preset",
+        preset,
+        *lookahead,
+        *(["-vf", video_filter] if video_filter else []),
+    ]
+
+
+def parse_quality_metrics(output):
+    """Extract the SSIM (All) and PSNR (average) scores from ffmpeg's filter log."""
+    metrics = {}
+    ssim_match = SSIM_PATTERN.search(output or "")
+    if ssim_match:
+        metrics["ssim"] = float(ssim_match.group(1))
+    psnr_match = PSNR_PATTERN.search(output or "")
+    if psnr_match:
+        metrics["psnr"] = float(psnr_match.group(1))
+    return metrics
+
+
+def plan_sample_offsets(duration, samples, sample_duration):
+    """Spread ``samples`` windows evenly across the sequence, avoiding its very edges."""
+    if not duration or duration <= sample_duration:
+        return [0.0]
+    offsets = []
+    for index in range(samples):
+        center = duration * (index + 1) / (samples + 1)
+        start = min(max(0.0, center - sample_duration / 2), duration - sample_duration)
+        offsets.append(round(start, 3))
+    return offsets
+
+
+class PresetTuner:
+    """Picks the fastest encoder preset whose sample encodes meet a quality floor.
+
+    A few short windows of the sequence are encoded at each candidate preset (fastest
+    first) and compared with the source using ffmpeg's ``ssim`` and ``psnr`` filters.
+    The first preset whose worst sample reaches the floor wins. Choices are cached per
+    encoder, resolution and frame rate, so later sequences with the same footage type
+    skip the sampling.
+    """
+
+    def __init__(
+        self,
+        metric="ssim",
+        floor=None,
+        candidates=None,
+        samples=AUTO_PRESET_SAMPLES,
+        sample_duration=AUTO_PRESET_SAMPLE_DURATION,
+    ):
+        if metric not in DEFAULT_QUALITY_FLOORS:
+            raise VideoConversionError(f"Unsupported quality metric: {metric}")
+        self.metric = metric
+        self.floor = DEFAULT_QUALITY_FLOORS[metric] if floor is None else floor
+        self.candidates = list(candidates or AUTO_PRESET_CANDIDATES)
+        self.samples = samples
+        self.sample_duration = sample_duration
+        self._choices = {}
+        self._key_locks = {}
+        self._lock = RLock()
+
+    def cache_key(self, probe, options):
+        stream = probe.streams[0]
+        framerate = parse_float(stream.framerate)
+        return (
+            tuple(options),
+            parse_int(stream.coded_width),
+            parse_int(stream.coded_height),
+            round(framerate, 2) if framerate is not None else None,
+        )
+
+    def choose(self, concat_path, probe, duration, options, bitrate, context, video_filter=None):
+        key = (*self.cache_key(probe, options), video_filter)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, RLock())
+        # Parallel sequences of the same footage type wait for one sampling run.
+        with key_lock:
+            with self._lock:
+                if key in self._choices:
+                    return self._choices[key]
+            preset = self._sample_presets(
+                concat_path, duration, options, bitrate, context, video_filter
+            )
+            with self._lock:
+                self._choices[key] = preset
+            return preset
+
+    def _sample_presets(self, concat_path, duration, options, bitrate, context, video_filter):
+        offsets = plan_sample_offsets(duration, self.samples, self.sample_duration)
+        work_dir = tempfile.mkdtemp(prefix="video-preset-samples-")
+        register_temp_dir(work_dir)
+        try:
+            for preset in self.candidates:
+                scores = [
+                    self._measure_sample(
+                        concat_path,
+                        offset,
+                        options,
+                        bitrate,
+                        preset,
+                        work_dir,
+                        context,
+                        video_filter,
+                    )
+                    for offset in offsets
+                ]
+                worst = min(scores)
+                logger.info(
+                    "Auto-preset for %s: %s scored %s %.4f (floor %.4f)",
+                    context,
+                    preset,
+                    self.metric.upper(),
+                    worst,
+                    self.floor,
+                )
+                if worst >= self.floor:
+                    return preset
+        finally:
+            cleanup_tracked_dir(work_dir, "preset sample directory", unregister_temp_dir)
+
+        fallback = self.candidates[-1]
+        logger.warning(
+            "No preset met the %s floor %.4f for %s; using %s.",
+            self.metric.upper(),
+            self.floor,
+            context,
+            fallback,
+        )
+        return fallback
+
+    def _measure_sample(
+        self, concat_path, offset, options, bitrate, preset, work_dir, context, video_filter
+    ):
+        sample_path = os.path.join(work_dir, f"sample_{preset}_{offset:.3f}.mp4")
+        window = ["-ss", f"{offset:.3f}", "-t", f"{self.sample_duration:.3f}"]
+        run_command(
+            FFmpegCommand("-v", "error")
+            .add_concat_input(concat_path, *window)
+            .add_output(
+                sample_path,
+                *build_encoder_args(options, bitrate, preset, video_filter),
+                "-an",
+                "-map",
+                "0:0",
+                "-f",
+                "mp4",
+            ),
+            f"encoding {preset} sample for {context}",
+        )
+        # The reference goes through the same downscale so both sides match frame for frame.
+        reference = (
+            f"[1:v]{video_filter},split[ref1][ref2]" if video_filter else "[1:v]split[ref1][ref2]"
+        )
+        output = run_command(
+            FFmpegCommand("-nostats")
+            .add_input(sample_path)
+            .add_concat_input(concat_path, *window)
+            .add_output(
+                "-",
+                "-lavfi",
+                f"[0:v]split[enc1][enc2];{reference};[enc1][ref1]ssim;[enc2][ref2]psnr",
+                "-f",
+                "null",
+            ),
+            f"measuring {preset} sample quality for {context}",
+            capture_stderr=True,
+        )
+        metrics = parse_quality_metrics(output)
+        if self.metric not in metrics:
+            raise VideoConversionError(
+                f"Could not read {self.metric.upper()} score for {preset} sample of {context}"
+            )
+        return metrics[self.metric]
+
+
+def chapter_sort_key(filename):
+    """Order chapters by their GoPro chapter number (GH01..., GH02...), then by name."""
+    if filename[:2] in ("GH", "GX") and filename[2:GOPRO_PREFIX_LENGTH].isdigit():
+        return (int(filename[2:GOPRO_PREFIX_LENGTH]), filename)
+    return (0, filename)
+
+
+def scan_loose_chapters(path):
+    """Return the names of the .mp4 files directly inside ``path`` with one os.scandir pass."""
+    try:
+        with os.scandir(path) as entries:
+            return sorted(
+                entry.name
+                for entry in entries
+                if entry.name.lower().endswith(".mp4") and entry.is_file()
+            )
+    except OSError as exc:
+        raise VideoConversionError(f"Unable to list contents of '{path}': {exc}") from exc
+
+
+def index_sequences(contents):
+    """Group the .mp4 names in ``contents`` by sequence, each ordered by chapter number."""
+    index = {}
+    for name in contents:
+        if name.lower().endswith(".mp4"):
+            index.setdefault(get_file_sequence(name), []).append(name)
+    for chapters in index.values():
+        chapters.sort(key=chapter_sort_key)
+    return index
+
+
+def place_chapter(source, destination, link=False):
+    """Move ``source`` to ``destination``, or link it there when ``link`` is set.
+
+    Hardlinks fall back to a symlink when the filesystem cannot provide one
+    (another mount, or no hardlink support), so sources are never copied.
+    """
+    if os.path.lexists(destination):
+        if link and os.path.exists(destination) and os.path.samefile(source, destination):
+            return
+        logger.warning(
+            "Skipping moving '%s' to '%s' because destination already exists",
+            sanitize_for_log(source),
+            sanitize_for_log(destination),
+        )
+        return
+    if not link:
+        try:
+            os.rename(source, destination)
+        except FileNotFoundError:
+            # Another --worker node organized the same chapter first.
+            if not os.path.exists(destination):
+                raise
+        return
+    link_file(source, destination)
+
+
+def link_file(source, destination):
+    """Hardlink ``source`` to ``destination``, or symlink it where hardlinks are impossible."""
+    try:
+        os.link(source, destination)
+    except OSError as exc:
+        if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP):
+            raise
+        os.symlink(os.path.abspath(source), destination)
+
+
+def skip_archived_sequences(index, path, options_hash=None):
+    """Drop loose sequences whose chapters are all archived with the ``options_hash`` settings."""
+    archive = _ARCHIVE_INDEX
+    if archive is None or options_hash is None:
+        return index
+    remaining = {}
+    for sequence, chapters in index.items():
+        fingerprints = [chapter_fingerprint(os.path.join(path, chapter)) for chapter in chapters]
+        outputs = archive.archived_outputs(fingerprints, options_hash)
+        if outputs is None:
+            remaining[sequence] = chapters
+            continue
+        logger.info(
+            "Leaving sequence %s in place: its chapters are already archived in %s.",
+            sanitize_for_log(sequence),
+            ", ".join(sanitize_for_log(output) for output in outputs),
+        )
+    return remaining
+
+
+def videostofolders(contents, path, dry_run=False, link=False, options_hash=None):
+    """Organize the loose chapters in ``contents`` into per-sequence folders.
+
+    Returns the sequences found. With ``dry_run`` the moves are printed as plan
+    comments instead; with ``link`` chapters are hardlinked and left in place. With
+    ``options_hash``, sequences already archived with those settings are left loose.
+    """
+    index = skip_archived_sequences(index_sequences(contents), path, options_hash)
+    if not index:
+        logger.info("There is nothing to sort")
+        return []
+    logger.info("There is something to sort")
+
+    action = ["ln"] if link else ["mv", "-n"]
+    try:
+        for sequence, chapters in index.items():
+            sequence_dir = os.path.join(path, sequence)
+            if dry_run:
+                print(f"# {shlex.join(['mkdir', '-p', sequence_dir])}")
+            else:
+                os.makedirs(sequence_dir, exist_ok=True)
+            for chapter in chapters:
+                source = os.path.join(path, chapter)
+                destination = os.path.join(sequence_dir, chapter)
+                if dry_run:
+                    print(f"# {shlex.join([*action, source, destination])}")
+                else:
+                    place_chapter(source, destination, link)
+    except OSError as exc:
+        raise VideoConversionError(f"Failed to organize videos in '{path}': {exc}") from exc
+
+    return list(index)
+
+
+class InotifyWatcher:
+    """Wake up when files are created in or moved into one directory (Linux inotify)."""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), INOTIFY_EVENTS) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, os.strerror(error), path)
+
+    def wait(self, timeout):
+        """Block for up to ``timeout`` seconds; return True if the directory changed."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        # Only the wake-up matters; the folder is rescanned as a whole.
+        while True:
+            try:
+                os.read(self.fd, 65536)
+            except BlockingIOError:
+                return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback watcher that simply sleeps between rescans."""
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return False
+
+    def close(self):
+        pass
+
+
+def open_directory_watcher(path):
+    """Return an inotify watcher for ``path``, or a polling one where inotify is unavailable."""
+    try:
+        return InotifyWatcher(path)
+    except (OSError, AttributeError) as exc:
+        logger.info("inotify unavailable (%s); polling for new chapters", sanitize_for_log(exc))
+        return PollingWatcher()
+
+
+class SequenceTracker:
+    """Report sequences whose chapters have not changed for ``quiet_period`` seconds."""
+
+    def __init__(self, quiet_period=WATCH_QUIET_PERIOD):
+        self.quiet_period = quiet_period
+        self._snapshots = {}
+        self._queued = {}
+
+    def observe(self, sequence, snapshot, now):
+        """Record ``snapshot`` and return True once it is stable and not yet queued."""
+        previous = self._snapshots.get(sequence)
+        if previous is None or previous[0] != snapshot:
+            self._snapshots[sequence] = (snapshot, now)
+            return False
+        if now - previous[1] < self.quiet_period or self._queued.get(sequence) == snapshot:
+            return False
+        # A sequence that gains chapters after conversion is queued again.
+        self._queued[sequence] = snapshot
+        return True
+
+
+def sequence_snapshot(path, sequence):
+    """Return the (name, size, mtime) of every chapter in a sequence folder, or None."""
+    try:
+        with os.scandir(os.path.join(path, sequence)) as entries:
+            return tuple(
+                sorted(
+                    (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+                    for entry in entries
+                    if entry.is_file()
+                )
+            )
+    except OSError:
+        return None
+
+
+def organize_new_chapters(path, link=False, options_hash=None):
+    """Move loose chapters into their sequence folders and return the sequences touched."""
+    # Converted outputs share the first chapter's name, which already sits in the folder.
+    loose = [
+        name
+        for name in scan_loose_chapters(path)
+        if not os.path.lexists(os.path.join(path, get_file_sequence(name), name))
+    ]
+    if not loose:
+        return []
+    return videostofolders(loose, path, link=link, options_hash=options_hash)
+
+
+def convert_watched_sequences(queue, path, sequence_args, sequence_kwargs):
+    """Worker loop for --watch: convert queued sequences until a None sentinel arrives."""
+    while (sequence := queue.get()) is not None:
+        try:
+            convert_sequence(path, sequence, *sequence_args, **sequence_kwargs)
+        except (VideoConversionError, OSError) as exc:
+            logger.error(
+                "Conversion of sequence %s failed: %s",
+                sanitize_for_log(sequence),
+                sanitize_for_log(exc),
+            )
+
+
+def watch_videos(
+    path,
+    options,
+    bitratemodifier,
+    mbits_max,
+    ratio_max,
+    convert,
+    quiet_period=WATCH_QUIET_PERIOD,
+    jobs=1,
+    poll_interval=WATCH_POLL_INTERVAL,
+    stop=None,
+    watcher=None,
+    link=False,
+    **sequence_kwargs,
+):
+    """Organize chapters as they land in ``path`` and convert each completed sequence.
+
+    Runs until ``stop`` is set (or the process is signalled). ``sequence_kwargs``
+    are passed to convert_sequence, as convertVideos does.
+    """
+    validate_conversion_settings(
+        jobs, sequence_kwargs.get("chunks", 1), sequence_kwargs.get("segment_duration")
+    )
+
+    stop = stop or Event()
+    watcher = watcher or open_directory_watcher(path)
+    tracker = SequenceTracker(quiet_period)
+    queue = Queue()
+    sequence_args = (options, bitratemodifier, mbits_max, ratio_max, convert)
+    options_hash = sequence_options_hash(*sequence_args, **sequence_kwargs)
+    workers = [
+        Thread(
+            target=convert_watched_sequences,
+            args=(queue, path, sequence_args, sequence_kwargs),
+            name=f"watch-{index}",
+            daemon=True,
+        )
+        for index in range(jobs)
+    ]
+    for worker in workers:
+        worker.start()
+
+    logger.info("Watching %s for new chapters.", sanitize_for_log(path))
+    watched = set()
+    enqueue_sequences([], recover=True)
+    try:
+        while not stop.is_set():
+            organized = organize_new_chapters(path, link, options_hash)
+            enqueue_sequences(organized)
+            watched.update(organized)
+            now = time.monotonic()
+            for sequence in sorted(watched):
+                snapshot = sequence_snapshot(path, sequence)
+                if not snapshot:
+                    watched.discard(sequence)
+                elif tracker.observe(sequence, snapshot, now):
+                    logger.info(
+                        "Sequence %s is complete; queued for conversion.",
+                        sanitize_for_log(sequence),
+                    )
+                    queue.put(sequence)
+            watcher.wait(poll_interval)
+    finally:
+        watcher.close()
+        for _ in workers:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+
+
+class SequencePlan:
+    """Everything decided about one sequence before any file is written or command run."""
+
+    def __init__(
+        self,
+        sequence,
+        chapter_paths,
+        destination,
+        probes,
+        options,
+        convert=True,
+        bitrate=None,
+        preset=DEFAULT_PRESET,
+        has_telemetry=False,
+        chunk_boundaries=None,
+        segments=None,
+        options_hash=None,
+        scratch_dir=None,
+        video_filter=None,
+        fingerprints=None,
+        proxy_path=None,
+        thumbnail_dir=None,
+        thumbnail_interval=THUMBNAIL_INTERVAL,
+        complexity_sources=None,
+    ):
+        self.sequence = sequence
+        self.chapter_paths = chapter_paths
+        self.source = chapter_paths[0]
+        self.destination = destination
+        # Work files live next to the output unless a scratch directory is given.
+        work_base = destination
+        if scratch_dir:
+            work_base = os.path.join(scratch_dir, os.path.basename(destination))
+        self.partial_destination = f"{work_base}{PARTIAL_OUTPUT_SUFFIX}"
+        self.probes = probes
+        self.options = options
+        self.convert = convert
+        self.bitrate = bitrate
+        self.preset = preset
+        self.has_telemetry = has_telemetry
+        self.chunk_boundaries = chunk_boundaries or []
+        self.segments = segments or []
+        self.options_hash = options_hash
+        self.segment_dir = f"{work_base}{SEGMENT_DIR_SUFFIX}"
+        self.video_filter = video_filter
+        self.fingerprints = fingerprints
+        self.proxy_path = proxy_path
+        self.proxy_partial = proxy_path and f"{proxy_path}{PARTIAL_OUTPUT_SUFFIX}"
+        self.thumbnail_dir = thumbnail_dir
+        self.thumbnail_partial_dir = thumbnail_dir and f"{thumbnail_dir}{PARTIAL_OUTPUT_SUFFIX}"
+        self.thumbnail_interval = thumbnail_interval
+        # Chapters whose SI/TI a dry run could not take from the cache.
+        self.complexity_sources = complexity_sources or []
+        self.duration = sum_durations(probes)
+
+    @property
+    def context(self):
+        action = "converting" if self.convert else "concatenating"
+        return f"{action} sequence '{sanitize_for_log(self.sequence)}'"
+
+    def stream_maps(self):
+        # Processes streams 0-1 and stream 3 when telemetry is present.
+        maps = ["-map", "0:0", "-map", "0:1"]
+        if self.has_telemetry:
+            maps += ["-map", "0:3"]
+        return maps
+
+    def encoder_args(self):
+        return build_encoder_args(self.options, self.bitrate, self.preset, self.video_filter)
+
+    @property
+    def has_derived_outputs(self):
+        return bool(self.proxy_path or self.thumbnail_dir)
+
+    def segment_path(self, index):
+        return os.path.join(self.segment_dir, f"segment_{index:04d}.mp4")
+
+
+def normalize_options(options):
+    """Accept encoder options as an argv list or a legacy shell-style string."""
+    if isinstance(options, str):
+        return shlex.split(options)
+    return list(options)
+
+
+def list_sequence_chapters(path, sequence, include_loose=False):
+    """Return the chapter filenames of ``sequence`` in the order they are concatenated.
+
+    With ``include_loose``, a sequence that has not been organized into its folder yet
+    is built from the matching loose files in ``path`` (used by ``--plan``).
+    """
+    sequence_dir = os.path.join(path, sequence)
+    if include_loose and not os.path.isdir(sequence_dir):
+        files = [
+            name
+            for name in os.listdir(path)
+            if name.lower().endswith(".mp4") and get_file_sequence(name) == sequence
+        ]
+        return path, sorted(files, key=chapter_sort_key)
+    files = os.listdir(sequence_dir)
+    files.sort(key=chapter_sort_key)
+    return sequence_dir, files
+
+
+def link_archived_output(sequence, fingerprints, options_hash, destination, dry_run=False):
+    """Link ``destination`` to an archived output of the same chapters and settings.
+
+    Returns True when the sequence needs no conversion.
+    """
+    existing = _ARCHIVE_INDEX.lookup(archive_key(fingerprints, options_hash))
+    if existing is None:
+        return False
+    if os.path.lexists(destination):
+        # Only an output that already is the archived one counts; anything else is redone.
+        return os.path.exists(destination) and os.path.samefile(existing, destination)
+    logger.info(
+        "Sequence %s was already converted with the same settings to '%s'; linking it.",
+        sanitize_for_log(sequence),
+        sanitize_for_log(existing),
+    )
+    if dry_run:
+        print(f"# {shlex.join(['ln', existing, destination])}")
+        return True
+    try:
+        link_file(existing, destination)
+    except OSError as exc:
+        raise VideoConversionError(
+            f"Failed to link '{destination}' to archived output '{existing}': {exc}"
+        ) from exc
+    return True
+
+
+def sequence_already_converted(sequence, chapter_paths, destination, options_hash):
+    """Decide whether --resume may skip ``sequence``, preferring the job ledger's record."""
+    sanitized_sequence = sanitize_for_log(sequence)
+    ledger = _JOB_LEDGER
+    if ledger is not None:
+        state = ledger.check(sequence, sequence_inputs(chapter_paths), options_hash, destination)
+        if state == "current":
+            logger.info(
+                "Skipping sequence %s because the job ledger records a matching output.",
+                sanitized_sequence,
+            )
+            return True
+        if state == "stale":
+            logger.info(
+                "Converting sequence %s again: its last run failed or its chapters,"
+                " settings or output changed.",
+                sanitized_sequence,
+            )
+            return False
+    # Outputs from before the ledger existed can only be checked for presence.
+    if os.path.exists(destination):
+        logger.info(
+            "Skipping sequence %s because output already exists (resume enabled).",
+            sanitized_sequence,
+        )
+        return True
+    return False
+
+
+def plan_sequence(
+    path,
+    sequence,
+    options,
+    bitratemodifier,
+    mbits_max,
+    ratio_max,
+    convert,
+    resume=False,
+    codec=None,
+    auto_copy=True,
+    chunks=1,
+    preset=DEFAULT_PRESET,
+    include_loose=False,
+    options_hash=None,
+    segment_duration=None,
+    output_dir=None,
+    scratch_dir=None,
+    max_height=None,
+    max_fps=None,
+    complexity=False,
+    dry_run=False,
+    proxy=False,
+    thumbnail_interval=None,
+):
+    """Probe a sequence and decide how to convert it; returns None when it is skipped.
+
+    The output goes to ``output_dir`` (default: ``path``) and partial files to
+    ``scratch_dir`` (default: next to the output). ``max_height``/``max_fps`` cap the
+    encoded geometry, and the bitrate is computed for the capped output. With
+    ``complexity``, the bitrate is scaled by the sequence's measured SI/TI. Sequences
+    the archive index already has an output for are linked to it instead. ``proxy``
+    and ``thumbnail_interval`` add a 540p proxy and periodic thumbnails of the output.
+    """
+
+    sanitized_sequence = sanitize_for_log(sequence)
+    chapter_dir, files = list_sequence_chapters(path, sequence, include_loose)
+    if not files:
+        raise VideoConversionError(f"No video files found in sequence '{sequence}'")
+    source = os.path.join(chapter_dir, files[0])
+    output_base = output_dir or path
+    destination = os.path.join(output_base, files[0])
+    chapter_paths = [os.path.join(chapter_dir, filename) for filename in files]
+    if resume and sequence_already_converted(sequence, chapter_paths, destination, options_hash):
+        return None
+    fingerprints = None
+    if _ARCHIVE_INDEX is not None:
+        fingerprints = [chapter_fingerprint(chapter_path) for chapter_path in chapter_paths]
+        if link_archived_output(sequence, fingerprints, options_hash, destination, dry_run):
+            return None
+
+    chapter_probes = probeSequence(chapter_paths)
+    file = chapter_probes[0]
+    if len(file.streams) < 2:
+        stream_count = len(file.streams)
+        raise VideoConversionError(
+            f"Expected at least 2 streams in '{source}' but found {stream_count} stream(s)"
+        )
+    expected_layout = stream_layout(file)
+    for chapter_path, chapter_probe in zip(chapter_paths[1:], chapter_probes[1:], strict=True):
+        if stream_layout(chapter_probe) != expected_layout:
             raise VideoConversionError(
-                f"Invalid framerate in '{source}': {stream.framerate}"
-            ) from exc
+                f"Stream layout of '{chapter_path}' {stream_layout(chapter_probe)} does not"
+                f" match first chapter '{source}' {expected_layout}"
+            )
+
+    caps = {"max_height": max_height, "max_fps": max_fps}
+    complexity_sources = []
+    if convert and complexity and dry_run:
+        # --plan never decodes; it only uses SI/TI measured by an earlier run.
+        complexity_sources = [path for path in chapter_paths if not cached_complexity(path)]
+    if convert and complexity and not complexity_sources:
+        stats = sequence_complexity(chapter_paths, chapter_probes)
+        caps["complexity_scale"] = complexity_bitrate_scale(stats)
+        logger.info(
+            "Sequence %s has SI %.1f, TI %.1f; scaling its bitrate by %.2f.",
+            sanitized_sequence,
+            stats["si"],
+            stats["ti"],
+            caps["complexity_scale"],
+        )
+    bitrate = calculateBitrate(
+        source, bitratemodifier, mbits_max, ratio_max, probe=file, codec=codec, **caps
+    )
+    stream = file.streams[0]
+    *_, video_filter = output_geometry(
+        parse_int(stream.coded_width) or 0,
+        parse_int(stream.coded_height) or 0,
+        parse_float(stream.framerate) or 0.0,
+        max_height,
+        max_fps,
+    )
+    if convert and auto_copy and codec and not video_filter:
+        target_bitrate = calculateBitrate(
+            source,
+            bitratemodifier,
+            mbits_max,
+            ratio_max,
+            probe=file,
+            apply_ratio_limit=False,
+            codec=codec,
+            complexity_scale=caps.get("complexity_scale"),
+        )
+        if should_stream_copy(chapter_probes, codec, target_bitrate):
+            logger.info(
+                "Sequence %s is already %s at or below the %d bps target;"
+                " copying streams instead of re-encoding.",
+                sanitized_sequence,
+                codec,
+                target_bitrate,
+            )
+            convert = False
+
+    if len(file.streams) >= 4:
+        if file.streams[3].codec_name != "bin_data":
+            found_codec = file.streams[3].codec_name
+            raise VideoConversionError(
+                f"Expected bin_data stream at index 3 in '{source}' but found '{found_codec}'"
+            )
+        has_telemetry = True
+    elif len(file.streams) == 3:
+        stream_count = len(file.streams)
+        raise VideoConversionError(
+            f"Unsupported stream layout in '{source}':"
+            f" expected 2 streams (video+audio) or at least"
+            f" 4 streams (video+audio+extra+telemetry),"
+            f" but found {stream_count} stream(s)"
+        )
+    else:
+        has_telemetry = False
+
+    plan = SequencePlan(
+        sequence,
+        chapter_paths,
+        destination,
+        chapter_probes,
+        normalize_options(options),
+        convert=convert,
+        bitrate=bitrate,
+        preset=preset,
+        has_telemetry=has_telemetry,
+        options_hash=options_hash,
+        scratch_dir=scratch_dir,
+        video_filter=video_filter if convert else None,
+        fingerprints=fingerprints,
+        proxy_path=proxy and os.path.join(output_base, PROXY_DIRNAME, files[0]),
+        thumbnail_dir=thumbnail_interval
+        and os.path.join(output_base, THUMBNAIL_DIRNAME, os.path.splitext(files[0])[0]),
+        thumbnail_interval=thumbnail_interval or THUMBNAIL_INTERVAL,
+        complexity_sources=complexity_sources,
+    )
+    if convert and segment_duration:
+        plan.segments = plan_segments(plan.duration, segment_duration)
+    elif convert:
+        plan.chunk_boundaries = plan_chunk_boundaries(plan.duration, chunks)
+        if chunks > 1 and not plan.chunk_boundaries:
+            logger.info(
+                "Sequence %s is too short or has no known duration; encoding in one piece.",
+                sanitized_sequence,
+            )
+    return plan
+
+
+def encode_command(plan, concat_path):
+    """Return the single-pass ffmpeg command that writes the plan's partial output.
+
+    Proxy and thumbnail outputs are fed from the same decode through a split filter.
+    """
+    codec_args = plan.encoder_args() if plan.convert else ["-c", "copy"]
+    command = FFmpegCommand(*FFMPEG_PROGRESS_ARGS).add_concat_input(concat_path)
+    if not plan.has_derived_outputs:
+        return command.add_output(
+            plan.partial_destination, *codec_args, *plan.stream_maps(), "-f", "mp4"
+        )
+
+    maps = plan.stream_maps()
+    if plan.convert:
+        # The archive branch of the split graph applies the --max-height/--max-fps filter.
+        codec_args = build_encoder_args(plan.options, plan.bitrate, plan.preset)
+        maps[1] = "[archive]"
+    command.add_global("-filter_complex", split_filter_graph(plan, archive=plan.convert))
+    command.add_output(plan.partial_destination, *codec_args, *maps, "-f", "mp4")
+    return add_derived_outputs(command, plan)
+
+
+def derived_outputs_command(plan, concat_path):
+    """Return a command writing only the proxy and thumbnails (for chunked/segmented encodes)."""
+    command = FFmpegCommand("-v", "error").add_concat_input(concat_path)
+    command.add_global("-filter_complex", split_filter_graph(plan, archive=False))
+    return add_derived_outputs(command, plan)
+
+
+def split_filter_graph(plan, archive=True):
+    """Return the filter graph that splits one decode between the plan's video outputs."""
+    branches = []
+    if archive:
+        branches.append(f"{plan.video_filter or 'null'}[archive]")
+    if plan.proxy_path:
+        branches.append(f"scale=-2:{PROXY_HEIGHT}[proxy]")
+    if plan.thumbnail_dir:
+        branches.append(f"fps=1/{plan.thumbnail_interval:g},scale=-2:{THUMBNAIL_HEIGHT}[thumbs]")
+    labels = [f"[v{index}]" for index in range(len(branches))]
+    graph = [f"[0:v:0]split={len(branches)}{''.join(labels)}"]
+    graph += [label + branch for label, branch in zip(labels, branches, strict=True)]
+    return ";".join(graph)
+
+
+def add_derived_outputs(command, plan):
+    if plan.proxy_path:
+        command.add_output(
+            plan.proxy_partial, "-map", "[proxy]", "-map", "0:1", *PROXY_ENCODER_ARGS, "-f", "mp4"
+        )
+    if plan.thumbnail_dir:
+        command.add_output(
+            os.path.join(plan.thumbnail_partial_dir, "%05d.jpg"),
+            "-map",
+            "[thumbs]",
+            "-q:v",
+            "3",
+            "-f",
+            "image2",
+        )
+    return command
+
+
+def prepare_derived_outputs(plan):
+    """Create the work locations of the proxy and thumbnails and track them for cleanup."""
+    if plan.proxy_path:
+        os.makedirs(os.path.dirname(plan.proxy_path), exist_ok=True)
+        cleanup_tracked_path(plan.proxy_partial, "stale partial proxy", raise_on_error=False)
+        register_partial_output(plan.proxy_partial)
+    if plan.thumbnail_dir:
+        cleanup_tracked_dir(plan.thumbnail_partial_dir, "stale thumbnail directory")
+        os.makedirs(plan.thumbnail_partial_dir)
+        register_temp_dir(plan.thumbnail_partial_dir)
+
+
+def discard_derived_outputs(plan):
+    if plan.proxy_path:
+        cleanup_tracked_path(plan.proxy_partial, "partial proxy", unregister_partial_output)
+    if plan.thumbnail_dir:
+        cleanup_tracked_dir(plan.thumbnail_partial_dir, "thumbnail directory", unregister_temp_dir)
+
+
+def finalize_derived_outputs(plan):
+    """Move the finished proxy and thumbnails into place, replacing older ones."""
+    try:
+        if plan.proxy_path:
+            os.replace(plan.proxy_partial, plan.proxy_path)
+            unregister_partial_output(plan.proxy_partial)
+        if plan.thumbnail_dir:
+            cleanup_tracked_dir(plan.thumbnail_dir, "previous thumbnail directory")
+            os.replace(plan.thumbnail_partial_dir, plan.thumbnail_dir)
+            unregister_temp_dir(plan.thumbnail_partial_dir)
+    except OSError as exc:
+        discard_derived_outputs(plan)
+        raise VideoConversionError(
+            f"Failed to finalize proxy or thumbnails for '{sanitize_for_log(plan.sequence)}': {exc}"
+        ) from exc
+
+
+class Mp4PatchError(Exception):
+    """Raised when an MP4 file cannot be parsed or patched in place."""
+
+
+class Mp4Box:
+    """Location of one ISO BMFF box inside a buffer."""
+
+    __slots__ = ("kind", "offset", "size", "header_size")
+
+    def __init__(self, kind, offset, size, header_size):
+        self.kind = kind
+        self.offset = offset
+        self.size = size
+        self.header_size = header_size
+
+    @property
+    def payload_offset(self):
+        return self.offset + self.header_size
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+
+def iter_mp4_boxes(buffer, start=0, end=None):
+    """Yield the boxes laid out back to back in ``buffer[start:end]``."""
+    end = len(buffer) if end is None else end
+    offset = start
+    while offset < end:
+        if end - offset < 8:
+            raise Mp4PatchError(f"Truncated box header at offset {offset}")
+        size, kind = struct.unpack_from(">I4s", buffer, offset)
+        header_size = 8
+        if size == 1:
+            if end - offset < 16:
+                raise Mp4PatchError(f"Truncated box header at offset {offset}")
+            size = struct.unpack_from(">Q", buffer, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise Mp4PatchError(f"Invalid size {size} for box {kind!r} at offset {offset}")
+        yield Mp4Box(kind, offset, size, header_size)
+        offset += size
+
+
+def find_mp4_box(buffer, kind, parent=None):
+    """Return the first ``kind`` box at the top level of ``buffer`` or inside ``parent``."""
+    if parent is None:
+        boxes = iter_mp4_boxes(buffer)
+    else:
+        boxes = iter_mp4_boxes(buffer, parent.payload_offset, parent.end)
+    for box in boxes:
+        if box.kind == kind:
+            return box
+    return None
+
+
+def mp4_box_bytes(kind, payload):
+    """Serialize a box, switching to a 64-bit size only when it is needed."""
+    if len(payload) + 8 <= MP4_MAX_BOX32:
+        return struct.pack(">I4s", len(payload) + 8, kind) + payload
+    return struct.pack(">I4sQ", 1, kind, len(payload) + 16) + payload
+
+
+def read_mp4_times(buffer, box):
+    """Return the (creation, modification) times of an mvhd, tkhd or mdhd box."""
+    layout = ">QQ" if buffer[box.payload_offset] == 1 else ">II"
+    if box.payload_offset + 4 + struct.calcsize(layout) > box.end:
+        raise Mp4PatchError(f"Truncated {box.kind.decode('latin-1')} box")
+    return struct.unpack_from(layout, buffer, box.payload_offset + 4)
+
+
+def write_mp4_times(buffer, box, times):
+    """Store ``times`` in an mvhd, tkhd or mdhd box using the box's own field width."""
+    version = buffer[box.payload_offset]
+    layout = ">QQ" if version == 1 else ">II"
+    if box.payload_offset + 4 + struct.calcsize(layout) > box.end:
+        raise Mp4PatchError(f"Truncated {box.kind.decode('latin-1')} box")
+    if version != 1 and max(times) > MP4_MAX_BOX32:
+        raise Mp4PatchError(f"Time does not fit the 32-bit {box.kind.decode('latin-1')} box")
+    struct.pack_into(layout, buffer, box.payload_offset + 4, *times)
+
+
+def mp4_track_boxes(buffer, trak):
+    """Return the handler type and the tkhd and mdhd boxes of a trak box."""
+    tkhd = find_mp4_box(buffer, b"tkhd", trak)
+    mdia = find_mp4_box(buffer, b"mdia", trak)
+    mdhd = hdlr = None
+    if mdia is not None:
+        mdhd = find_mp4_box(buffer, b"mdhd", mdia)
+        hdlr = find_mp4_box(buffer, b"hdlr", mdia)
+    handler = None
+    if hdlr is not None and hdlr.payload_offset + 12 <= hdlr.end:
+        handler = bytes(buffer[hdlr.payload_offset + 8 : hdlr.payload_offset + 12])
+    return handler, tkhd, mdhd
+
+
+def read_mp4_metadata(buffer):
+    """Return the udta box and the movie and per-handler track times of an MP4 file."""
+    moov = find_mp4_box(buffer, b"moov")
+    if moov is None:
+        raise Mp4PatchError("No moov box found")
+    mvhd = find_mp4_box(buffer, b"mvhd", moov)
+    if mvhd is None:
+        raise Mp4PatchError("No mvhd box found")
+    udta = find_mp4_box(buffer, b"udta", moov)
+    tracks = {}
+    for box in iter_mp4_boxes(buffer, moov.payload_offset, moov.end):
+        if box.kind != b"trak":
+            continue
+        handler, tkhd, mdhd = mp4_track_boxes(buffer, box)
+        times = (
+            read_mp4_times(buffer, tkhd) if tkhd is not None else None,
+            read_mp4_times(buffer, mdhd) if mdhd is not None else None,
+        )
+        tracks.setdefault(None, times)
+        tracks.setdefault(handler, times)
+    return {
+        "udta": bytes(buffer[udta.offset : udta.end]) if udta is not None else None,
+        "movie": read_mp4_times(buffer, mvhd),
+        "tracks": tracks,
+    }
+
+
+def build_patched_moov(buffer, moov, metadata, copy_udta):
+    """Return a copy of ``moov`` carrying the source times and, optionally, its udta box."""
+    parts = []
+    for child in iter_mp4_boxes(buffer, moov.payload_offset, moov.end):
+        if copy_udta and child.kind == b"udta":
+            continue
+        parts.append(buffer[child.offset : child.end])
+    if copy_udta:
+        if metadata["udta"] is None:
+            raise Mp4PatchError("Source has no udta box to copy")
+        parts.append(metadata["udta"])
+    payload = bytearray(b"".join(parts))
+
+    for box in iter_mp4_boxes(payload):
+        if box.kind == b"mvhd":
+            write_mp4_times(payload, box, metadata["movie"])
+        elif box.kind == b"trak":
+            handler, tkhd, mdhd = mp4_track_boxes(payload, box)
+            # Match tracks by handler (vide, soun, meta, ...) so dropped source
+            # tracks such as timecode do not shift the mapping.
+            source_times = metadata["tracks"].get(handler, metadata["tracks"].get(None))
+            if source_times is None:
+                continue
+            for target, times in zip((tkhd, mdhd), source_times, strict=True):
+                if target is not None and times is not None:
+                    write_mp4_times(payload, target, times)
+    return mp4_box_bytes(b"moov", bytes(payload))
+
+
+def map_mp4_file(mp4_file):
+    try:
+        return mmap.mmap(mp4_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError as exc:
+        raise Mp4PatchError(f"Cannot map '{mp4_file.name}': {exc}") from exc
+
+
+def patch_mp4_metadata(source, destination, copy_udta=True):
+    """Copy header dates (and the GoPro udta box) from ``source`` into ``destination`` in place.
+
+    Only the moov box of ``destination`` is rewritten, so mdat is never read or
+    moved. The new moov replaces the old one when it fits (absorbing a following
+    free box), or is appended while the old one becomes free space. Returns the
+    strategy used; nothing is written when Mp4PatchError is raised.
+    """
+    with open(source, "rb") as source_file, map_mp4_file(source_file) as buffer:
+        metadata = read_mp4_metadata(buffer)
+
+    with open(destination, "r+b") as output:
+        with map_mp4_file(output) as buffer:
+            file_size = len(buffer)
+            boxes = list(iter_mp4_boxes(buffer))
+            moov_index = next(
+                (index for index, box in enumerate(boxes) if box.kind == b"moov"), None
+            )
+            if moov_index is None:
+                raise Mp4PatchError("No moov box found")
+            moov = boxes[moov_index]
+            following = boxes[moov_index + 1] if moov_index + 1 < len(boxes) else None
+            moov_bytes = build_patched_moov(buffer, moov, metadata, copy_udta)
+
+        fd = output.fileno()
+        if moov.end == file_size:
+            # ffmpeg's default layout ends with moov, so it can simply grow or shrink.
+            os.pwrite(fd, moov_bytes, moov.offset)
+            os.ftruncate(fd, moov.offset + len(moov_bytes))
+            return "rewritten"
+
+        available = moov.size
+        if following is not None and following.kind in MP4_FREE_BOXES:
+            available = following.end - moov.offset
+        slack = available - len(moov_bytes)
+        if slack == 0 or slack >= 8:
+            padding = mp4_box_bytes(b"free", bytes(slack - 8)) if slack else b""
+            os.pwrite(fd, moov_bytes + padding, moov.offset)
+            return "padded"
+
+        # Appending keeps every chunk offset into mdat valid; the old moov is
+        # retyped only after the new one is written.
+        os.pwrite(fd, moov_bytes, file_size)
+        os.pwrite(fd, b"free", moov.offset + 4)
+        return "relocated"
+
+
+def metadata_commands(plan):
+    """Return the (argv, context) pairs that copy telemetry and timestamps to the output."""
+    sanitized_sequence = sanitize_for_log(plan.sequence)
+    commands = []
+    if plan.has_telemetry:
+        commands.append(
+            (
+                ["udtacopy", plan.source, plan.partial_destination],
+                f"copying telemetry for '{sanitized_sequence}'",
+            )
+        )
+    commands.append(
+        (
+            [
+                "exiftool",
+                "-TagsFromFile",
+                plan.source,
+                "-CreateDate",
+                "-MediaCreateDate",
+                "-MediaModifyDate",
+                "-ModifyDate",
+                plan.partial_destination,
+            ],
+            f"copying metadata for '{sanitized_sequence}'",
+        )
+    )
+    return commands
+
+
+def copy_output_metadata(plan):
+    """Patch source metadata into the partial output, falling back to udtacopy/exiftool."""
+    try:
+        strategy = patch_mp4_metadata(
+            plan.source, plan.partial_destination, copy_udta=plan.has_telemetry
+        )
+    except Mp4PatchError as exc:
+        logger.warning(
+            "In-place metadata copy failed for '%s' (%s); using external tools",
+            sanitize_for_log(plan.sequence),
+            sanitize_for_log(exc),
+        )
+    else:
+        logger.debug(
+            "Patched metadata for '%s' in place (%s moov)",
+            sanitize_for_log(plan.sequence),
+            strategy,
+        )
+        return
+
+    for argv, context in metadata_commands(plan):
+        if argv[0] == "exiftool":
+            run_exiftool(argv[1:], context)
+        else:
+            run_command(argv, context)
+
+
+def describe_sequence_plan(plan, concat_path=CONCAT_LIST_PLACEHOLDER):
+    """Return every command the plan would run, in order, as argv lists."""
+    commands = [complexity_command(source) for source in plan.complexity_sources]
+    if plan.convert and plan.segments:
+        commands += [
+            segment_encode_command(
+                concat_path,
+                start,
+                length,
+                plan.encoder_args(),
+                f"{plan.segment_path(index)}{PARTIAL_OUTPUT_SUFFIX}",
+            )
+            for index, (start, length) in enumerate(plan.segments)
+        ]
+        commands.append(
+            chunk_stitch_command(
+                os.path.join(plan.segment_dir, "encoded.txt"),
+                concat_path,
+                plan.has_telemetry,
+                plan.partial_destination,
+            )
+        )
+    elif plan.convert and plan.chunk_boundaries:
+        work_dir = f"{plan.partial_destination}{CHUNK_DIR_SUFFIX}"
+        commands.append(chunk_split_command(concat_path, plan.chunk_boundaries, work_dir))
+        for index in range(len(plan.chunk_boundaries) + 1):
+            commands.append(
+                chunk_encode_command(
+                    os.path.join(work_dir, f"source_{index:04d}.mp4"),
+                    plan.encoder_args(),
+                    os.path.join(work_dir, f"encoded_{index:04d}.mp4"),
+                )
+            )
+        commands.append(
+            chunk_stitch_command(
+                os.path.join(work_dir, "encoded.txt"),
+                concat_path,
+                plan.has_telemetry,
+                plan.partial_destination,
+            )
+        )
+    else:
+        commands.append(encode_command(plan, concat_path))
+    # Split encodes write the proxy and thumbnails in one more pass, as encode_sequence_plan does.
+    if plan.convert and (plan.segments or plan.chunk_boundaries) and plan.has_derived_outputs:
+        commands.append(derived_outputs_command(plan, concat_path))
+    commands.extend(argv for argv, _ in metadata_commands(plan))
+    return [command_argv(command) for command in commands]
+
+
+def print_sequence_plan(plan, preset_tuner=None):
+    """Print the commands for ``plan`` without running them (``--plan`` mode)."""
+    action = "convert" if plan.convert else "concatenate"
+    print(
+        f"# Sequence {sanitize_for_log(plan.sequence)}: {action}"
+        f" {len(plan.chapter_paths)} chapter(s) -> {sanitize_for_log(plan.destination)}"
+    )
+    if plan.convert:
+        preset_note = " (chosen by --auto-preset at run time)" if preset_tuner else ""
+        print(f"# bitrate {plan.bitrate} bps, preset {plan.preset}{preset_note}")
+        if plan.complexity_sources:
+            print("# the bitrate is scaled at run time by the SI/TI the next commands measure")
+    for chapter_path in plan.chapter_paths:
+        print(f"# {CONCAT_LIST_PLACEHOLDER}: file '{escape_concat_path(chapter_path)}'")
+    commands = describe_sequence_plan(plan)
+    fallback_count = len(metadata_commands(plan))
+    for argv in commands[:-fallback_count]:
+        print(shlex.join(argv))
+    print("# copy metadata into the moov box in place; only if that fails:")
+    for argv in commands[-fallback_count:]:
+        print(shlex.join(argv))
+    print(f"# then rename {shlex.quote(plan.partial_destination)} to the final output")
+
+
+def write_concat_file(chapter_paths):
+    """Write an ffmpeg concat demuxer list for ``chapter_paths`` and track it as temporary."""
+    with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".txt") as concat_file:
+        concat_path = concat_file.name
+        register_temp_file(concat_path)
+        try:
+            # Follow ffmpeg concat demuxer file list format (file '/absolute/path').
+            for chapter_path in chapter_paths:
+                escaped_path = escape_concat_path(os.path.abspath(chapter_path))
+                concat_file.write(f"file '{escaped_path}'\n")
+        except OSError:
+            cleanup_tracked_path(concat_path, "temporary concat file", unregister_temp_file)
+            raise
+    return concat_path
+
+
+@contextlib.contextmanager
+def staged_encode(plan):
+    """Set up the partial outputs, concat list and read-ahead for one encode of ``plan``.
+
+    Yields ``(concat_path, read_ahead)``; the caller starts the read-ahead. Unless the
+    block completes, the partial output and the proxy/thumbnail outputs are removed.
+    """
+
+    sanitized_sequence = sanitize_for_log(plan.sequence)
+    partial_destination = plan.partial_destination
+    encode_successful = False
+    concat_path = None
+    read_ahead = None
+    # Attempt to clean up stale partial output; log a warning on failure.
+    cleanup_tracked_path(partial_destination, "stale partial output", raise_on_error=False)
+    register_partial_output(partial_destination)
+    try:
+        logger.info("Sequence: %s", sanitized_sequence)
+        concat_path = write_concat_file(plan.chapter_paths)
+        prepare_derived_outputs(plan)
+        read_ahead = ChapterReadAhead(
+            plan.chapter_paths, [getattr(probe, "duration", None) for probe in plan.probes]
+        )
+        yield concat_path, read_ahead
+        encode_successful = True
+    finally:
+        if read_ahead is not None:
+            read_ahead.close()
+        if concat_path:
+            cleanup_tracked_path(concat_path, "temporary concat file", unregister_temp_file)
+        if not encode_successful:
+            cleanup_tracked_path(partial_destination, "partial output", unregister_partial_output)
+            discard_derived_outputs(plan)
+
+
+def encode_sequence_plan(plan, preset_tuner=None):
+    """Write the encoded (or concatenated) partial output for ``plan``."""
+
+    with staged_encode(plan) as (concat_path, read_ahead):
+        if plan.convert and preset_tuner is not None:
+            plan.preset = preset_tuner.choose(
+                concat_path,
+                plan.probes[0],
+                plan.duration,
+                plan.options,
+                plan.bitrate,
+                plan.context,
+                plan.video_filter,
+            )
+
+        read_ahead.start()
+        if plan.convert and (plan.segments or plan.chunk_boundaries):
+            if plan.segments:
+                encode_sequence_segmented(plan, concat_path, read_ahead)
+            else:
+                encode_sequence_chunked(plan, concat_path)
+            # Split encodes never decode the whole sequence in one process.
+            if plan.has_derived_outputs:
+                run_command(
+                    derived_outputs_command(plan, concat_path),
+                    f"writing proxy and thumbnails for {plan.context}",
+                )
+        else:
+            run_command(
+                encode_command(plan, concat_path),
+                plan.context,
+                progress=ProgressMonitor(plan.sequence, plan.duration, listener=read_ahead.advance),
+            )
+
+
+def finish_sequence_plan(plan):
+    """Copy metadata into the encoded partial output and atomically move it into place."""
+
+    conversion_successful = False
+    try:
+        copy_output_metadata(plan)
+        finalize_output(plan)
+        conversion_successful = True
+    finally:
+        # Skip partial cleanup when the output is finalized.
+        if not conversion_successful:
+            cleanup_tracked_path(
+                plan.partial_destination, "partial output", unregister_partial_output
+            )
+            discard_derived_outputs(plan)
+    finalize_derived_outputs(plan)
+    if plan.segments:
+        cleanup_tracked_dir(plan.segment_dir, "segment directory")
+
+
+def execute_sequence_plan(plan, preset_tuner=None):
+    """Run the commands for ``plan`` and atomically move the finished output into place."""
+    encode_sequence_plan(plan, preset_tuner)
+    finish_sequence_plan(plan)
+
+
+def copy_file_across_filesystems(source, destination):
+    """Copy ``source`` to ``destination`` inside the kernel and verify the copied size.
+
+    ``copy_file_range`` is tried first; ``sendfile`` takes over where it is not
+    supported between the two filesystems. The copy is flushed to disk before
+    returning.
+    """
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        source_fd = source_file.fileno()
+        destination_fd = destination_file.fileno()
+        total = os.fstat(source_fd).st_size
+        copied = 0
+        use_copy_file_range = hasattr(os, "copy_file_range")
+        while copied < total:
+            count = min(COPY_CHUNK_SIZE, total - copied)
+            if use_copy_file_range:
+                try:
+                    sent = os.copy_file_range(source_fd, destination_fd, count, copied, copied)
+                except OSError as exc:
+                    if exc.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                        raise
+                    use_copy_file_range = False
+                    continue
+            else:
+                os.lseek(destination_fd, copied, os.SEEK_SET)
+                sent = os.sendfile(destination_fd, source_fd, copied, count)
+            if sent == 0:
+                break
+            copied += sent
+        os.fsync(destination_fd)
+        copied_size = os.fstat(destination_fd).st_size
+    if copied_size != total:
+        raise VideoConversionError(
+            f"Copy of '{source}' to '{destination}' is {copied_size} bytes, expected {total}"
+        )
+
+
+def move_output(partial_path, destination):
+    """Move a finished partial output into place, copying it across filesystems if needed.
+
+    Across filesystems the file is copied to a tracked ``.partial`` next to the
+    destination, renamed into place once its size matches, and only then is the
+    scratch copy deleted, so an interruption never leaves a truncated output.
+    """
+    try:
+        # Atomic when source/destination are on the same filesystem.
+        os.replace(partial_path, destination)
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+    else:
+        unregister_partial_output(partial_path)
+        return
+
+    staged_path = f"{destination}{PARTIAL_OUTPUT_SUFFIX}"
+    register_partial_output(staged_path)
+    try:
+        copy_file_across_filesystems(partial_path, staged_path)
+        os.replace(staged_path, destination)
+    finally:
+        # Removes the staged copy after a failure; it is already gone after the rename.
+        cleanup_tracked_path(staged_path, "staged output", unregister_partial_output)
+    cleanup_tracked_path(partial_path, "scratch output", unregister_partial_output)
+
+
+def finalize_output(plan):
+    """Replace the final output with the finished partial file and copy source metadata."""
+    sanitized_sequence = sanitize_for_log(plan.sequence)
+    try:
+        move_output(plan.partial_destination, plan.destination)
+    except OSError as exc:
+        raise VideoConversionError(
+            f"Failed to finalize output file for '{sanitized_sequence}': {exc}"
+        ) from exc
+
+    try:
+        shutil.copystat(plan.source, plan.destination)
+    except OSError as exc:
+        logger.warning(
+            "Failed to copy file metadata from '%s' to '%s': %s",
+            sanitize_for_log(plan.source),
+            sanitize_for_log(plan.destination),
+            sanitize_for_log(exc),
+        )
+
+
+def sequence_options_hash(
+    options,
+    bitratemodifier,
+    mbits_max,
+    ratio_max,
+    convert,
+    codec=None,
+    auto_copy=True,
+    preset=DEFAULT_PRESET,
+    preset_tuner=None,
+    max_height=None,
+    max_fps=None,
+    complexity=False,
+    **_unhashed,
+):
+    """Hash the settings that shape a sequence's output, from prepare_sequence's arguments.
 
-        try:
-            bit_rate = int(stream.bit_rate)
-        except (TypeError, ValueError) as exc:
-            raise VideoConversionError(
-                f"Invalid bit_rate in '{source}': {stream.bit_rate}"
-            ) from exc
+    Arguments that only affect how or where the output is produced are ignored.
+    """
+    # New settings are only hashed when used, so ledger entries from older runs stay current.
+    caps = [max_height, max_fps] if max_height or max_fps else []
+    if complexity:
+        caps.append("complexity")
+    return job_options_hash(
+        without_thread_caps(options),
+        bitratemodifier,
+        mbits_max,
+        ratio_max,
+        convert,
+        codec,
+        auto_copy,
+        preset,
+        preset_tuner and (preset_tuner.metric, preset_tuner.floor),
+        *caps,
+    )
 
-        if coded_height == HEIGHT_1080P:
-            bitrate = BITRATE_1080P
-        elif coded_height == HEIGHT_1520P:
-            bitrate = BITRATE_1520P
-        elif coded_height == HEIGHT_2160P:
-            bitrate = BITRATE_2160P
-        else:
-            bitrate = int(round(coded_height * coded_width * framerate * bitratemodifier))
 
-        bitrate_limit = int(round(bit_rate * ratio_max))
+def prepare_sequence(
+    path,
+    sequence,
+    options,
+    bitratemodifier,
+    mbits_max,
+    ratio_max,
+    convert,
+    resume=False,
+    codec=None,
+    auto_copy=True,
+    chunks=1,
+    preset=DEFAULT_PRESET,
+    preset_tuner=None,
+    dry_run=False,
+    segment_duration=None,
+    output_dir=None,
+    scratch_dir=None,
+    max_height=None,
+    max_fps=None,
+    complexity=False,
+    proxy=False,
+    thumbnail_interval=None,
+):
+    """Plan ``sequence`` from convert_sequence's arguments; returns None when it is skipped."""
+    options_hash = sequence_options_hash(
+        options,
+        bitratemodifier,
+        mbits_max,
+        ratio_max,
+        convert,
+        codec=codec,
+        auto_copy=auto_copy,
+        preset=preset,
+        preset_tuner=preset_tuner,
+        max_height=max_height,
+        max_fps=max_fps,
+        complexity=complexity,
+    )
+    return plan_sequence(
+        path,
+        sequence,
+        options,
+        bitratemodifier,
+        mbits_max,
+        ratio_max,
+        convert,
+        resume=resume,
+        codec=codec,
+        auto_copy=auto_copy,
+        chunks=chunks,
+        preset=preset,
+        include_loose=dry_run,
+        dry_run=dry_run,
+        options_hash=options_hash,
+        segment_duration=segment_duration,
+        output_dir=output_dir,
+        scratch_dir=scratch_dir,
+        max_height=max_height,
+        max_fps=max_fps,
+        complexity=complexity,
+        proxy=proxy,
+        thumbnail_interval=thumbnail_interval,
+    )
 
-        if bitrate > bitrate_limit:
-            bitrate = bitrate_limit
 
-        if bitrate > mbits_max * 1024 * 1024:
-            bitrate = mbits_max * 1024 * 1024
+def sequence_step_error(path, sequence, exc):
+    return VideoConversionError(f"Error processing sequence '{sequence}' in '{path}': {exc}")
 
-        result = bitrate
-        return result
+
+def run_sequence_step(path, sequence, step, *args, **kwargs):
+    """Call ``step``, reporting unexpected errors as a VideoConversionError."""
+    try:
+        return step(*args, **kwargs)
     except VideoConversionError:
         raise
-    except (
-        OSError,
-        ValueError,
-        TypeError,
-        IndexError,
-        AttributeError,
-        subprocess.SubprocessError,
-    ) as exc:
-        raise VideoConversionError(f"Failed to calculate bitrate for '{source}': {exc}") from exc
+    except SEQUENCE_STEP_ERRORS as exc:
+        raise sequence_step_error(path, sequence, exc) from exc
 
 
-def videostofolders(contents, path):
+def record_sequence_start(plan):
+    ledger = _JOB_LEDGER
+    if ledger is not None:
+        ledger.start(plan.sequence, sequence_inputs(plan.chapter_paths), plan.options_hash)
 
-    # Checking if there is anything to move
-    if any(word.lower().endswith(".mp4") for word in contents):
-        logger.info("There is something to sort")
-    else:
-        logger.info("There is nothing to sort")
-        return []
 
-    files = []
-    # Selecting only files to be moved
-    for content in contents:
-        if content.lower().endswith(".mp4"):
-            files.append(content)
-
-    file_sequences = {file: get_file_sequence(file) for file in files}
-
-    # Getting all unique sequences
-    listOfSequences = []
-    for file in files:
-        file_sequence = file_sequences[file]
-        if file_sequence not in listOfSequences:
-            listOfSequences.append(file_sequence)
-
-    try:
-        # Creating folders for each sequence
-        for sequence in listOfSequences:
-            os.makedirs(os.path.join(path, sequence), exist_ok=True)
-
-        # Moving files to their respective folders
-        for sequence in listOfSequences:
-            for file in files:
-                file_sequence = file_sequences[file]
-
-                if file_sequence == sequence:
-                    src_path = os.path.join(path, file)
-                    dst_path = os.path.join(path, sequence, file)
-                    if os.path.exists(dst_path):
-                        logger.warning(
-                            "Skipping moving '%s' to '%s' because destination already exists",
-                            src_path,
-                            dst_path,
-                        )
-                        continue
-                    os.rename(src_path, dst_path)
-    except OSError as exc:
-        raise VideoConversionError(f"Failed to organize videos in '{path}': {exc}") from exc
+def enqueue_sequences(sequences, recover=False):
+    """List ``sequences`` as pending in the job ledger, if configured.
+
+    With ``recover``, runs left 'running' by a crashed process are marked failed first.
+    """
+    ledger = _JOB_LEDGER
+    if ledger is None:
+        return
+    if recover:
+        ledger.recover()
+    ledger.enqueue(sequences)
+
+
+def record_plan_failure(sequence, error):
+    """Mark ``sequence`` failed in the job ledger when it could not even be planned."""
+    ledger = _JOB_LEDGER
+    if ledger is not None:
+        ledger.fail(sequence, error)
+
+
+def record_sequence_result(plan, error=None):
+    """Store the outcome of ``plan`` in the job ledger and archive index, if configured."""
+    archive = _ARCHIVE_INDEX
+    if error is None and archive is not None and plan.fingerprints:
+        archive.record(
+            archive_key(plan.fingerprints, plan.options_hash),
+            plan.fingerprints,
+            plan.options_hash,
+            plan.destination,
+        )
+    ledger = _JOB_LEDGER
+    if ledger is None:
+        return
+    if error is not None:
+        ledger.fail(plan.sequence, error if isinstance(error, Exception) else "interrupted")
+        return
+    try:
+        output_size = os.path.getsize(plan.destination)
+    except OSError:
+        output_size = None
+    ledger.finish(plan.sequence, output_size)
+
+
+def convert_sequence(path, sequence, *sequence_args, **sequence_kwargs):
+    """Concatenate (and optionally re-encode) a single sequence folder into its output file.
+
+    Takes the arguments of prepare_sequence. When ``auto_copy`` is enabled and
+    ``codec`` is given, sequences that are already encoded with that codec at or
+    below the target bitrate are stream-copied instead. With ``chunks`` greater than
+    1, long sequences are encoded as parallel chunks, and a ``preset_tuner`` replaces
+    ``preset`` with one picked from sample encodes. A ``segment_duration`` encodes
+    long sequences as resumable segments instead. Outputs go to ``output_dir`` and
+    partial files to ``scratch_dir`` when given. With ``dry_run`` the commands are
+    printed instead of executed.
+    """
 
-    return listOfSequences
+    try:
+        plan = run_sequence_step(
+            path, sequence, prepare_sequence, path, sequence, *sequence_args, **sequence_kwargs
+        )
+    except Exception as exc:
+        # --plan only reads the ledger.
+        if not sequence_kwargs.get("dry_run"):
+            record_plan_failure(sequence, exc)
+        raise
+    if plan is None:
+        return
+    preset_tuner = sequence_kwargs.get("preset_tuner")
+    if sequence_kwargs.get("dry_run"):
+        print_sequence_plan(plan, preset_tuner)
+        return
+    record_sequence_start(plan)
+    try:
+        run_sequence_step(path, sequence, execute_sequence_plan, plan, preset_tuner)
+    except BaseException as exc:
+        record_sequence_result(plan, exc)
+        raise
+    record_sequence_result(plan)
 
 
 def convertVideos(
@@ -390,8 +4081,25 @@ def convertVideos(
     convert,
     resume=False,
     sequences=None,
+    jobs=1,
+    codec=None,
+    auto_copy=True,
+    chunks=1,
+    preset=DEFAULT_PRESET,
+    preset_tuner=None,
+    dry_run=False,
+    segment_duration=None,
+    output_dir=None,
+    scratch_dir=None,
+    max_height=None,
+    max_fps=None,
+    complexity=False,
+    proxy=False,
+    thumbnail_interval=None,
 ):
 
+    validate_conversion_settings(jobs, chunks, segment_duration)
+
     # Use provided sequences list or fall back to directory listing
     try:
         if sequences is not None:
@@ -404,239 +4112,919 @@ def convertVideos(
 
     sanitized_sequences = [sanitize_for_log(sequence) for sequence in _listOfSequences]
     logger.info("List: %s", ", ".join(sanitized_sequences))
-    for sequence, sanitized_sequence in zip(_listOfSequences, sanitized_sequences, strict=True):
+
+    if not dry_run:
+        enqueue_sequences(_listOfSequences, recover=True)
+
+    sequence_args = (options, bitratemodifier, mbits_max, ratio_max, convert)
+    sequence_kwargs = {
+        "resume": resume,
+        "codec": codec,
+        "auto_copy": auto_copy,
+        "chunks": chunks,
+        "preset": preset,
+        "preset_tuner": preset_tuner,
+        "dry_run": dry_run,
+        "segment_duration": segment_duration,
+        "output_dir": output_dir,
+        "scratch_dir": scratch_dir,
+        "max_height": max_height,
+        "max_fps": max_fps,
+        "complexity": complexity,
+        "proxy": proxy,
+        "thumbnail_interval": thumbnail_interval,
+    }
+    # Plans are printed in order, so --plan never uses the pipeline.
+    if dry_run:
+        for sequence in _listOfSequences:
+            convert_sequence(path, sequence, *sequence_args, **sequence_kwargs)
+        return
+
+    SequencePipeline(path, sequence_args, sequence_kwargs, jobs).run(_listOfSequences)
+
+
+def validate_conversion_settings(jobs=1, chunks=1, segment_duration=None):
+    if jobs < 1:
+        raise VideoConversionError(f"Number of parallel jobs must be at least 1, got {jobs}")
+    if chunks < 1:
+        raise VideoConversionError(f"Number of chunks must be at least 1, got {chunks}")
+    if segment_duration is not None:
+        if segment_duration <= 0:
+            raise VideoConversionError(f"Segment duration must be positive, got {segment_duration}")
+        if chunks > 1:
+            raise VideoConversionError("Resumable segments cannot be combined with chunks")
+
+
+class SequencePipeline:
+    """Plan, encode and finalize sequences in overlapping stages.
+
+    One thread probes and plans sequences ahead of the encoders, ``jobs`` threads
+    encode, and one thread copies metadata and moves outputs into place, so the
+    encoders never wait for ffprobe or exiftool. The planner runs at most
+    PIPELINE_PLAN_AHEAD sequences ahead of each encoder. After the first failure
+    nothing new is planned or encoded; outputs that are already encoded are still
+    finalized, and the first error is re-raised once every stage has stopped.
+    """
+
+    def __init__(self, path, sequence_args, sequence_kwargs, jobs=1):
+        self.path = path
+        self.sequence_args = sequence_args
+        self.sequence_kwargs = sequence_kwargs
+        self.jobs = jobs
+        self.stage_times = Counter()
+        self.first_error = None
+        self._planned = Queue(maxsize=jobs * PIPELINE_PLAN_AHEAD)
+        self._encoded = Queue()
+        self._lock = RLock()
+
+    def _fail(self, sequence, exc):
+        with self._lock:
+            if self.first_error is None:
+                self.first_error = exc
+                return
+        logger.error(
+            "Sequence %s also failed: %s", sanitize_for_log(sequence), sanitize_for_log(exc)
+        )
+
+    def _timed(self, stage, sequence, step, *args, **kwargs):
+        started = time.monotonic()
         try:
-            partial_destination = None
-            conversion_successful = False
-            files = os.listdir(os.path.join(path, sequence))
-            files.sort()
-            if not files:
-                raise VideoConversionError(f"No video files found in sequence '{sequence}'")
-            source = os.path.join(path, sequence, files[0])
-            destination = os.path.join(path, files[0])
-            if resume and os.path.exists(destination):
-                logger.info(
-                    "Skipping sequence %s because output already exists (resume enabled).",
-                    sanitized_sequence,
+            return run_sequence_step(self.path, sequence, step, *args, **kwargs)
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.stage_times[stage] += elapsed
+            logger.info(
+                "Stage %s for sequence %s took %s.",
+                stage,
+                sanitize_for_log(sequence),
+                format_duration(elapsed),
+            )
+
+    def _plan_stage(self, sequences):
+        try:
+            for sequence in sequences:
+                if self.first_error is not None:
+                    break
+                try:
+                    plan = self._timed(
+                        "plan",
+                        sequence,
+                        prepare_sequence,
+                        self.path,
+                        sequence,
+                        *self.sequence_args,
+                        **self.sequence_kwargs,
+                    )
+                except Exception as exc:
+                    record_plan_failure(sequence, exc)
+                    self._fail(sequence, exc)
+                    continue
+                if plan is not None:
+                    self._planned.put(plan)
+        finally:
+            for _ in range(self.jobs):
+                self._planned.put(None)
+
+    def _encode_stage(self):
+        preset_tuner = self.sequence_kwargs.get("preset_tuner")
+        while True:
+            waited = time.monotonic()
+            plan = self._planned.get()
+            with self._lock:
+                self.stage_times["encoder idle"] += time.monotonic() - waited
+            if plan is None:
+                return
+            if self.first_error is not None:
+                continue
+            try:
+                record_sequence_start(plan)
+                self._timed("encode", plan.sequence, encode_sequence_plan, plan, preset_tuner)
+            except Exception as exc:
+                record_sequence_result(plan, exc)
+                self._fail(plan.sequence, exc)
+                continue
+            self._encoded.put(plan)
+
+    def _finalize_stage(self):
+        while (plan := self._encoded.get()) is not None:
+            try:
+                self._timed("finalize", plan.sequence, finish_sequence_plan, plan)
+            except Exception as exc:
+                record_sequence_result(plan, exc)
+                self._fail(plan.sequence, exc)
+                continue
+            record_sequence_result(plan)
+
+    def run(self, sequences):
+        if self.jobs > 1:
+            logger.info("Converting up to %d sequences in parallel.", self.jobs)
+        planner = Thread(target=self._plan_stage, args=(sequences,), name="plan", daemon=True)
+        encoders = [
+            Thread(target=self._encode_stage, name=f"encode-{index}", daemon=True)
+            for index in range(self.jobs)
+        ]
+        finalizer = Thread(target=self._finalize_stage, name="finalize", daemon=True)
+        for thread in (planner, *encoders, finalizer):
+            thread.start()
+        planner.join()
+        for encoder in encoders:
+            encoder.join()
+        self._encoded.put(None)
+        finalizer.join()
+
+        logger.info(
+            "Stage totals: plan %s, encode %s, finalize %s; encoders idle %s.",
+            *(
+                format_duration(self.stage_times[stage])
+                for stage in ("plan", "encode", "finalize", "encoder idle")
+            ),
+        )
+        if self.first_error is not None:
+            raise self.first_error
+
+
+class SequenceLease:
+    """A claim on one sequence, held as a lease file next to its folder.
+
+    The file is created with O_EXCL, so only one process on any node can hold it. The
+    holder rewrites its heartbeat every ``ttl / 4`` seconds; a lease whose heartbeat is
+    older than ``ttl`` belongs to a dead node and is reclaimed by renaming it away.
+    Nodes sharing a folder need synchronized clocks.
+    """
+
+    def __init__(self, path, sequence, ttl=LEASE_TTL):
+        self.path = os.path.join(path, f".{sequence}{LEASE_SUFFIX}")
+        self.sequence = sequence
+        self.ttl = ttl
+        self.token = os.urandom(8).hex()
+        self.lost = False
+        self._stop = Event()
+        self._thread = None
+
+    def record(self):
+        return {
+            "host": os.uname().nodename,
+            "pid": os.getpid(),
+            "token": self.token,
+            "heartbeat": time.time(),
+        }
+
+    @staticmethod
+    def load(lease_path):
+        """Return (token, heartbeat, record) of a lease file, or None when it is gone.
+
+        A lease that is still being written has no record yet; its mtime stands in
+        for the heartbeat.
+        """
+        try:
+            with open(lease_path) as lease_file:
+                mtime = os.fstat(lease_file.fileno()).st_mtime
+                record = json.load(lease_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            try:
+                return (None, os.stat(lease_path).st_mtime, {})
+            except OSError:
+                return None
+        if not isinstance(record, dict):
+            return (None, mtime, {})
+        return (record.get("token"), record.get("heartbeat") or mtime, record)
+
+    def acquire(self):
+        """Take the lease; returns False while another live process holds it."""
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                if not self._reclaim_expired():
+                    return False
+                continue
+            with os.fdopen(fd, "w") as lease_file:
+                json.dump(self.record(), lease_file)
+            return True
+        return False
+
+    def _reclaim_expired(self):
+        current = self.load(self.path)
+        if current is None:
+            return True
+        token, heartbeat, record = current
+        silent = time.time() - heartbeat
+        if silent < self.ttl:
+            return False
+        # Renaming is atomic, so only one node moves the expired lease away.
+        stale_path = f"{self.path}.{self.token}.stale"
+        try:
+            os.rename(self.path, stale_path)
+        except FileNotFoundError:
+            return True
+        moved = self.load(stale_path)
+        try:
+            if moved is None or moved[:2] != (token, heartbeat):
+                # The lease was renewed or replaced in the meantime; hand it back.
+                with contextlib.suppress(FileExistsError, FileNotFoundError):
+                    os.link(stale_path, self.path)
+                return False
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(stale_path)
+        logger.warning(
+            "Reclaiming lease on sequence %s from %s (pid %s), silent for %.0f s.",
+            sanitize_for_log(self.sequence),
+            sanitize_for_log(record.get("host")),
+            sanitize_for_log(record.get("pid")),
+            silent,
+        )
+        return True
+
+    def renew(self):
+        """Refresh the heartbeat; returns False once another process owns the lease."""
+        current = self.load(self.path)
+        if current is None or current[0] != self.token:
+            self.lost = True
+            return False
+        temp_path = f"{self.path}.{self.token}.tmp"
+        with open(temp_path, "w") as lease_file:
+            json.dump(self.record(), lease_file)
+        os.replace(temp_path, self.path)
+        return True
+
+    def start_heartbeat(self):
+        self._thread = Thread(target=self._heartbeat, name=f"lease-{self.sequence}", daemon=True)
+        self._thread.start()
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.ttl / 4):
+            try:
+                renewed = self.renew()
+            except OSError as exc:
+                logger.warning(
+                    "Failed to renew lease on sequence %s: %s",
+                    sanitize_for_log(self.sequence),
+                    sanitize_for_log(exc),
                 )
                 continue
-            partial_destination = f"{destination}{PARTIAL_OUTPUT_SUFFIX}"
-            # Attempt to clean up stale partial output; log a warning on failure.
-            cleanup_tracked_path(partial_destination, "stale partial output", raise_on_error=False)
-            register_partial_output(partial_destination)
-            file = probeVideo(source)
-            if len(file.streams) < 2:
-                stream_count = len(file.streams)
-                raise VideoConversionError(
-                    f"Expected at least 2 streams in '{source}' but found {stream_count} stream(s)"
+            if not renewed:
+                logger.error(
+                    "Lost the lease on sequence %s to another node; it may be converted twice.",
+                    sanitize_for_log(self.sequence),
                 )
-            bitrate = calculateBitrate(source, bitratemodifier, mbits_max, ratio_max, probe=file)
-            logger.info("Sequence: %s", sanitized_sequence)
+                return
 
-            quoted_source = shlex.quote(source)
-            quoted_destination = shlex.quote(partial_destination)
-            sanitized_source = sanitize_for_log(source)
-            sanitized_destination = sanitize_for_log(destination)
+    def release(self):
+        """Stop the heartbeat and remove the lease file if this process still owns it."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        current = self.load(self.path)
+        if current is not None and current[0] == self.token:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.path)
 
-            concat_path = None
-            try:
-                with tempfile.NamedTemporaryFile(
-                    mode="w", delete=False, suffix=".txt"
-                ) as concat_file:
-                    concat_path = concat_file.name
-                    register_temp_file(concat_path)
-                    # Follow ffmpeg concat demuxer file list format (file '/absolute/path').
-                    for filename in files:
-                        file_path = os.path.abspath(os.path.join(path, sequence, filename))
-                        escaped_path = escape_concat_path(file_path)
-                        concat_file.write(f"file '{escaped_path}'\n")
-
-                quoted_concat = shlex.quote(concat_path)
-                concat_cmd = f"ffmpeg -y -f concat -safe 0 -i {quoted_concat} "
-
-                if convert:
-                    maxrate = int(bitrate * MAXRATE_MULTIPLIER)
-                    bufsize = int(bitrate * BUFSIZE_MULTIPLIER)
-                    ffmpeg_cmd = (
-                        f"{concat_cmd}{options} -b:v {bitrate} -maxrate {maxrate} "
-                        f"-bitrate_limit 0 -bufsize {bufsize} -fps_mode passthrough -g 120 "
-                        f"-preset slower -look_ahead 1 -map 0:0 -map 0:1"
-                    )
-                else:
-                    ffmpeg_cmd = f"{concat_cmd}-c copy -map 0:0 -map 0:1"
-
-                if len(file.streams) >= 4:
-                    if file.streams[3].codec_name == "bin_data":
-                        # Processes streams 0-1 and conditionally stream 3
-                        # when telemetry is present.
-                        ffmpeg_cmd = f"{ffmpeg_cmd} -map 0:3 {quoted_destination}"
-                        action = "converting" if convert else "concatenating"
-                        bash_command(
-                            ffmpeg_cmd,
-                            f"{action} sequence '{sanitized_sequence}'",
-                        )
-                        bash_command(
-                            f"udtacopy {quoted_source} {quoted_destination}",
-                            f"copying telemetry for '{sanitized_sequence}'",
-                        )
-                        exiftool_cmd = (
-                            f"exiftool -TagsFromFile {quoted_source}"
-                            f" -CreateDate -MediaCreateDate"
-                            f" -MediaModifyDate -ModifyDate"
-                            f" {quoted_destination}"
-                        )
-                        bash_command(
-                            exiftool_cmd,
-                            f"copying metadata for '{sanitized_sequence}'",
-                        )
-                    else:
-                        codec = file.streams[3].codec_name
-                        raise VideoConversionError(
-                            f"Expected bin_data stream at index 3 in '{source}' but found '{codec}'"
-                        )
-                elif len(file.streams) == 3:
-                    stream_count = len(file.streams)
-                    raise VideoConversionError(
-                        f"Unsupported stream layout in '{source}':"
-                        f" expected 2 streams (video+audio) or at least"
-                        f" 4 streams (video+audio+extra+telemetry),"
-                        f" but found {stream_count} stream(s)"
-                    )
-                else:
-                    ffmpeg_cmd = f"{ffmpeg_cmd} {quoted_destination}"
-                    action = "converting" if convert else "concatenating"
-                    bash_command(
-                        ffmpeg_cmd,
-                        f"{action} sequence '{sanitized_sequence}'",
-                    )
-                    exiftool_cmd = (
-                        f"exiftool -TagsFromFile {quoted_source}"
-                        f" -CreateDate -MediaCreateDate"
-                        f" -MediaModifyDate -ModifyDate"
-                        f" {quoted_destination}"
-                    )
-                    bash_command(
-                        exiftool_cmd,
-                        f"copying metadata for '{sanitized_sequence}'",
-                    )
 
-                try:
-                    # Atomic when source/destination are on the same filesystem;
-                    # ensures completed outputs replace the final file.
-                    os.replace(partial_destination, destination)
-                    unregister_partial_output(partial_destination)
-                    conversion_successful = True
-                except OSError as exc:
-                    raise VideoConversionError(
-                        f"Failed to finalize output file for '{sanitized_sequence}': {exc}"
-                    ) from exc
+def list_sequence_folders(path):
+    """Return the sequence folders in ``path``, skipping hidden and work directories."""
+    try:
+        with os.scandir(path) as entries:
+            return sorted(
+                entry.name
+                for entry in entries
+                if entry.is_dir()
+                and not entry.name.startswith(".")
+                and not entry.name.endswith(WORK_DIR_SUFFIXES)
+                and entry.name not in (PROXY_DIRNAME, THUMBNAIL_DIRNAME)
+            )
+    except OSError as exc:
+        raise VideoConversionError(f"Unable to list sequences in '{path}': {exc}") from exc
 
-                try:
-                    shutil.copystat(source, destination)
-                except OSError as exc:
-                    logger.warning(
-                        "Failed to copy file metadata from '%s' to '%s': %s",
-                        sanitized_source,
-                        sanitized_destination,
-                        sanitize_for_log(exc),
-                    )
+
+class LeaseWorker:
+    """Converts the sequences of a folder shared with other nodes, one lease at a time.
+
+    Each of the ``jobs`` threads leases the next sequence that has no output yet and
+    converts it while the lease's heartbeat runs. A sequence that fails is not tried
+    again by this node. The worker returns once every sequence has an output or has
+    been tried, and keeps rescanning while other nodes still hold leases (a dead
+    node's leases expire and are reclaimed).
+    """
+
+    def __init__(
+        self,
+        path,
+        sequence_args,
+        sequence_kwargs,
+        jobs=1,
+        lease_ttl=LEASE_TTL,
+        poll_interval=WORKER_POLL_INTERVAL,
+        stop=None,
+        link=False,
+    ):
+        self.path = path
+        self.sequence_args = sequence_args
+        self.sequence_kwargs = sequence_kwargs
+        self.jobs = jobs
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.stop = stop or Event()
+        self.link = link
+        self.converted = []
+        self.failed = []
+        self._tried = set()
+        self._lock = RLock()
+
+    def has_output(self, sequence):
+        _, files = list_sequence_chapters(self.path, sequence)
+        if not files:
+            return True
+        output_dir = self.sequence_kwargs.get("output_dir") or self.path
+        return os.path.exists(os.path.join(output_dir, files[0]))
+
+    def claim(self):
+        """Return (sequence, lease), or (None, waiting) when nothing can be leased now."""
+        waiting = False
+        with self._lock:
+            for sequence in list_sequence_folders(self.path):
+                if sequence in self._tried or self.has_output(sequence):
+                    continue
+                lease = SequenceLease(self.path, sequence, self.lease_ttl)
+                if not lease.acquire():
+                    waiting = True
+                    continue
+                # Another node may have finished it between the scan and the claim.
+                if self.has_output(sequence):
+                    lease.release()
+                    continue
+                self._tried.add(sequence)
+                return sequence, lease
+        return None, waiting
+
+    def _drain(self):
+        while not self.stop.is_set() and not _SIGNAL_HANDLED:
+            sequence, lease = self.claim()
+            if sequence is None:
+                if not lease:
+                    return
+                self.stop.wait(self.poll_interval)
+                continue
+            lease.start_heartbeat()
+            try:
+                convert_sequence(self.path, sequence, *self.sequence_args, **self.sequence_kwargs)
+            except (VideoConversionError, OSError) as exc:
+                logger.error(
+                    "Conversion of sequence %s failed: %s",
+                    sanitize_for_log(sequence),
+                    sanitize_for_log(exc),
+                )
+                with self._lock:
+                    self.failed.append(sequence)
+            else:
+                with self._lock:
+                    self.converted.append(sequence)
             finally:
-                if concat_path:
-                    cleanup_tracked_path(concat_path, "temporary concat file", unregister_temp_file)
-                # Skip partial cleanup when the output is finalized
-                # or resume has skipped the sequence.
-                if partial_destination and not conversion_successful:
-                    cleanup_tracked_path(
-                        partial_destination, "partial output", unregister_partial_output
-                    )
-        except VideoConversionError:
-            raise
-        except (OSError, IndexError, AttributeError, subprocess.SubprocessError) as exc:
-            raise VideoConversionError(
-                f"Error processing sequence '{sequence}' in '{path}': {exc}"
-            ) from exc
+                lease.release()
+
+    def run(self):
+        videostofolders(
+            scan_loose_chapters(self.path),
+            self.path,
+            link=self.link,
+            options_hash=sequence_options_hash(*self.sequence_args, **self.sequence_kwargs),
+        )
+        threads = [
+            Thread(target=self._drain, name=f"worker-{index}", daemon=True)
+            for index in range(self.jobs)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logger.info(
+            "Worker finished: %d sequence(s) converted, %d failed.",
+            len(self.converted),
+            len(self.failed),
+        )
+        return self.converted, self.failed
+
+
+def work_shared_folder(
+    path,
+    options,
+    bitratemodifier,
+    mbits_max,
+    ratio_max,
+    convert,
+    jobs=1,
+    lease_ttl=LEASE_TTL,
+    poll_interval=WORKER_POLL_INTERVAL,
+    stop=None,
+    link=False,
+    **sequence_kwargs,
+):
+    """Run this node as one --worker on a folder that other nodes convert too.
+
+    Returns the (converted, failed) sequences. ``sequence_kwargs`` are passed to
+    convert_sequence, as convertVideos does.
+    """
+    validate_conversion_settings(
+        jobs, sequence_kwargs.get("chunks", 1), sequence_kwargs.get("segment_duration")
+    )
+    sequence_args = (options, bitratemodifier, mbits_max, ratio_max, convert)
+    worker = LeaseWorker(
+        path, sequence_args, sequence_kwargs, jobs, lease_ttl, poll_interval, stop, link
+    )
+    return worker.run()
 
 
-def getOptions(codec, accelerator):
+def getOptions(codec, accelerator, profile=None, threads=None):
+    """Return the encoder options for ``codec`` on ``accelerator``.
 
-    options = ""
+    ``profile`` (cpu only) adds the CPU_ENCODER_PROFILES tuning, and ``threads``
+    caps the encoder's thread pool so parallel jobs do not oversubscribe the CPU.
+    """
+
+    options = []
     if accelerator == "qsv":
         if codec == "h265":
-            options = "-init_hw_device qsv=hw -c copy -c:v hevc_qsv -extbrc 1 -refs 20 -bf 7"
-        elif codec == "h264":
-            options = "-init_hw_device qsv=hw -c copy -c:v h264_qsv"
-    elif accelerator == "cpu":
-        if codec == "h265":
-            options = "-c copy -c:v libx265"
+            options = [
+                "-init_hw_device",
+                "qsv=hw",
+                "-c",
+                "copy",
+                "-c:v",
+                "hevc_qsv",
+                "-extbrc",
+                "1",
+                "-refs",
+                "20",
+                "-bf",
+                "7",
+            ]
         elif codec == "h264":
-            options = "-c copy -c:v libx264"
+            options = ["-init_hw_device", "qsv=hw", "-c", "copy", "-c:v", "h264_qsv"]
+    elif accelerator == "cpu" and codec in CPU_ENCODERS:
+        encoder = CPU_ENCODERS[codec]
+        options = ["-c", "copy", "-c:v", encoder]
+        tuning = list(CPU_ENCODER_PROFILES[profile][encoder]) if profile else []
+        if threads and encoder == "libx265":
+            pools = f"pools={threads}"
+            if tuning:
+                tuning[1] = f"{tuning[1]}:{pools}"
+            else:
+                tuning = ["-x265-params", pools]
+        elif threads:
+            options += ["-threads", str(threads)]
+        options += tuning
 
     if not options:
         raise VideoConversionError(
             f"Unsupported codec/accelerator combination: {codec}/{accelerator}"
         )
+    if profile and accelerator != "cpu":
+        raise VideoConversionError(f"--profile {profile} only applies to the cpu accelerator")
 
     return options
 
 
-if __name__ == "__main__":
-    if sys.version_info < (3, 10):  # noqa: UP036 — runtime guard for direct script execution
-        print("Error: Python 3.10 or later is required.", file=sys.stderr)
-        sys.exit(1)
+def encoder_threads(jobs):
+    """Split the CPUs between ``jobs`` parallel encoders; None leaves the encoder default."""
+    if jobs <= 1:
+        return None
+    return max(1, (os.cpu_count() or 1) // jobs)
+
+
+def without_thread_caps(options):
+    """Return ``options`` without the thread caps getOptions adds.
+
+    The caps depend on --jobs and the CPU count, not on the output, so they are left
+    out of ledger, segment manifest and archive identities.
+    """
+    stripped = []
+    arguments_iter = iter(options)
+    for option in arguments_iter:
+        if option == "-threads":
+            next(arguments_iter, None)
+            continue
+        if option == "-x265-params":
+            params = next(arguments_iter, "")
+            kept = ":".join(
+                param for param in params.split(":") if param and not param.startswith("pools=")
+            )
+            if kept:
+                stripped += [option, kept]
+            continue
+        stripped.append(option)
+    return stripped
+
+
+async def run_command_async(command, context="command execution", progress=None):
+    """asyncio counterpart of run_command built on asyncio.create_subprocess_exec.
+
+    Cancelling the awaiting task terminates the child and waits for it to exit.
+    """
+
+    argv = command_argv(command)
+    check_not_cancelled(context)
+
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *argv, stdout=None if progress is None else asyncio.subprocess.PIPE
+        )
+    except FileNotFoundError as exc:
+        raise VideoConversionError(
+            f"Executable '{argv[0]}' not available during {context}: {exc}"
+        ) from exc
+
+    register_process(process)
+    try:
+        if progress is not None:
+            async for line in process.stdout:
+                progress.feed_line(line.decode(errors="replace"))
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        with contextlib.suppress(ProcessLookupError):
+            process.terminate()
+        await process.wait()
+        raise
+    finally:
+        unregister_process(process)
+
+    if progress is not None:
+        progress.finish(returncode)
+
+    if returncode != 0:
+        exc = subprocess.CalledProcessError(returncode, argv)
+        raise VideoConversionError(f"Command failed during {context}: {exc}") from exc
+
+
+async def encode_sequence_plan_async(plan, preset_tuner=None):
+    """asyncio counterpart of encode_sequence_plan.
+
+    Single-pass encodes and stream copies run through run_command_async; chunked and
+    segmented encodes and preset tuning keep their worker threads.
+    """
+
+    if plan.convert and (plan.segments or plan.chunk_boundaries or preset_tuner is not None):
+        await asyncio.to_thread(encode_sequence_plan, plan, preset_tuner)
+        return
+
+    with staged_encode(plan) as (concat_path, read_ahead):
+        # Waiting for a device reader slot must not block the event loop.
+        await asyncio.to_thread(read_ahead.start)
+        await run_command_async(
+            encode_command(plan, concat_path),
+            plan.context,
+            progress=ProgressMonitor(plan.sequence, plan.duration, listener=read_ahead.advance),
+        )
+
+
+class Converter:
+    """asyncio API for converting the sequence folders of one videos folder.
+
+    ``plan`` probes a sequence and returns its SequencePlan (None when it is skipped),
+    ``execute`` encodes and finalizes a plan, and ``convert`` does both for several
+    sequences, running at most ``max_concurrency`` of them at a time. The remaining
+    keyword arguments are those of prepare_sequence. Each execution tracks its files
+    and child processes in its own ArtifactTracker: cancelling it stops its ffmpeg and
+    removes its partial outputs without touching other jobs. A Converter installs no
+    signal handlers; the job ledger, caches and exiftool daemon are used when the
+    caller configured them.
+    """
+
+    def __init__(
+        self,
+        path,
+        options,
+        bitratemodifier=0.12,
+        mbits_max=25,
+        ratio_max=0.70,
+        convert=True,
+        max_concurrency=1,
+        **sequence_kwargs,
+    ):
+        if sequence_kwargs.get("dry_run"):
+            raise VideoConversionError("Converter cannot dry-run; print plan() results instead")
+        validate_conversion_settings(
+            max_concurrency,
+            sequence_kwargs.get("chunks", 1),
+            sequence_kwargs.get("segment_duration"),
+        )
+        self.path = path
+        self.sequence_args = (options, bitratemodifier, mbits_max, ratio_max, convert)
+        self.sequence_kwargs = sequence_kwargs
+        self.preset_tuner = sequence_kwargs.get("preset_tuner")
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._trackers = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_exc_info):
+        await self.aclose()
+
+    async def plan(self, sequence):
+        """Probe ``sequence`` and return its SequencePlan, or None when it is skipped."""
+        return await asyncio.to_thread(
+            run_sequence_step,
+            self.path,
+            sequence,
+            prepare_sequence,
+            self.path,
+            sequence,
+            *self.sequence_args,
+            **self.sequence_kwargs,
+        )
+
+    async def execute(self, plan):
+        """Encode ``plan`` and move its output into place once a concurrency slot is free."""
+        async with self._slots:
+            await self._execute(plan)
+
+    async def _execute(self, plan):
+        tracker = ArtifactTracker()
+        self._trackers.add(tracker)
+        record_sequence_start(plan)
+        try:
+            with use_tracker(tracker):
+                try:
+                    await encode_sequence_plan_async(plan, self.preset_tuner)
+                    await asyncio.to_thread(finish_sequence_plan, plan)
+                except SEQUENCE_STEP_ERRORS as exc:
+                    raise sequence_step_error(self.path, plan.sequence, exc) from exc
+        except BaseException as exc:
+            # Thread-backed steps may still be running: stop their commands, then clean up.
+            tracker.cancel()
+            tracker.cleanup()
+            record_sequence_result(plan, exc)
+            raise
+        finally:
+            self._trackers.discard(tracker)
+        record_sequence_result(plan)
+
+    async def _convert_sequence(self, sequence):
+        async with self._slots:
+            plan = await self.plan(sequence)
+            if plan is not None:
+                await self._execute(plan)
+
+    async def convert(self, sequences=None):
+        """Plan and execute ``sequences`` (default: every sequence folder).
+
+        Returns a dict mapping each failed sequence to its error. Cancelling the call
+        cancels every sequence that is still running.
+        """
+        if sequences is None:
+            sequences = await asyncio.to_thread(list_sequence_folders, self.path)
+        results = await asyncio.gather(
+            *(self._convert_sequence(sequence) for sequence in sequences),
+            return_exceptions=True,
+        )
+        failures = {}
+        for sequence, result in zip(sequences, results, strict=True):
+            if isinstance(result, Exception):
+                logger.error(
+                    "Sequence %s failed: %s", sanitize_for_log(sequence), sanitize_for_log(result)
+                )
+                failures[sequence] = result
+            elif isinstance(result, BaseException):
+                raise result
+        return failures
+
+    async def aclose(self):
+        """Stop every running execution and remove its partial outputs."""
+        for tracker in list(self._trackers):
+            tracker.cancel()
+            tracker.cleanup()
+
 
+def main(argv=None):
+    """Run the command line interface; returns the process exit code."""
     try:
         configure_logging()
         reset_signal_state()
         configure_signal_handlers()
-        args = arguments()
+        args = arguments(argv)
 
         # Validate that the videos path exists and is a directory
         videos_path = args["videos"]
         sanitized_path = sanitize_for_log(videos_path)
         if not os.path.exists(videos_path):
             logger.error("The specified path does not exist: %s", sanitized_path)
-            sys.exit(1)
+            return 1
         if not os.path.isdir(videos_path):
             logger.error("The specified path is not a directory: %s", sanitized_path)
-            sys.exit(1)
+            return 1
 
-        try:
-            contents = os.listdir(args["videos"])
-            contents.sort()
-        except OSError as exc:
-            raise VideoConversionError(
-                f"Unable to list contents of '{videos_path}': {exc}"
-            ) from exc
+        ledger_path = os.path.join(videos_path, JOB_LEDGER_FILENAME)
+        if args["status"]:
+            if not os.path.exists(ledger_path):
+                print(f"No job ledger in {videos_path}")
+                return 0
+            print(format_ledger_status(JobLedger(ledger_path)))
+            return 0
 
-        # videostofolders now returns the list of sequences
-        sequences = videostofolders(contents, args["videos"])
+        if args["watch"] and args["plan"]:
+            logger.error("--watch cannot be combined with --plan")
+            return 1
+        if args["worker"] and (args["watch"] or args["plan"]):
+            logger.error("--worker cannot be combined with --watch or --plan")
+            return 1
+        if args["lease_ttl"] <= 0:
+            logger.error("--lease-ttl must be positive")
+            return 1
+        # Outputs are named after the first chapter, so with --link they would replace
+        # the loose source that the folder's link points at.
+        if args["link"] and (
+            not args["output"] or os.path.realpath(args["output"]) == os.path.realpath(videos_path)
+        ):
+            logger.error("--link requires an --output directory other than the videos folder")
+            return 1
+
+        if not args["no_probe_cache"]:
+            configure_source_cache(open_source_cache(args["probe_cache"]))
+        # The organizer already consults the archive index, so it is opened first.
+        if args["dedupe"]:
+            configure_archive_index(ArchiveIndex(args["archive_index"]))
+
+        options = getOptions(
+            args["codec"],
+            args["accelerator"],
+            profile=args["profile"],
+            threads=(
+                encoder_threads(args["jobs"] * args["chunks"])
+                if args["accelerator"] == "cpu"
+                else None
+            ),
+        )
+        preset = args["preset"] or (
+            CPU_ENCODER_PROFILES[args["profile"]]["preset"] if args["profile"] else DEFAULT_PRESET
+        )
 
-        # Skip conversion if there are no sequences to process
-        if not sequences:
-            logger.info("No video sequences to convert. Exiting.")
-            sys.exit(0)
+        for directory in (args["output"], args["scratch"]):
+            if directory and not args["plan"]:
+                try:
+                    os.makedirs(directory, exist_ok=True)
+                except OSError as exc:
+                    raise VideoConversionError(
+                        f"Unable to create directory '{directory}': {exc}"
+                    ) from exc
 
-        options = getOptions(args["codec"], args["accelerator"])
+        for cap in ("max_height", "max_fps", "thumbnails"):
+            if args[cap] is not None and args[cap] <= 0:
+                logger.error("--%s must be positive", cap.replace("_", "-"))
+                return 1
+        if args["device_readers"] < 0:
+            logger.error("--device-readers must be 0 or more")
+            return 1
+        configure_device_readers(args["device_readers"] or None)
+        # --plan only reads an existing ledger so it leaves the folder untouched. Workers
+        # skip it: SQLite locking is not reliable on network filesystems.
+        if not args["worker"] and (not args["plan"] or os.path.exists(ledger_path)):
+            configure_job_ledger(JobLedger(ledger_path))
+        configure_progress_board(ProgressBoard(args["status_file"], args["progress_interval"]))
+        if not args["no_exiftool_daemon"] and not args["plan"]:
+            configure_exiftool_session(ExifToolSession())
+        segment_duration = args["segment_duration"] if args["resumable"] else None
+        preset_tuner = None
+        if args["auto_preset"]:
+            preset_tuner = PresetTuner(args["quality_metric"], args["quality_floor"])
 
-        convertVideos(
-            args["videos"],
+        sequence_args = (
             options,
             args["bitratemodifier"],
             args["mbits_max"],
             args["ratio_max"],
             args["convert"],
-            resume=args["resume"],
-            sequences=sequences,
         )
+        sequence_kwargs = {
+            "codec": args["codec"],
+            "auto_copy": not args["force_encode"],
+            "chunks": args["chunks"],
+            "preset": preset,
+            "preset_tuner": preset_tuner,
+            "segment_duration": segment_duration,
+            "output_dir": args["output"],
+            "scratch_dir": args["scratch"],
+            "max_height": args["max_height"],
+            "max_fps": args["max_fps"],
+            "complexity": args["complexity"],
+            "proxy": args["proxy"],
+            "thumbnail_interval": args["thumbnails"],
+        }
+
+        sequences = None
+        if not args["watch"] and not args["worker"]:
+            sequences = videostofolders(
+                scan_loose_chapters(args["videos"]),
+                args["videos"],
+                dry_run=args["plan"],
+                link=args["link"],
+                options_hash=sequence_options_hash(*sequence_args, **sequence_kwargs),
+            )
+
+            # Skip conversion if there are no sequences to process
+            if not sequences:
+                logger.info("No video sequences to convert. Exiting.")
+                return 0
+
+        try:
+            if args["watch"]:
+                watch_videos(
+                    args["videos"],
+                    *sequence_args,
+                    quiet_period=args["quiet_period"],
+                    jobs=args["jobs"],
+                    link=args["link"],
+                    resume=args["resume"],
+                    **sequence_kwargs,
+                )
+            elif args["worker"]:
+                _, failed = work_shared_folder(
+                    args["videos"],
+                    *sequence_args,
+                    jobs=args["jobs"],
+                    lease_ttl=args["lease_ttl"],
+                    link=args["link"],
+                    **sequence_kwargs,
+                )
+                if failed:
+                    raise VideoConversionError(
+                        f"{len(failed)} sequence(s) failed: {', '.join(failed)}"
+                    )
+            else:
+                convertVideos(
+                    args["videos"],
+                    *sequence_args,
+                    resume=args["resume"],
+                    sequences=sequences,
+                    jobs=args["jobs"],
+                    dry_run=args["plan"],
+                    **sequence_kwargs,
+                )
+        finally:
+            if _EXIFTOOL_SESSION is not None:
+                _EXIFTOOL_SESSION.close()
+            report_source_cache()
     except VideoConversionError as exc:
         logger.error("Conversion halted: %s", sanitize_for_log(exc))
-        sys.exit(1)
+        return 1
     except (OSError, PermissionError) as exc:
         logger.error("Filesystem error during processing: %s", sanitize_for_log(exc))
-        sys.exit(1)
+        return 1
     except KeyboardInterrupt:
         logger.info("Operation cancelled by user (Ctrl+C).")
-        sys.exit(1)
+        return 1
     except Exception as exc:
         logger.exception("Unexpected error: %s", sanitize_for_log(exc))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    if sys.version_info < (3, 10):  # noqa: UP036 — runtime guard for direct script execution
+        print("Error: Python 3.10 or later is required.", file=sys.stderr)
         sys.exit(1)
+
+    sys.exit(main())